@@ -0,0 +1,160 @@
+# filename: asset_bundle.py
+"""
+预打包资源：把全部底图与置顶图层预先转换为原始 RGBA 像素存入单个文件，
+加载时用 mmap 映射并以 Image.frombuffer 直接包装，不解码、不复制，多个进程共享页缓存。
+
+用法：python asset_bundle.py [-c config.yaml] [-o assets.bundle]
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+from config_loader import Config, load_config
+
+# 文件结构：MAGIC | 头部长度(uint32 LE) | JSON 头部 | 按页对齐的各图像像素数据
+MAGIC = b"ANANBDL1"
+_ALIGN = 4096
+
+# (mtime_ns, size)，文件不存在时为 None
+Fingerprint = Optional[Tuple[int, int]]
+
+
+def file_fingerprint(path: str) -> Fingerprint:
+    """返回文件的 (修改时间, 大小) 指纹，文件不存在时返回 None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class BundleEntry(NamedTuple):
+    """打包文件中的一张图像"""
+
+    name: str
+    """图像名称（配置中的文件路径）"""
+    size: Tuple[int, int]
+    """图像尺寸"""
+    offset: int
+    """像素数据在文件中的偏移"""
+    length: int
+    """像素数据长度"""
+    source: Fingerprint
+    """打包时源文件的指纹"""
+
+
+def build_bundle(paths: List[str], out_path: str) -> List[BundleEntry]:
+    """
+    解码 paths 中的全部图像并写入打包文件。先写临时文件再替换，保证读取方不会看到半成品。
+    """
+    decoded: List[Tuple[str, Image.Image, Fingerprint]] = []
+    for path in paths:
+        with Image.open(path) as im:
+            decoded.append((path, im.convert("RGBA"), file_fingerprint(path)))
+
+    # 先用占位偏移算出头部长度，再确定数据起始位置
+    def header_bytes(entries: List[BundleEntry]) -> bytes:
+        return json.dumps([e._asdict() for e in entries], ensure_ascii=False).encode("utf-8")
+
+    entries = [
+        BundleEntry(name, img.size, 0, img.width * img.height * 4, fp)
+        for name, img, fp in decoded
+    ]
+    # 偏移的位数会影响头部长度，预留足够大的占位值
+    probe = [e._replace(offset=10 ** 12) for e in entries]
+    data_start = _align(len(MAGIC) + 4 + len(header_bytes(probe)))
+
+    offset = data_start
+    for i, e in enumerate(entries):
+        entries[i] = e._replace(offset=offset)
+        offset = _align(offset + e.length)
+
+    header = header_bytes(entries)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for e, (_, img, _) in zip(entries, decoded):
+            f.seek(e.offset)
+            f.write(img.tobytes("raw", "RGBA"))
+        f.truncate(offset)
+    os.replace(tmp_path, out_path)
+    return entries
+
+
+def _align(n: int) -> int:
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class AssetBundle:
+    """
+    只读映射的打包资源。images 中的图像直接引用映射内存（只读），
+    渲染函数会先复制底图再绘制，因此可以安全地在多处共享。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"不是有效的资源打包文件: {path}")
+        (header_len,) = struct.unpack_from("<I", self._mm, len(MAGIC))
+        start = len(MAGIC) + 4
+        raw = json.loads(self._mm[start : start + header_len].decode("utf-8"))
+
+        self.entries: Dict[str, BundleEntry] = {}
+        self.images: Dict[str, Image.Image] = {}
+        view = memoryview(self._mm)
+        for item in raw:
+            entry = BundleEntry(
+                item["name"],
+                tuple(item["size"]),
+                item["offset"],
+                item["length"],
+                tuple(item["source"]) if item["source"] else None,
+            )
+            self.entries[entry.name] = entry
+            buf = view[entry.offset : entry.offset + entry.length]
+            self.images[entry.name] = Image.frombuffer(
+                "RGBA", entry.size, buf, "raw", "RGBA", 0, 1
+            )
+
+    def is_fresh(self, name: str) -> bool:
+        """打包后源文件没有变化时返回 True"""
+        entry = self.entries.get(name)
+        return entry is not None and file_fingerprint(name) == entry.source
+
+    def fresh_images(self) -> Dict[str, Image.Image]:
+        """返回源文件未变化的图像"""
+        return {name: img for name, img in self.images.items() if self.is_fresh(name)}
+
+
+def build_bundle_for_config(config: Config, out_path: str) -> List[BundleEntry]:
+    """打包配置中引用的全部底图与置顶图层（跳过不存在的文件）"""
+    paths = [p for p in config.asset_paths() if os.path.isfile(p)]
+    return build_bundle(paths, out_path)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="将底图与置顶图层预打包为可内存映射的资源文件")
+    parser.add_argument("-c", "--config", default="config.yaml", help="配置文件路径")
+    parser.add_argument(
+        "-o", "--output", default=None, help="输出路径，默认使用配置中的 asset_bundle_file 或 assets.bundle"
+    )
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    out_path = args.output or config.asset_bundle_file or "assets.bundle"
+    entries = build_bundle_for_config(config, out_path)
+    total = sum(e.length for e in entries)
+    print(f"已打包 {len(entries)} 张图像（{total / 1024 / 1024:.1f} MiB）到 {out_path}")
+
+
+if __name__ == "__main__":
+    main()
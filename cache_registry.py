@@ -0,0 +1,87 @@
+# filename: cache_registry.py
+"""
+进程内缓存登记表：各模块把自己的缓存连同声明的容量上限登记在这里，
+长时间运行测试（tools/soak.py）与诊断时据此检查缓存是否超出上限。
+"""
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+
+class CacheStats(NamedTuple):
+    """缓存的当前占用"""
+
+    entries: int
+    """条目数"""
+    bytes: Optional[int] = None
+    """估算的字节数，无法估算时为 None"""
+
+
+class CacheInfo(NamedTuple):
+    """登记的缓存及其当前占用"""
+
+    name: str
+    """缓存名称（模块.缓存）"""
+    description: str
+    """说明"""
+    entries: int
+    """当前条目数"""
+    bytes: Optional[int]
+    """当前估算字节数"""
+    max_entries: Optional[int]
+    """声明的条目数上限，None 表示不限"""
+    max_bytes: Optional[int]
+    """声明的字节数上限，None 表示不限"""
+
+    @property
+    def over_limit(self) -> bool:
+        """当前占用是否超出声明的上限"""
+        if self.max_entries is not None and self.entries > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.bytes is not None and self.bytes > self.max_bytes
+
+
+class _Registration(NamedTuple):
+    stats: Callable[[], CacheStats]
+    max_entries: Optional[int]
+    max_bytes: Optional[int]
+    description: str
+
+
+_caches: Dict[str, _Registration] = {}
+_lock = threading.Lock()
+
+
+def register_cache(
+    name: str,
+    stats: Callable[[], CacheStats],
+    max_entries: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    description: str = "",
+) -> None:
+    """
+    登记一个缓存。同名缓存重复登记时以最后一次为准。
+
+    : param stats: 返回当前占用的函数，会在任意线程中被调用
+    : param max_entries: 声明的条目数上限
+    : param max_bytes: 声明的字节数上限
+    """
+    with _lock:
+        _caches[name] = _Registration(stats, max_entries, max_bytes, description)
+
+
+def cache_report() -> List[CacheInfo]:
+    """返回全部已登记缓存的当前占用（按名称排序）"""
+    with _lock:
+        items = sorted(_caches.items())
+    report = []
+    for name, reg in items:
+        stats = reg.stats()
+        report.append(
+            CacheInfo(name, reg.description, stats.entries, stats.bytes, reg.max_entries, reg.max_bytes)
+        )
+    return report
+
+
+def caches_over_limit() -> List[CacheInfo]:
+    """返回当前占用超出声明上限的缓存"""
+    return [info for info in cache_report() if info.over_limit]
@@ -1,7 +1,11 @@
 import os
 import yaml
-from typing import Dict, Any, Tuple, List
-from pydantic import BaseModel
+from typing import Dict, Any, Tuple, List, Union
+from pydantic import BaseModel, model_validator
+
+
+def _normalize_path(path: str) -> str:
+    return path.replace("\\", os.sep)
 
 
 class Config(BaseModel):
@@ -24,6 +28,8 @@ class Config(BaseModel):
     """操作延时（秒）"""
     font_file: str = "font.ttf"
     """字体文件路径"""
+    fallback_font_files: List[str] = []
+    """后备字体文件路径列表，主字体缺少的字符（如 emoji、生僻字）依次从这些字体中查找"""
     baseimage_mapping: Dict[str, str] = {
         "#普通#": "BaseImages\\base.png"
     }
@@ -50,10 +56,98 @@ class Config(BaseModel):
     """表情切换快捷键映射"""
     text_wrap_algorithm: str = "original"
     """文本换行算法，可选值："original"(原始算法), "knuth_plass"(改进的Knuth-Plass算法)"""
+    max_font_height: int = 64
+    """文字的最大字号（像素），字号搜索只在该字号以下进行"""
+    image_resample: str = "lanczos"
+    """粘贴图片的缩放方式，可选值："lanczos"(质量最好), "fast"(先整数倍缩小再双线性插值，速度快数倍)"""
+    png_compress_level: int = 6
+    """输出 PNG 的压缩等级（0~9），等级越低编码越快、文件越大"""
+    hot_reload: bool = True
+    """是否在配置文件、字体或底图变化时自动重新加载"""
+    hot_reload_interval: float = 1.0
+    """检查文件变化的间隔（秒）"""
+    asset_bundle_file: str = ""
+    """预打包资源文件路径（由 asset_bundle.py 生成），留空表示直接读取各 PNG"""
+    text_min_font_size: int = 0
+    """最小可读字号，大于 0 时在该字号下仍放不下的长文本分成多张图片发送；0 表示不分页"""
+    render_scale: float = 1.0
+    """HiDPI 渲染倍数（如 1、1.5、2），坐标等仍按原始底图填写"""
+    render_deadline_ms: float = 0
+    """单次渲染的时限（毫秒），预计超时时降低排版与编码质量；0 表示不限制"""
+    render_cache: bool = False
+    """是否把纯文本消息的渲染结果保存在磁盘缓存中，相同的文字与差分再次出现时直接使用"""
+    render_cache_dir: str = os.path.join(".cache", "renders")
+    """渲染结果缓存目录"""
+    render_cache_max_bytes: int = 256 * 1024 * 1024
+    """渲染结果缓存的大小上限（字节），超出时删除最久未用的结果"""
+    profiles: Dict[str, str] = {}
+    """角色档案：角色名 -> 该角色的配置文件路径，供在同一进程中渲染多个角色"""
+    profile_assets_max_bytes: int = 256 * 1024 * 1024
+    """所有角色档案解码后的图像占用的内存上限（字节），超出时淘汰最久未用的图像"""
+    flight_recorder: bool = False
+    """是否记录最近的渲染请求（供 tools/replay_trace.py 重放）"""
+    flight_recorder_file: str = "flight_recorder.jsonl"
+    """渲染记录文件路径"""
+    flight_recorder_max_records: int = 500
+    """最多保留的记录条数"""
+    flight_recorder_max_bytes: int = 5 * 1024 * 1024
+    """记录文件大小上限（字节）"""
+    flight_recorder_redact_text: bool = True
+    """是否把记录中的文本替换为占位文本"""
 
     class Config:
         arbitrary_types_allowed = True
 
+    @model_validator(mode="after")
+    def _normalize_paths(self) -> "Config":
+        """把路径中的 \\ 换成当前系统的分隔符，Windows 风格的配置在其他系统上同样可用"""
+        self.font_file = _normalize_path(self.font_file)
+        self.fallback_font_files = [_normalize_path(p) for p in self.fallback_font_files]
+        self.baseimage_mapping = {k: _normalize_path(v) for k, v in self.baseimage_mapping.items()}
+        self.baseimage_file = _normalize_path(self.baseimage_file)
+        self.base_overlay_file = _normalize_path(self.base_overlay_file)
+        self.asset_bundle_file = _normalize_path(self.asset_bundle_file)
+        self.render_cache_dir = _normalize_path(self.render_cache_dir)
+        self.profiles = {k: _normalize_path(v) for k, v in self.profiles.items()}
+        self.flight_recorder_file = _normalize_path(self.flight_recorder_file)
+        return self
+
+    def resolve_paths(self, base_dir: str) -> "Config":
+        """
+        返回把底图、置顶图层与字体的相对路径改为相对 base_dir 的副本，
+        用于从其他目录读取的配置文件（如角色档案）。绝对路径与空路径保持不变。
+        """
+
+        def resolve(path: str) -> str:
+            return os.path.join(base_dir, path) if path and not os.path.isabs(path) else path
+
+        return self.model_copy(
+            update={
+                "font_file": resolve(self.font_file),
+                "fallback_font_files": [resolve(p) for p in self.fallback_font_files],
+                "baseimage_mapping": {k: resolve(v) for k, v in self.baseimage_mapping.items()},
+                "baseimage_file": resolve(self.baseimage_file),
+                "base_overlay_file": resolve(self.base_overlay_file),
+            }
+        )
+
+    def font_spec(self) -> Union[str, Tuple[str, ...]]:
+        """返回传给渲染函数的字体：没有后备字体时为字体路径，否则为 (主字体, 后备字体...)"""
+        if not self.fallback_font_files:
+            return self.font_file
+        return (self.font_file, *self.fallback_font_files)
+
+    def font_paths(self) -> List[str]:
+        """返回主字体与全部后备字体的路径"""
+        return [self.font_file, *self.fallback_font_files]
+
+    def asset_paths(self) -> List[str]:
+        """返回所有底图与置顶图层的文件路径（去重，顺序固定）"""
+        paths = dict.fromkeys(self.baseimage_mapping.values())
+        paths[self.baseimage_file] = None
+        paths[self.base_overlay_file] = None
+        return list(paths)
+
 
 def load_config(config_file: str = "config.yaml") -> Config:
     """
@@ -0,0 +1,283 @@
+# filename: dib_decode.py
+"""
+剪贴板 DIB（设备无关位图）解析。
+
+剪贴板中的 CF_DIB / CF_DIBV5 数据只有信息头、可选的颜色掩码与调色板以及像素数据，
+没有 BMP 文件头。这里直接按信息头计算像素数据的位置，用 Image.frombuffer 包装剪贴板缓冲区，
+不拼接文件头也不复制整段数据；像素布局与 Pillow 内部格式一致时（8 位调色板、RGBA 字节序）
+图像直接引用缓冲区，其余格式在一次解包中转换。
+
+只依赖 Pillow，可在任意平台上用构造的 DIB 字节测试。
+"""
+import struct
+from io import BytesIO
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+
+from PIL import Image
+
+# 信息头长度 -> 名称
+HEADER_NAMES = {
+    12: "BITMAPCOREHEADER",
+    40: "BITMAPINFOHEADER",
+    52: "BITMAPV2INFOHEADER",
+    56: "BITMAPV3INFOHEADER",
+    108: "BITMAPV4HEADER",
+    124: "BITMAPV5HEADER",
+}
+
+BI_RGB = 0
+BI_RLE8 = 1
+BI_RLE4 = 2
+BI_BITFIELDS = 3
+BI_JPEG = 4
+BI_PNG = 5
+BI_ALPHABITFIELDS = 6
+
+Masks = Tuple[int, int, int, int]  # (R, G, B, A)
+
+# (位深, 掩码) -> (图像模式, Pillow 原始模式)
+_MASK_MODES: Dict[Tuple[int, Masks], Tuple[str, str]] = {
+    (32, (0xFF0000, 0xFF00, 0xFF, 0xFF000000)): ("RGBA", "BGRA"),
+    (32, (0xFF0000, 0xFF00, 0xFF, 0)): ("RGB", "BGRX"),
+    (32, (0xFF, 0xFF00, 0xFF0000, 0xFF000000)): ("RGBA", "RGBA"),
+    (32, (0xFF, 0xFF00, 0xFF0000, 0)): ("RGB", "RGBX"),
+    (32, (0xFF000000, 0xFF0000, 0xFF00, 0xFF)): ("RGBA", "ABGR"),
+    (32, (0xFF000000, 0xFF0000, 0xFF00, 0)): ("RGB", "XBGR"),
+    (32, (0xFF00, 0xFF0000, 0xFF000000, 0xFF)): ("RGBA", "ARGB"),
+    (24, (0xFF0000, 0xFF00, 0xFF, 0)): ("RGB", "BGR"),
+    (16, (0xF800, 0x7E0, 0x1F, 0)): ("RGB", "BGR;16"),
+    (16, (0x7C00, 0x3E0, 0x1F, 0)): ("RGB", "BGR;15"),
+}
+
+# 未使用掩码时各位深的默认布局
+_DEFAULT_MASKS: Dict[int, Masks] = {
+    32: (0xFF0000, 0xFF00, 0xFF, 0),
+    24: (0xFF0000, 0xFF00, 0xFF, 0),
+    16: (0x7C00, 0x3E0, 0x1F, 0),
+}
+
+_PALETTE_RAWMODES = {1: "P;1", 2: "P;2", 4: "P;4", 8: "P"}
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class DIBHeader(NamedTuple):
+    """解析后的 DIB 信息头"""
+
+    header_size: int
+    """信息头长度，决定头部版本（见 HEADER_NAMES）"""
+    width: int
+    """宽度（像素）"""
+    height: int
+    """高度（像素，始终为正）"""
+    top_down: bool
+    """行序：True 为自上而下，False 为自下而上（默认）"""
+    bit_count: int
+    """每像素位数"""
+    compression: int
+    """压缩方式（BI_*）"""
+    image_size: int
+    """头部记录的像素数据长度，未压缩时可能为 0"""
+    masks: Masks
+    """(R, G, B, A) 颜色掩码，未使用掩码时为该位深的默认布局"""
+    palette_offset: int
+    """调色板在数据中的偏移"""
+    palette_size: int
+    """调色板项数"""
+    palette_entry: int
+    """每个调色板项的字节数（CORE 头为 3，其余为 4）"""
+    pixel_offset: int
+    """像素数据在数据中的偏移"""
+
+    @property
+    def name(self) -> str:
+        return HEADER_NAMES.get(self.header_size, f"未知信息头({self.header_size})")
+
+    @property
+    def stride(self) -> int:
+        """每行字节数（按 4 字节对齐）"""
+        return ((self.width * self.bit_count + 31) // 32) * 4
+
+
+def parse_dib_header(data: Buffer) -> DIBHeader:
+    """
+    解析 DIB 信息头并计算调色板与像素数据的位置。
+
+    BITMAPINFOHEADER 使用 BI_BITFIELDS / BI_ALPHABITFIELDS 时颜色掩码紧跟在信息头之后；
+    V2 及以上的信息头自带掩码字段。数据格式无效时抛出 ValueError。
+    """
+    if len(data) < 12:
+        raise ValueError("DIB 数据过短。")
+    (header_size,) = struct.unpack_from("<I", data, 0)
+    if header_size not in HEADER_NAMES or len(data) < header_size:
+        raise ValueError(f"不支持的 DIB 信息头长度: {header_size}")
+
+    if header_size == 12:
+        width, height, _, bit_count = struct.unpack_from("<HHHH", data, 4)
+        compression, image_size, colors_used = BI_RGB, 0, 0
+        palette_entry = 3
+    else:
+        width, height, _, bit_count, compression, image_size = struct.unpack_from(
+            "<iiHHII", data, 4
+        )
+        (colors_used,) = struct.unpack_from("<I", data, 32)
+        palette_entry = 4
+
+    top_down = height < 0
+    height = abs(height)
+    if width <= 0 or height == 0:
+        raise ValueError(f"无效的 DIB 尺寸: {width}x{height}")
+
+    offset = header_size
+    masks = _DEFAULT_MASKS.get(bit_count, (0, 0, 0, 0))
+    if compression in (BI_BITFIELDS, BI_ALPHABITFIELDS):
+        if header_size >= 52:
+            r, g, b = struct.unpack_from("<III", data, 40)
+            a = struct.unpack_from("<I", data, 52)[0] if header_size >= 56 else 0
+        else:
+            count = 4 if compression == BI_ALPHABITFIELDS else 3
+            if len(data) < offset + 4 * count:
+                raise ValueError("DIB 颜色掩码不完整。")
+            r, g, b = struct.unpack_from("<III", data, offset)
+            a = struct.unpack_from("<I", data, offset + 12)[0] if count == 4 else 0
+            offset += 4 * count
+        masks = (r, g, b, a)
+    elif compression == BI_RGB and bit_count == 32 and header_size >= 56:
+        # V3 及以上的信息头即使不使用掩码压缩，也可以通过 alpha 掩码声明 alpha 通道
+        (a,) = struct.unpack_from("<I", data, 52)
+        if a == 0xFF000000:
+            masks = (0xFF0000, 0xFF00, 0xFF, a)
+
+    palette_size = 0
+    if bit_count <= 8:
+        palette_size = colors_used or (1 << bit_count)
+    palette_offset = offset
+    offset += palette_size * palette_entry
+
+    return DIBHeader(
+        header_size,
+        width,
+        height,
+        top_down,
+        bit_count,
+        compression,
+        image_size,
+        masks,
+        palette_offset,
+        palette_size,
+        palette_entry,
+        offset,
+    )
+
+
+def _decode_rle(data: memoryview, header: DIBHeader) -> bytearray:
+    """解码 RLE8 / RLE4 像素数据为每像素一字节的调色板索引（自上而下）"""
+    width, height = header.width, header.height
+    rle4 = header.compression == BI_RLE4
+    out = bytearray(width * height)
+    x = y = 0  # y 为自下而上的行号
+    pos = 0
+    end = len(data)
+
+    def put(index: int) -> None:
+        nonlocal x
+        if x < width and y < height:
+            out[(height - 1 - y) * width + x] = index
+        x += 1
+
+    while pos + 1 < end:
+        count, value = data[pos], data[pos + 1]
+        pos += 2
+        if count:
+            # 编码模式：重复 count 个像素
+            for i in range(count):
+                put(((value >> 4) if i % 2 == 0 else (value & 0x0F)) if rle4 else value)
+        elif value == 0:  # 行结束
+            x, y = 0, y + 1
+        elif value == 1:  # 位图结束
+            break
+        elif value == 2:  # 位移
+            if pos + 1 >= end:
+                break
+            x += data[pos]
+            y += data[pos + 1]
+            pos += 2
+        else:
+            # 绝对模式：后面跟 value 个未压缩像素，按 2 字节对齐
+            nbytes = (value + 1) // 2 if rle4 else value
+            for i in range(value):
+                j = pos + (i // 2 if rle4 else i)
+                byte = data[j] if j < end else 0
+                put(((byte >> 4) if i % 2 == 0 else (byte & 0x0F)) if rle4 else byte)
+            pos += nbytes + (nbytes & 1)
+    return out
+
+
+def decode_dib(data: Buffer) -> Image.Image:
+    """
+    把剪贴板中的 DIB 数据解码为 Pillow 图像。
+
+    未压缩的图像直接在原缓冲区上构造：8 位调色板与 RGBA 字节序的 32 位
+    图像不复制像素，直接引用 data（此时图像只读，data 需在使用期间保持有效）；
+    其余格式由 Pillow 从原缓冲区一次解包。带 alpha 掩码的 32 位图像返回 RGBA
+    （alpha 全为 0 时视为不透明，返回 RGB），调色板图像返回 P 模式，其余返回 RGB。
+
+    : param data: CF_DIB 或 CF_DIBV5 数据（bytes、bytearray 或 memoryview）
+    """
+    view = memoryview(data).cast("B")
+    header = parse_dib_header(view)
+    size = (header.width, header.height)
+
+    if header.compression in (BI_JPEG, BI_PNG):
+        # 内嵌的完整 JPEG / PNG 文件
+        length = header.image_size or len(view) - header.pixel_offset
+        image = Image.open(BytesIO(view[header.pixel_offset : header.pixel_offset + length]))
+        image.load()
+        return image
+
+    palette: Optional[bytes] = None
+    if header.palette_size:
+        start = header.palette_offset
+        palette = bytes(view[start : start + header.palette_size * header.palette_entry])
+
+    if header.compression in (BI_RLE8, BI_RLE4):
+        if header.top_down:
+            raise ValueError("RLE 压缩的 DIB 不能自上而下存储。")
+        length = header.image_size or len(view) - header.pixel_offset
+        indices = _decode_rle(view[header.pixel_offset : header.pixel_offset + length], header)
+        image = Image.frombuffer("P", size, indices, "raw", "P", 0, 1)
+    else:
+        if header.compression not in (BI_RGB, BI_BITFIELDS, BI_ALPHABITFIELDS):
+            raise ValueError(f"不支持的 DIB 压缩方式: {header.compression}")
+        if palette is not None:
+            if header.bit_count not in _PALETTE_RAWMODES:
+                raise ValueError(f"不支持的调色板位深: {header.bit_count}")
+            mode, rawmode = "P", _PALETTE_RAWMODES[header.bit_count]
+        else:
+            key = (header.bit_count, header.masks)
+            if key not in _MASK_MODES:
+                raise ValueError(
+                    f"不支持的 DIB 像素格式: {header.bit_count} 位，掩码 "
+                    + ", ".join(f"{m:#x}" for m in header.masks)
+                )
+            mode, rawmode = _MASK_MODES[key]
+
+        stride = header.stride
+        needed = stride * header.height
+        if len(view) < header.pixel_offset + needed:
+            raise ValueError("DIB 像素数据不完整。")
+        pixels = view[header.pixel_offset : header.pixel_offset + needed]
+        args = (rawmode, stride, 1 if header.top_down else -1)
+        if rawmode == mode:
+            # 布局与 Pillow 内部格式一致，图像直接引用缓冲区
+            image = Image.frombuffer(mode, size, pixels, "raw", *args)
+        else:
+            # frombuffer 会按原始模式映射，格式不同时改为从缓冲区解包
+            image = Image.frombytes(mode, size, pixels, "raw", *args)
+
+    if palette is not None:
+        image.putpalette(palette, "BGR" if header.palette_entry == 3 else "BGRX")
+    elif image.mode == "RGBA" and image.getchannel("A").getextrema() == (0, 0):
+        # 许多程序写入的 CF_DIBV5 声明了 alpha 掩码却不填写 alpha，按不透明图像处理
+        image = image.convert("RGB")
+    return image
@@ -0,0 +1,117 @@
+# filename: directive_parser.py
+import re
+from typing import Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from cache_registry import CacheStats, register_cache
+
+# 指令种类 -> {标签: 值}，例如 {"emotion": {"#开心#": "BaseImages\\开心.png"}}
+DirectiveTable = Mapping[str, Mapping[str, str]]
+
+
+class Directive(NamedTuple):
+    """文本中解析出的一条内联指令"""
+
+    kind: str
+    """指令种类，例如 "emotion" """
+    tag: str
+    """原文中出现的标签文本，例如 "#开心#" """
+    value: str
+    """标签对应的值，例如底图路径"""
+    start: int
+    """标签在原文中的起始偏移"""
+    end: int
+    """标签在原文中的结束偏移（不含）"""
+
+
+class ParsedInput(NamedTuple):
+    """解析结果：去除指令后的文本与按出现顺序排列的指令列表"""
+
+    text: str
+    directives: List[Directive]
+
+    def first(self, kind: str) -> Optional[Directive]:
+        """返回指定种类中最先出现的指令，没有则返回 None"""
+        for d in self.directives:
+            if d.kind == kind:
+                return d
+        return None
+
+
+class DirectiveParser:
+    """
+    由配置一次性编译出的内联指令解析器。
+
+    所有种类的全部标签被合并为一个正则（按长度降序的多选分支，保证最长匹配优先），
+    解析时对输入只做一次线性扫描，同时得到去除标签后的文本与结构化的指令列表。
+    """
+
+    def __init__(self, table: DirectiveTable):
+        self._lookup: Dict[str, Tuple[str, str]] = {}
+        for kind, mapping in table.items():
+            for tag, value in mapping.items():
+                # 同一标签出现在多个种类中时，以先声明的种类为准
+                if tag and tag not in self._lookup:
+                    self._lookup[tag] = (kind, value)
+
+        if self._lookup:
+            alternatives = sorted(self._lookup, key=len, reverse=True)
+            self._pattern: Optional[re.Pattern] = re.compile(
+                "|".join(re.escape(tag) for tag in alternatives)
+            )
+        else:
+            self._pattern = None
+
+    def parse(self, text: str) -> ParsedInput:
+        """
+        单次扫描解析文本，返回去除所有指令标签并 strip 后的文本和指令列表。
+        """
+        if self._pattern is None or not text:
+            return ParsedInput(text.strip(), [])
+
+        directives: List[Directive] = []
+        pieces: List[str] = []
+        pos = 0
+        for m in self._pattern.finditer(text):
+            tag = m.group(0)
+            kind, value = self._lookup[tag]
+            directives.append(Directive(kind, tag, value, m.start(), m.end()))
+            pieces.append(text[pos:m.start()])
+            pos = m.end()
+        pieces.append(text[pos:])
+        return ParsedInput("".join(pieces).strip(), directives)
+
+
+_parser_cache: Dict[tuple, DirectiveParser] = {}
+
+
+def _table_key(table: DirectiveTable) -> tuple:
+    return tuple((kind, tuple(mapping.items())) for kind, mapping in table.items())
+
+
+def directive_table_from_config(config) -> Dict[str, Dict[str, str]]:
+    """从配置对象构造指令表，目前只包含表情差分指令"""
+    return {"emotion": dict(config.baseimage_mapping)}
+
+
+def get_directive_parser(config) -> DirectiveParser:
+    """
+    获取与当前配置对应的解析器。
+
+    解析器按指令表内容缓存，只有配置中的相关字段发生变化时才会重新编译。
+    """
+    table = directive_table_from_config(config)
+    key = _table_key(table)
+    parser = _parser_cache.get(key)
+    if parser is None:
+        _parser_cache.clear()  # 只保留最新配置对应的解析器
+        parser = DirectiveParser(table)
+        _parser_cache[key] = parser
+    return parser
+
+
+register_cache(
+    "directive_parser.parser",
+    lambda: CacheStats(len(_parser_cache)),
+    max_entries=1,
+    description="当前配置对应的指令解析器",
+)
@@ -0,0 +1,289 @@
+# filename: flight_recorder.py
+"""
+渲染飞行记录仪：把最近 N 次渲染请求的输入特征与各阶段耗时写入本地 JSONL 文件，
+供 tools/replay_trace.py 用当前代码重放并统计延迟分位数，以真实使用情况评估优化效果。
+
+记录的内容：文本（可脱敏为保留排版特征的占位文本）、差分、粘贴图片的摘要与尺寸、
+配置指纹以及各阶段耗时。不记录图片像素。
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from config_loader import Config
+from image_fit_paste import image_digest
+
+
+def config_fingerprint(config: Config) -> str:
+    """配置内容的短摘要，用于区分记录产生时使用的配置"""
+    data = json.dumps(config.model_dump(mode="json"), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+
+
+# 影响换行与着色的字符，脱敏时原样保留
+_KEEP_CHARS = frozenset("[]【】")
+
+
+def _placeholder(ch: str) -> str:
+    if ch.isspace() or ch in _KEEP_CHARS:
+        return ch
+    if ch.isascii():
+        if ch.isdigit():
+            return "0"
+        return "n" if ch.isalpha() else "-"
+    if unicodedata.east_asian_width(ch) in ("W", "F"):
+        return "字"
+    return "é"
+
+
+def redact_text(text: str) -> str:
+    """
+    把文本替换为保留排版特征的占位文本：空白、换行与括号原样保留，
+    其余字符按类别替换为宽度相近的占位字符，重放时排版开销与原文接近。
+    """
+    return "".join(_placeholder(ch) for ch in text)
+
+
+class RenderTrace:
+    """一次渲染请求的分阶段计时"""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """统计 with 块的耗时（毫秒），同名阶段累加"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    @property
+    def elapsed_ms(self) -> float:
+        """从创建到现在经过的毫秒数"""
+        return (time.perf_counter() - self._start) * 1000
+
+
+class RenderRecord(NamedTuple):
+    """一条渲染记录"""
+
+    time: float
+    """记录时间（Unix 时间戳）"""
+    kind: str
+    """请求类型："text"、"image" 或 "mixed" """
+    text: str
+    """文本（脱敏时为占位文本）"""
+    redacted: bool
+    """text 是否已脱敏"""
+    emotion: Optional[str]
+    """差分名称，底图不在差分映射中时为 None"""
+    base_image: str
+    """底图路径"""
+    image_digest: Optional[str]
+    """粘贴图片的摘要，没有图片时为 None"""
+    image_size: Optional[Tuple[int, int]]
+    """粘贴图片的尺寸"""
+    image_mode: Optional[str]
+    """粘贴图片的模式"""
+    config_fingerprint: str
+    """配置指纹"""
+    timings: Dict[str, float]
+    """各阶段耗时（毫秒）"""
+    total_ms: float
+    """总耗时（毫秒）"""
+    output_bytes: int
+    """输出 PNG 的字节数，失败时为 0"""
+    degradations: Tuple[str, ...] = ()
+    """为满足渲染时限采用的降级措施"""
+
+    @property
+    def render_ms(self) -> float:
+        """渲染相关阶段的耗时之和，重放时与之比较"""
+        return sum(self.timings.values())
+
+    @classmethod
+    def from_json(cls, line: str) -> "RenderRecord":
+        data = json.loads(line)
+        for key in ("image_size", "degradations"):
+            if data.get(key) is not None:
+                data[key] = tuple(data[key])
+        return cls(**{field: data[field] for field in cls._fields if field in data})
+
+
+class FlightRecorder:
+    """
+    最近 max_records 条渲染记录的环形缓冲区，同步追加到 JSONL 文件。
+
+    文件中的记录数超过 max_records 的两倍，或再追加会超过 max_bytes 时，
+    用内存中的最近记录原子地重写文件（必要时继续丢弃最旧的记录），
+    因此文件大小始终不超过 max_bytes。重启后会从文件恢复最近的记录。
+    可在多个线程中同时记录。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_records: int = 500,
+        max_bytes: int = 5 * 1024 * 1024,
+        redact: bool = True,
+    ):
+        if max_records < 1 or max_bytes < 1:
+            raise ValueError("max_records 与 max_bytes 必须大于 0。")
+        self.path = path
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.redact = redact
+        self._lines: Deque[str] = deque(maxlen=max_records)
+        self._file_lines = 0
+        self._file_bytes = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.rstrip("\n")
+                    if line:
+                        self._lines.append(line)
+                        self._file_lines += 1
+            self._file_bytes = os.path.getsize(self.path)
+        except FileNotFoundError:
+            pass
+        except (OSError, UnicodeDecodeError) as e:
+            logging.warning("无法读取渲染记录 %s: %s", self.path, e)
+
+    def capture(
+        self,
+        trace: RenderTrace,
+        config: Config,
+        text: str,
+        image: Optional[Image.Image],
+        base_image: str,
+        output: Optional[bytes],
+        degradations: Sequence[str] = (),
+        content_digest: Optional[str] = None,
+        output_size: Optional[int] = None,
+    ) -> RenderRecord:
+        """
+        根据一次渲染的输入与结果生成记录并写入。content_digest 为渲染时已算好的图片摘要；
+        output_size 为输出的总字节数（分页时各页之和），为 None 时取 len(output)。
+        """
+        if image is not None and content_digest is None:
+            content_digest = image_digest(image)
+        if text and image is not None:
+            kind = "mixed"
+        elif image is not None:
+            kind = "image"
+        else:
+            kind = "text"
+        emotion = next(
+            (tag for tag, path in config.baseimage_mapping.items() if path == base_image),
+            None,
+        )
+        record = RenderRecord(
+            time=time.time(),
+            kind=kind,
+            text=redact_text(text) if self.redact else text,
+            redacted=self.redact,
+            emotion=emotion,
+            base_image=base_image,
+            image_digest=content_digest if image is not None else None,
+            image_size=image.size if image is not None else None,
+            image_mode=image.mode if image is not None else None,
+            config_fingerprint=config_fingerprint(config),
+            timings={k: round(v, 3) for k, v in trace.timings.items()},
+            total_ms=round(trace.elapsed_ms, 3),
+            output_bytes=output_size if output_size is not None else len(output or b""),
+            degradations=tuple(degradations),
+        )
+        self.record(record)
+        return record
+
+    def record(self, record: RenderRecord) -> None:
+        """追加一条记录"""
+        line = json.dumps(record._asdict(), ensure_ascii=False)
+        size = len(line.encode("utf-8")) + 1
+        with self._lock:
+            self._lines.append(line)
+            try:
+                if (
+                    self._file_lines >= 2 * self.max_records
+                    or self._file_bytes + size > self.max_bytes
+                ):
+                    self._rewrite()
+                else:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(line + "\n")
+                    self._file_lines += 1
+                    self._file_bytes += size
+            except OSError as e:
+                logging.warning("无法写入渲染记录 %s: %s", self.path, e)
+
+    def _rewrite(self) -> None:
+        # 从最新的记录往前保留，直到达到大小上限
+        kept: List[bytes] = []
+        total = 0
+        for line in reversed(self._lines):
+            data = line.encode("utf-8") + b"\n"
+            if total + len(data) > self.max_bytes:
+                break
+            kept.append(data)
+            total += len(data)
+        kept.reverse()
+        while len(self._lines) > len(kept):
+            self._lines.popleft()
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.writelines(kept)
+        os.replace(tmp_path, self.path)
+        self._file_lines = len(kept)
+        self._file_bytes = total
+
+    def records(self) -> List[RenderRecord]:
+        """返回内存中的全部记录（从旧到新）"""
+        with self._lock:
+            lines = list(self._lines)
+        return [RenderRecord.from_json(line) for line in lines]
+
+
+def load_records(path: str) -> List[RenderRecord]:
+    """读取记录文件，跳过无法解析的行"""
+    records: List[RenderRecord] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(RenderRecord.from_json(line))
+            except (ValueError, TypeError):
+                continue
+    return records
+
+
+def recorder_from_config(config: Config) -> Optional[FlightRecorder]:
+    """按配置创建记录仪，未启用时返回 None"""
+    if not config.flight_recorder:
+        return None
+    return FlightRecorder(
+        config.flight_recorder_file,
+        max_records=config.flight_recorder_max_records,
+        max_bytes=config.flight_recorder_max_bytes,
+        redact=config.flight_recorder_redact_text,
+    )
@@ -0,0 +1,273 @@
+# filename: font_fallback.py
+import hashlib
+import json
+import os
+import struct
+import threading
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+from PIL import ImageDraw, ImageFont
+
+from cache_registry import CacheStats, register_cache
+
+# 字符覆盖索引的磁盘缓存目录
+COVERAGE_CACHE_DIR = os.path.join(".cache", "font_coverage")
+
+_MAX_CODEPOINT = 0x110000
+
+Range = Tuple[int, int]  # [start, end]，两端都包含
+
+
+def _table_offset(data: bytes, tag: bytes) -> Optional[int]:
+    base = 0
+    if data[:4] == b"ttcf":
+        # 字体集合只使用第一个字体
+        (base,) = struct.unpack_from(">I", data, 12)
+    (num_tables,) = struct.unpack_from(">H", data, base + 4)
+    for i in range(num_tables):
+        rec = base + 12 + 16 * i
+        if data[rec : rec + 4] == tag:
+            (offset,) = struct.unpack_from(">I", data, rec + 8)
+            return offset
+    return None
+
+
+def _format4_ranges(data: bytes, off: int) -> List[Range]:
+    (seg_x2,) = struct.unpack_from(">H", data, off + 6)
+    seg = seg_x2 // 2
+    ends = struct.unpack_from(f">{seg}H", data, off + 14)
+    starts = struct.unpack_from(f">{seg}H", data, off + 16 + seg_x2)
+    deltas = struct.unpack_from(f">{seg}h", data, off + 16 + 2 * seg_x2)
+    ro_pos = off + 16 + 3 * seg_x2
+    range_offsets = struct.unpack_from(f">{seg}H", data, ro_pos)
+
+    ranges: List[Range] = []
+    for i in range(seg):
+        start, end, delta, ro = starts[i], ends[i], deltas[i], range_offsets[i]
+        if start == 0xFFFF:
+            continue
+        if ro == 0:
+            # 只有映射到字形 0 的那一个码位缺失
+            missing = (-delta) & 0xFFFF
+            if start <= missing <= end:
+                if start < missing:
+                    ranges.append((start, missing - 1))
+                if missing < end:
+                    ranges.append((missing + 1, end))
+            else:
+                ranges.append((start, end))
+            continue
+        run_start = None
+        for cp in range(start, end + 1):
+            pos = ro_pos + 2 * i + ro + 2 * (cp - start)
+            glyph = struct.unpack_from(">H", data, pos)[0] if pos + 2 <= len(data) else 0
+            if glyph:
+                glyph = (glyph + delta) & 0xFFFF
+            if glyph and run_start is None:
+                run_start = cp
+            elif not glyph and run_start is not None:
+                ranges.append((run_start, cp - 1))
+                run_start = None
+        if run_start is not None:
+            ranges.append((run_start, end))
+    return ranges
+
+
+def _format12_ranges(data: bytes, off: int) -> List[Range]:
+    (groups,) = struct.unpack_from(">I", data, off + 12)
+    ranges: List[Range] = []
+    for i in range(groups):
+        start, end, glyph = struct.unpack_from(">III", data, off + 16 + 12 * i)
+        if glyph == 0:
+            start += 1  # 首个码位映射到 .notdef
+        if start <= end:
+            ranges.append((start, min(end, _MAX_CODEPOINT - 1)))
+    return ranges
+
+
+def _merge(ranges: List[Range]) -> List[Range]:
+    merged: List[Range] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def read_cmap_ranges(font_path: str) -> List[Range]:
+    """
+    读取字体 cmap 表中所有 Unicode 子表，返回按码位排序、合并后的覆盖区间。
+    支持 format 4 与 format 12 子表（TrueType/OpenType 字体中最常见的两种）。
+    """
+    with open(font_path, "rb") as f:
+        data = f.read()
+    cmap = _table_offset(data, b"cmap")
+    if cmap is None:
+        return []
+    (num,) = struct.unpack_from(">H", data, cmap + 2)
+    ranges: List[Range] = []
+    seen = set()
+    for i in range(num):
+        platform, encoding, offset = struct.unpack_from(">HHI", data, cmap + 4 + 8 * i)
+        unicode = platform == 0 or (platform == 3 and encoding in (1, 10))
+        if not unicode or offset in seen:
+            continue
+        seen.add(offset)
+        sub = cmap + offset
+        (fmt,) = struct.unpack_from(">H", data, sub)
+        if fmt == 4:
+            ranges.extend(_format4_ranges(data, sub))
+        elif fmt == 12:
+            ranges.extend(_format12_ranges(data, sub))
+    return _merge(ranges)
+
+
+def _cache_path(font_path: str, cache_dir: str) -> str:
+    st = os.stat(font_path)
+    key = f"{os.path.abspath(font_path)}|{st.st_mtime_ns}|{st.st_size}"
+    return os.path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+
+def load_coverage_ranges(font_path: str, cache_dir: Optional[str] = COVERAGE_CACHE_DIR) -> List[Range]:
+    """
+    返回字体的覆盖区间，优先读取磁盘缓存（以路径、修改时间和大小为键），
+    没有缓存时解析 cmap 并写入缓存。cache_dir 为 None 时不使用磁盘缓存。
+    """
+    path = _cache_path(font_path, cache_dir) if cache_dir else None
+    if path and os.path.isfile(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return [tuple(r) for r in json.load(f)]  # type: ignore[misc]
+        except (OSError, ValueError):
+            pass
+    ranges = read_cmap_ranges(font_path)
+    if path:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)  # type: ignore[arg-type]
+            # 多个线程或进程可能同时写同一缓存，临时文件名各不相同
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(ranges, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass  # 缓存写入失败不影响使用
+    return ranges
+
+
+class FontCoverage:
+    """单个字体的码位覆盖位图，查询为 O(1)"""
+
+    def __init__(self, ranges: Sequence[Range]):
+        bits = bytearray(_MAX_CODEPOINT // 8)
+        for start, end in ranges:
+            # 区间两端不足一个字节的部分逐位设置，中间整字节填充
+            while start <= end and start % 8:
+                bits[start >> 3] |= 1 << (start & 7)
+                start += 1
+            while start <= end and (end + 1) % 8:
+                bits[end >> 3] |= 1 << (end & 7)
+                end -= 1
+            if start <= end:
+                bits[start >> 3 : (end >> 3) + 1] = b"\xff" * ((end - start + 1) >> 3)
+        self._bits = bytes(bits)
+
+    def __contains__(self, ch: str) -> bool:
+        cp = ord(ch)
+        return bool(self._bits[cp >> 3] & (1 << (cp & 7)))
+
+
+class FontChain:
+    """
+    按顺序排列的字体链。每个字符使用链中第一个覆盖它的字体；
+    所有字体都不覆盖时使用第一个字体（显示为缺字框，与单字体行为一致）。
+    """
+
+    def __init__(self, paths: Sequence[str], cache_dir: Optional[str] = COVERAGE_CACHE_DIR):
+        self.paths = tuple(paths)
+        self.coverages = [FontCoverage(load_coverage_ranges(p, cache_dir)) for p in self.paths]
+
+    def font_index(self, ch: str) -> int:
+        for i, cov in enumerate(self.coverages):
+            if ch in cov:
+                return i
+        return 0
+
+    def split_runs(self, text: str) -> List[Tuple[int, str]]:
+        """把文本拆分为 (字体序号, 片段) 列表，相邻同字体的字符合并为一个片段"""
+        runs: List[Tuple[int, str]] = []
+        start = 0
+        current = -1
+        for i, ch in enumerate(text):
+            # 空白与控制字符跟随前一个片段，避免无谓地切换字体
+            idx = current if (ch.isspace() and current >= 0) else self.font_index(ch)
+            if idx != current:
+                if i > start:
+                    runs.append((current, text[start:i]))
+                start, current = i, idx
+        if start < len(text):
+            runs.append((current, text[start:]))
+        return runs
+
+
+@lru_cache(maxsize=8)
+def get_font_chain(paths: Tuple[str, ...]) -> FontChain:
+    """同一组字体只构建一次覆盖索引"""
+    return FontChain(paths)
+
+
+register_cache(
+    "font_fallback.font_chain",
+    lambda: CacheStats(get_font_chain.cache_info().currsize),
+    max_entries=8,
+    description="字体链的码位覆盖索引（每个字体约 136 KiB）",
+)
+
+
+class ChainFont:
+    """
+    与 FreeTypeFont 接口兼容的字体链：测量与绘制时按字符覆盖拆分为多个片段，
+    分别交给对应的字体处理，所有片段共享同一条基线。
+    """
+
+    def __init__(self, chain: FontChain, size: int):
+        self.chain = chain
+        self.size = size
+        self.fonts = [ImageFont.truetype(p, size=size) for p in chain.paths]
+        self.path = chain.paths[0]
+        metrics = [f.getmetrics() for f in self.fonts]
+        self._ascent = max(a for a, _ in metrics)
+        self._descent = max(d for _, d in metrics)
+        self._offsets = [self._ascent - a for a, _ in metrics]
+
+    def getmetrics(self) -> Tuple[int, int]:
+        return self._ascent, self._descent
+
+    def getlength(self, text: str, *args, **kwargs) -> float:
+        return sum(
+            self.fonts[i].getlength(run, *args, **kwargs)
+            for i, run in self.chain.split_runs(text)
+        )
+
+    def getbbox(self, text: str, *args, **kwargs) -> Tuple[float, float, float, float]:
+        x = 0.0
+        box: Optional[List[float]] = None
+        for i, run in self.chain.split_runs(text):
+            font = self.fonts[i]
+            l, t, r, b = font.getbbox(run, *args, **kwargs)
+            dy = self._offsets[i]
+            if box is None:
+                box = [x + l, t + dy, x + r, b + dy]
+            else:
+                box = [min(box[0], x + l), min(box[1], t + dy), max(box[2], x + r), max(box[3], b + dy)]
+            x += font.getlength(run)
+        return tuple(box) if box else (0, 0, 0, 0)  # type: ignore[return-value]
+
+    def draw_text(self, draw: ImageDraw.ImageDraw, xy: Tuple[float, float], text: str, fill) -> None:
+        x, y = xy
+        for i, run in self.chain.split_runs(text):
+            font = self.fonts[i]
+            draw.text((x, y + self._offsets[i]), run, font=font, fill=fill)
+            x += draw.textlength(run, font=font)
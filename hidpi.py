@@ -0,0 +1,165 @@
+# filename: hidpi.py
+"""
+高分辨率（HiDPI）渲染：按缩放倍数（如 1.5、2）放大坐标、字号与边距，
+在高分屏上直接输出清晰的大图，而不是事后放大模糊的小图。
+
+底图与置顶图层按倍数预先缩放一次并缓存，之后每条消息只需复制缩放好的底图，
+2 倍渲染的开销约为 1 倍的 4 倍像素量，不会对底图重复解码或重采样。
+"""
+import threading
+import weakref
+from collections import OrderedDict, deque
+from io import BytesIO
+from typing import Callable, Deque, Dict, Hashable, Optional, Tuple, Union
+
+from PIL import Image
+
+from asset_bundle import file_fingerprint
+from cache_registry import CacheStats, register_cache
+
+# 预缩放资源缓存的字节数上限
+SCALED_ASSET_MAX_BYTES = 256 * 1024 * 1024
+
+Source = Union[str, BytesIO, Image.Image]
+
+
+def check_scale(scale: float) -> None:
+    if not scale > 0:
+        raise ValueError("scale 必须大于 0。")
+
+
+def scale_length(value: int, scale: float) -> int:
+    """按倍数缩放长度（四舍五入）"""
+    return int(round(value * scale))
+
+
+def scale_point(point: Tuple[int, int], scale: float) -> Tuple[int, int]:
+    """按倍数缩放坐标（四舍五入）"""
+    return scale_length(point[0], scale), scale_length(point[1], scale)
+
+
+def _image_bytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+class ScaledAssetCache:
+    """
+    底图与置顶图层按倍数缩放后的 LRU 缓存，总字节数不超过 max_bytes。
+
+    文件路径以 (路径, 文件指纹, 倍数) 为键，文件修改后自动重新缩放；
+    图像对象以 (对象, 倍数) 为键，原对象被释放（如配置重载后）时对应的缓存随之删除。
+    缓存的图像只会被读取（渲染前先复制），可在线程间共享。
+    """
+
+    def __init__(self, max_bytes: int = SCALED_ASSET_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._images: "OrderedDict[Hashable, Image.Image]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # id(原图) -> 原图的弱引用，原图释放时删除以其为键的缓存
+        self._sources: Dict[int, weakref.ref] = {}
+        # 已释放原图的 id。弱引用回调可能在任意位置触发（包括本线程持有锁时），
+        # 回调中只追加 id，由下一次取用缓存时在锁内清理
+        self._released: Deque[int] = deque()
+
+    def get(self, source: Source, scale: float) -> Source:
+        """
+        返回缩放后的图像；scale 为 1 或文件不存在时原样返回 source（由渲染函数按原逻辑处理）。
+        文件对象无法判断内容是否变化，每次都重新缩放，不放入缓存。
+        """
+        check_scale(scale)
+        if scale == 1:
+            return source
+        if isinstance(source, BytesIO):
+            return _scale(_load_rgba(source), scale)
+        if isinstance(source, Image.Image):
+            key: Hashable = ("image", id(source), scale)
+            return self._get_or_scale(key, lambda: source, source)
+        fp = file_fingerprint(source)
+        if fp is None:
+            return source
+        return self._get_or_scale(
+            ("file", source, fp, scale), lambda: _load_rgba(source), None
+        )
+
+    def _get_or_scale(
+        self,
+        key: Hashable,
+        load: Callable[[], Image.Image],
+        owner: Optional[Image.Image],
+    ) -> Image.Image:
+        with self._lock:
+            # 先清理已释放的原图，避免新对象复用其 id 时取到旧的缩放结果
+            self._drain_released()
+            scaled = self._images.get(key)
+            if scaled is not None:
+                self._images.move_to_end(key)
+                return scaled
+        scaled = _scale(load(), key[-1])
+        with self._lock:
+            self._drain_released()
+            if owner is not None and id(owner) not in self._sources:
+                self._sources[id(owner)] = weakref.ref(owner, self._forget(id(owner)))
+            self._put(key, scaled)
+        return scaled
+
+    def _forget(self, source_id: int) -> Callable[[weakref.ref], None]:
+        def callback(_ref: weakref.ref) -> None:
+            self._released.append(source_id)
+
+        return callback
+
+    def _drain_released(self) -> None:
+        # 调用方须持有 self._lock
+        while self._released:
+            source_id = self._released.popleft()
+            self._sources.pop(source_id, None)
+            for key in [k for k in self._images if k[0] == "image" and k[1] == source_id]:
+                self._bytes -= _image_bytes(self._images.pop(key))
+
+    def _put(self, key: Hashable, image: Image.Image) -> None:
+        old = self._images.pop(key, None)
+        if old is not None:
+            self._bytes -= _image_bytes(old)
+        self._images[key] = image
+        self._bytes += _image_bytes(image)
+        # 至少保留刚缩放的图像，即使它本身超过上限
+        while self._bytes > self.max_bytes and len(self._images) > 1:
+            _, evicted = self._images.popitem(last=False)
+            self._bytes -= _image_bytes(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._images.clear()
+            self._bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            self._drain_released()
+            return CacheStats(len(self._images), self._bytes)
+
+
+def _load_rgba(source: Union[str, BytesIO]) -> Image.Image:
+    with Image.open(source) as im:
+        return im.convert("RGBA")
+
+
+def _scale(image: Image.Image, scale: float) -> Image.Image:
+    size = (max(1, scale_length(image.width, scale)), max(1, scale_length(image.height, scale)))
+    return image.resize(size, Image.Resampling.LANCZOS)
+
+
+scaled_assets = ScaledAssetCache()
+register_cache(
+    "hidpi.scaled_assets",
+    scaled_assets.stats,
+    max_bytes=SCALED_ASSET_MAX_BYTES,
+    description="按 HiDPI 倍数预先缩放的底图与置顶图层",
+)
+
+
+def scaled_asset(source: Optional[Source], scale: float) -> Optional[Source]:
+    """返回按倍数缩放后的底图或置顶图层（带缓存），None 原样返回"""
+    if source is None:
+        return None
+    return scaled_assets.get(source, scale)
@@ -0,0 +1,193 @@
+# filename: hot_reload.py
+import logging
+import os
+import threading
+from typing import Callable, Dict, Mapping, NamedTuple, Optional, Set, Union
+
+from PIL import Image
+
+from asset_bundle import AssetBundle, Fingerprint, file_fingerprint
+from config_loader import Config, load_config
+from directive_parser import DirectiveParser, get_directive_parser
+from text_fit_draw import clear_font_caches
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # watchdog 为可选依赖，没有安装时退化为轮询
+    Observer = None  # type: ignore
+    FileSystemEventHandler = object  # type: ignore
+
+class RenderState(NamedTuple):
+    """某一版本配置及其派生状态的快照，构建完成后只读，可被多个线程共享"""
+
+    config: Config
+    """配置对象"""
+    images: Mapping[str, Image.Image]
+    """底图与置顶图层路径 -> 解码后的 RGBA 图像（渲染时会被复制，不会被修改）"""
+    parser: DirectiveParser
+    """内联指令解析器"""
+    fingerprints: Dict[str, Fingerprint]
+    """配置文件、字体与各图片文件的指纹，用于判断变化"""
+
+    def base_image(self, path: str) -> Union[Image.Image, str]:
+        """返回已解码的底图，未能预先解码时退回路径，由渲染函数自行打开"""
+        return self.images.get(path, path)
+
+    def overlay(self) -> Union[Image.Image, str, None]:
+        """返回置顶图层（未启用时为 None）"""
+        if not self.config.use_base_overlay:
+            return None
+        return self.images.get(self.config.base_overlay_file, self.config.base_overlay_file)
+
+
+def build_state(config_file: str, previous: Optional[RenderState] = None) -> RenderState:
+    """
+    读取配置并构建派生状态。
+
+    只有指纹发生变化的文件才会被重新处理：未变化的图片直接沿用上一版本的解码结果，
+    字体缓存只在字体文件本身被修改时清空，指令解析器只在差分映射变化时重新编译。
+    """
+    config = load_config(config_file)
+    fingerprints: Dict[str, Fingerprint] = {config_file: file_fingerprint(config_file)}
+
+    # 预打包资源中未过期的图像直接映射使用，无需解码
+    bundled: Dict[str, Image.Image] = {}
+    if config.asset_bundle_file:
+        fingerprints[config.asset_bundle_file] = file_fingerprint(config.asset_bundle_file)
+        try:
+            bundled = AssetBundle(config.asset_bundle_file).fresh_images()
+        except (OSError, ValueError) as e:
+            logging.warning("无法使用预打包资源 %s: %s", config.asset_bundle_file, e)
+
+    images: Dict[str, Image.Image] = {}
+    for path in config.asset_paths():
+        fp = file_fingerprint(path)
+        fingerprints[path] = fp
+        if fp is None:
+            continue
+        if (
+            previous is not None
+            and previous.fingerprints.get(path) == fp
+            and path in previous.images
+        ):
+            images[path] = previous.images[path]
+            continue
+        if path in bundled:
+            images[path] = bundled[path]
+            continue
+        try:
+            with Image.open(path) as im:
+                images[path] = im.convert("RGBA")
+        except OSError as e:
+            logging.error("无法加载图片 %s: %s", path, e)
+
+    # 字体缓存以路径为键，只有已在使用的字体文件内容变化时才需要清空
+    fonts_changed = False
+    for path in config.font_paths():
+        fp = file_fingerprint(path)
+        fingerprints[path] = fp
+        if previous is not None and path in previous.config.font_paths():
+            fonts_changed = fonts_changed or previous.fingerprints.get(path) != fp
+    if fonts_changed:
+        clear_font_caches()
+
+    return RenderState(config, images, get_directive_parser(config), fingerprints)
+
+
+class _WakeHandler(FileSystemEventHandler):  # type: ignore[misc]
+    def __init__(self, wake: threading.Event):
+        self._wake = wake
+
+    def on_any_event(self, event):
+        self._wake.set()
+
+
+class HotReloader:
+    """
+    监视配置文件与资源文件，在后台线程中重建派生状态并原子地替换。
+
+    渲染时读取一次 current 得到完整快照，整个渲染过程都使用同一版本的状态，
+    不会观察到半更新的配置。安装了 watchdog 时由文件事件立即唤醒，
+    同时始终保留按 interval 的轮询作为兜底。
+    """
+
+    def __init__(
+        self,
+        config_file: str = "config.yaml",
+        interval: float = 1.0,
+        on_reload: Optional[Callable[[RenderState, RenderState], None]] = None,
+    ):
+        self.config_file = config_file
+        self.interval = interval
+        self.on_reload = on_reload
+        self.current: RenderState = build_state(config_file)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._observer = None
+
+    def _changed(self) -> bool:
+        state = self.current
+        return any(
+            file_fingerprint(path) != fp for path, fp in state.fingerprints.items()
+        )
+
+    def reload_now(self) -> bool:
+        """立即检查并在有变化时重建状态，返回是否发生了替换"""
+        if not self._changed():
+            return False
+        old = self.current
+        try:
+            new = build_state(self.config_file, old)
+        except Exception as e:
+            # 配置写到一半或格式错误时保留旧状态，等待下一次变化
+            logging.error("重新加载配置失败，继续使用旧配置: %s", e)
+            return False
+        self.current = new
+        logging.info("已重新加载配置与资源")
+        if self.on_reload is not None:
+            try:
+                self.on_reload(old, new)
+            except Exception as e:
+                logging.error("应用新配置失败: %s", e)
+        return True
+
+    def _watch_dirs(self) -> Set[str]:
+        return {
+            os.path.dirname(os.path.abspath(p)) for p in self.current.fingerprints
+        }
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            if self._stop.is_set():
+                break
+            self._wake.clear()
+            self.reload_now()
+
+    def start(self) -> None:
+        """启动后台监视线程"""
+        if self._thread is not None:
+            return
+        if Observer is not None:
+            self._observer = Observer()
+            handler = _WakeHandler(self._wake)
+            for d in self._watch_dirs():
+                if os.path.isdir(d):
+                    self._observer.schedule(handler, d, recursive=False)
+            self._observer.start()
+        self._thread = threading.Thread(target=self._run, name="hot-reload", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止后台监视线程"""
+        self._stop.set()
+        self._wake.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -1,62 +1,166 @@
 # filename: image_fit_paste.py
+import hashlib
 import os
-from io import BytesIO
-from typing import Literal, Tuple, Union
+import threading
+from collections import OrderedDict
+from typing import Literal, NamedTuple, Optional, Tuple, Union
 
 from PIL import Image
 
+from cache_registry import CacheStats, register_cache
+from hidpi import scale_length, scale_point, scaled_asset
+from render_budget import (
+    DEFAULT_PNG_COMPRESS_LEVEL,
+    FAST_RESAMPLE,
+    RESAMPLE_LANCZOS,
+    RenderBudget,
+    encode_png,
+    png_estimate,
+    resize_estimate,
+    resize_image,
+)
+
 Align = Literal["left", "center", "right"]
 VAlign = Literal["top", "middle", "bottom"]
 
 
-def paste_image_auto(
-    image_source: Union[str, Image.Image],
+# 计算摘要时每次导出的像素字节数，逐段导出避免为大图一次分配整块内存
+_DIGEST_CHUNK_BYTES = 1024 * 1024
+
+
+def image_digest(image: Image.Image) -> str:
+    """
+    按模式、尺寸、调色板与全部像素计算图片摘要（十六进制），用于识别同一张粘贴图片。
+    像素按若干行一段导出并送入哈希，整张图片都参与计算，耗时仍远低于一次 LANCZOS 缩放。
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.mode}|{image.width}x{image.height}|".encode("ascii"))
+    palette = image.getpalette() if image.mode == "P" else None
+    if palette is not None:
+        h.update(bytes(palette))
+    row_bytes = max(1, image.width * len(image.getbands()))
+    rows = max(1, _DIGEST_CHUNK_BYTES // row_bytes)
+    for top in range(0, image.height, rows):
+        h.update(image.crop((0, top, image.width, min(image.height, top + rows))).tobytes())
+    return h.hexdigest()
+
+
+# 缩放结果缓存的字节数上限
+RESIZE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# (图片摘要, 目标尺寸, 插值方式)
+ResizeKey = Tuple[str, Tuple[int, int], str]
+
+
+def _image_bytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+class ResizeCache:
+    """
+    缩放后图片的 LRU 缓存，按图片内容摘要、目标尺寸与插值方式索引，总字节数不超过 max_bytes。
+
+    用户经常反复粘贴同一张表情包，命中时直接复用缩放结果，省去整张原图的 LANCZOS 重采样。
+    缓存的图片只会被读取（粘贴到画布上），可在线程间共享。
+    """
+
+    def __init__(self, max_bytes: int = RESIZE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._images: "OrderedDict[ResizeKey, Image.Image]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: ResizeKey) -> Optional[Image.Image]:
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+            return image
+
+    def put(self, key: ResizeKey, image: Image.Image) -> None:
+        size = _image_bytes(image)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._images.pop(key, None)
+            if old is not None:
+                self._bytes -= _image_bytes(old)
+            self._images[key] = image
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= _image_bytes(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._images.clear()
+            self._bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(len(self._images), self._bytes)
+
+
+resize_cache = ResizeCache()
+register_cache(
+    "image_fit_paste.resize",
+    resize_cache.stats,
+    max_bytes=RESIZE_CACHE_MAX_BYTES,
+    description="粘贴图片的缩放结果",
+)
+
+
+def cached_resize(
+    content_image: Image.Image,
+    size: Tuple[int, int],
+    budget: Optional[RenderBudget] = None,
+    reserve_ms: float = 0.0,
+    resample: str = RESAMPLE_LANCZOS,
+    digest: Optional[str] = None,
+) -> Image.Image:
+    """
+    按 resample 指定的方式缩放（见 render_budget.resize_image），结果按内容摘要缓存。
+    digest 为调用方已算好的 image_digest，为 None 时在这里计算；
+    时限紧张时不计算摘要、不使用缓存。为满足时限而降级的缩放结果质量较低，不放入缓存。
+    返回的图片可能被多次复用，调用方不能修改它。
+    """
+    if digest is None:
+        if budget is not None and budget.would_exceed(
+            resize_estimate(content_image.size, size) + reserve_ms
+        ):
+            return resize_image(content_image, size, budget, reserve_ms, resample)
+        digest = image_digest(content_image)
+    key: ResizeKey = (digest, size, resample)
+    resized = resize_cache.get(key)
+    if resized is not None:
+        return resized
+    resized = resize_image(content_image, size, budget, reserve_ms, resample)
+    if budget is None or FAST_RESAMPLE not in budget.degradations:
+        resize_cache.put(key, resized)
+    return resized
+
+
+class ImageFit(NamedTuple):
+    """图片在矩形内的放置结果（只计算尺寸与位置，不做缩放）"""
+
+    size: Tuple[int, int]
+    """缩放后的尺寸"""
+    position: Tuple[int, int]
+    """粘贴位置（左上角）"""
+
+
+def fit_image(
     top_left: Tuple[int, int],
     bottom_right: Tuple[int, int],
-    content_image: Image.Image,
+    content_size: Tuple[int, int],
     align: Align = "center",
     valign: VAlign = "middle",
     padding: int = 0,
     allow_upscale: bool = False,
-    keep_alpha: bool = True,
-    image_overlay: Union[str, Image.Image, None] = None,
-) -> bytes:
+) -> ImageFit:
     """
-    在指定矩形内放置一张图片（content_image），按比例缩放至“最大但不超过”该矩形。
-
-    : param base_image: 底图（会被复制，原图不改）
-    : param top_left: 指定矩形区域（左上坐标）
-    : param bottom_right: 指定矩形区域（右下坐标）
-    : param content_image: 待放入的图片（PIL.Image.Image）
-    : param align: 水平对齐方式
-    : param valign: 垂直对齐方式
-    : param padding: 矩形内边距（像素），四边统一
-    : param allow_upscale: 是否允许放大（默认只缩小不放大）
-    : param keep_alpha: True 时保留透明通道并用其作为粘贴蒙版
-    : param image_overlay: 可选的置顶覆盖图（会被复制，原图不改）
-
-    返回：最终 PNG 的 bytes。
+    计算尺寸为 content_size 的图片按比例放入矩形后的尺寸与位置，不进行任何像素操作。
     """
-    if not isinstance(content_image, Image.Image):
-        raise TypeError("content_image 必须为 PIL.Image.Image")
-
-    if isinstance(image_source, Image.Image):
-        img = image_source.copy()
-    else:
-        img = Image.open(image_source).convert("RGBA")
-
-    if image_overlay is not None:
-        if isinstance(image_overlay, Image.Image):
-            img_overlay = image_overlay.copy()
-        else:
-            img_overlay = (
-                Image.open(image_overlay).convert("RGBA")
-                if os.path.isfile(image_overlay)
-                else None
-            )
-    else:
-        img_overlay = None
-
     x1, y1 = top_left
     x2, y2 = bottom_right
     if not (x2 > x1 and y2 > y1):
@@ -66,7 +170,7 @@ def paste_image_auto(
     region_w = max(1, (x2 - x1) - 2 * padding)
     region_h = max(1, (y2 - y1) - 2 * padding)
 
-    cw, ch = content_image.size
+    cw, ch = content_size
     if cw <= 0 or ch <= 0:
         raise ValueError("content_image 尺寸无效。")
 
@@ -82,9 +186,6 @@ def paste_image_auto(
     new_w = max(1, int(round(cw * scale)))
     new_h = max(1, int(round(ch * scale)))
 
-    # 选择高质量插值
-    resized = content_image.resize((new_w, new_h), Image.Resampling.LANCZOS)
-
     # 计算粘贴坐标（考虑对齐与 padding）
     if align == "left":
         px = x1 + padding
@@ -100,12 +201,117 @@ def paste_image_auto(
     else:  # "bottom"
         py = y2 - padding - new_h
 
+    return ImageFit((new_w, new_h), (px, py))
+
+
+def paint_image(
+    img: Image.Image,
+    content_image: Image.Image,
+    fit: ImageFit,
+    keep_alpha: bool = True,
+    budget: Optional[RenderBudget] = None,
+    resample: str = RESAMPLE_LANCZOS,
+    digest: Optional[str] = None,
+) -> None:
+    """
+    按 fit_image 的结果缩放 content_image 并粘贴到 img 上（原地修改 img）。
+    resample 为缩放方式；传入 budget 时，预计缩放加编码会超时则改用更快的插值。
+    同一张图片缩放到同一尺寸的结果会被缓存，重复粘贴时不再重采样（digest 见 cached_resize）。
+    """
+    resized = cached_resize(
+        content_image,
+        fit.size,
+        budget,
+        reserve_ms=png_estimate(img.size),
+        resample=resample,
+        digest=digest,
+    )
+
     # 处理透明度：若 keep_alpha=True 且有 alpha，则用 alpha 作为 mask 粘贴
     if keep_alpha and ("A" in resized.getbands()):
-        img.paste(resized, (px, py), resized)
+        img.paste(resized, fit.position, resized)
     else:
         # 没有 alpha 就直接粘贴（会覆盖底图该区域）
-        img.paste(resized, (px, py))
+        img.paste(resized, fit.position)
+
+
+def paste_image_auto(
+    image_source: Union[str, Image.Image],
+    top_left: Tuple[int, int],
+    bottom_right: Tuple[int, int],
+    content_image: Image.Image,
+    align: Align = "center",
+    valign: VAlign = "middle",
+    padding: int = 0,
+    allow_upscale: bool = False,
+    keep_alpha: bool = True,
+    image_overlay: Union[str, Image.Image, None] = None,
+    budget: Optional[RenderBudget] = None,
+    scale: float = 1.0,
+    resample: str = RESAMPLE_LANCZOS,
+    png_compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL,
+    content_digest: Optional[str] = None,
+) -> bytes:
+    """
+    在指定矩形内放置一张图片（content_image），按比例缩放至“最大但不超过”该矩形。
+
+    : param base_image: 底图（会被复制，原图不改）
+    : param top_left: 指定矩形区域（左上坐标）
+    : param bottom_right: 指定矩形区域（右下坐标）
+    : param content_image: 待放入的图片（PIL.Image.Image）
+    : param align: 水平对齐方式
+    : param valign: 垂直对齐方式
+    : param padding: 矩形内边距（像素），四边统一
+    : param allow_upscale: 是否允许放大（默认只缩小不放大）
+    : param keep_alpha: True 时保留透明通道并用其作为粘贴蒙版
+    : param image_overlay: 可选的置顶覆盖图（会被复制，原图不改）
+    : param budget: 可选的时限，预计超时时改用更快的插值与 PNG 压缩，降级措施记录在 budget.degradations
+    : param scale: HiDPI 倍数，坐标与 padding 按 1 倍底图给出，底图与置顶图层使用预先缩放并缓存的版本
+    : param resample: 缩放方式，"lanczos"（默认）或 "fast"（见 render_budget.resize_image）
+    : param png_compress_level: PNG 压缩等级（0~9）
+    : param content_digest: 已算好的 image_digest(content_image)，用于缩放结果缓存，为 None 时按需计算
+
+    可在多个线程中并发调用；传入的图像对象只会被读取，可在线程间共享（需已加载像素）。
+
+    返回：最终 PNG 的 bytes。
+    """
+    if not isinstance(content_image, Image.Image):
+        raise TypeError("content_image 必须为 PIL.Image.Image")
+
+    if scale != 1:
+        image_source = scaled_asset(image_source, scale)
+        image_overlay = scaled_asset(image_overlay, scale)
+        top_left = scale_point(top_left, scale)
+        bottom_right = scale_point(bottom_right, scale)
+        padding = scale_length(padding, scale)
+
+    if isinstance(image_source, Image.Image):
+        img = image_source.copy()
+    else:
+        img = Image.open(image_source).convert("RGBA")
+
+    if image_overlay is not None:
+        if isinstance(image_overlay, Image.Image):
+            img_overlay = image_overlay.copy()
+        else:
+            img_overlay = (
+                Image.open(image_overlay).convert("RGBA")
+                if os.path.isfile(image_overlay)
+                else None
+            )
+    else:
+        img_overlay = None
+
+    fit = fit_image(
+        top_left,
+        bottom_right,
+        content_image.size,
+        align=align,
+        valign=valign,
+        padding=padding,
+        allow_upscale=allow_upscale,
+    )
+    paint_image(img, content_image, fit, keep_alpha, budget, resample, content_digest)
 
     # 覆盖置顶图层（如果有）
     if image_overlay is not None and img_overlay is not None:
@@ -114,6 +320,4 @@ def paste_image_auto(
         print("Warning: overlay image is not exist.")
 
     # 输出 PNG bytes
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    return buf.getvalue()
+    return encode_png(img, budget, png_compress_level)
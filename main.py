@@ -2,7 +2,7 @@
 import io
 import logging
 import time
-from typing import Optional, Tuple
+from typing import Iterator, Optional, Tuple
 
 import keyboard
 import psutil
@@ -12,21 +12,26 @@ import win32gui
 import win32process
 from PIL import Image
 
-from config_loader import load_config
-from image_fit_paste import paste_image_auto
-from text_fit_draw import draw_text_auto
+from dib_decode import decode_dib
+from flight_recorder import recorder_from_config
+from hot_reload import HotReloader, RenderState
+from render_core import apply_directives, render_pages, resolve_emotion
 
-config = load_config()
+# 配置及其派生状态（解码后的底图、指令解析器等），文件变化时在后台重建并整体替换
+reloader = HotReloader("config.yaml")
+config = reloader.current.config
 
 logging.basicConfig(
     level=getattr(logging, config.logging_level.upper(), logging.INFO),
     format="%(asctime)s [%(levelname)s] %(message)s",
 )
 
+# 渲染请求记录仪（未启用时为 None）
+recorder = recorder_from_config(config)
+
 # 当前使用的表情索引
 current_emotion = "#普通#"
 last_used_image_file = config.baseimage_mapping[current_emotion]
-ratio = 1
 
 # 注册表情切换快捷键
 def register_emotion_switch_hotkeys():
@@ -34,7 +39,7 @@ def register_emotion_switch_hotkeys():
     def switch_emotion(emotion_tag):
         global current_emotion, last_used_image_file
         current_emotion = emotion_tag
-        last_used_image_file = config.baseimage_mapping.get(emotion_tag, config.baseimage_file)
+        last_used_image_file = resolve_emotion(config, emotion_tag) or config.baseimage_file
         logging.info(f"已切换到表情: {emotion_tag} ({last_used_image_file})")
     
     for hotkey, emotion_tag in config.emotion_switch_hotkeys.items():
@@ -42,13 +47,6 @@ def register_emotion_switch_hotkeys():
         keyboard.add_hotkey(hotkey, switch_emotion, args=(emotion_tag,), suppress=True)
 
 
-def is_vertical_image(image: Image.Image) -> bool:
-    """
-    判断图像是否为竖图
-    """
-    return image.height * ratio > image.width
-
-
 def get_foreground_window_process_name() -> Optional[str]:
     """
     获取当前前台窗口的进程名称
@@ -115,25 +113,19 @@ def try_get_image() -> Optional[Image.Image]:
     try:
         win32clipboard.OpenClipboard()
 
-        # 检查剪贴板中是否有 DIB 格式的图像
-        if not win32clipboard.IsClipboardFormatAvailable(win32clipboard.CF_DIB):
+        # 优先读取 CF_DIBV5（可携带 alpha 通道），否则读取 CF_DIB
+        for fmt in (win32clipboard.CF_DIBV5, win32clipboard.CF_DIB):
+            if win32clipboard.IsClipboardFormatAvailable(fmt):
+                break
+        else:
             return None
 
-        # 获取 DIB 格式的图像数据
-        data = win32clipboard.GetClipboardData(win32clipboard.CF_DIB)
+        data = win32clipboard.GetClipboardData(fmt)
         if not data:
             return None
 
-        # 将 DIB 数据转换为字节流，供 Pillow 打开
-        bmp_data = data
-        # DIB 格式缺少 BMP 文件头，需要手动加上
-        # BMP 文件头是 14 字节，包含 "BM" 标识和文件大小信息
-        header = (
-            b"BM"
-            + (len(bmp_data) + 14).to_bytes(4, "little")
-            + b"\x00\x00\x00\x00\x36\x00\x00\x00"
-        )
-        image = Image.open(io.BytesIO(header + bmp_data))
+        # 按信息头直接解析 DIB，不再拼接 BMP 文件头
+        image = decode_dib(data)
 
     except Exception as e:
         logging.error("无法从剪贴板获取图像：%s", e)
@@ -146,156 +138,15 @@ def try_get_image() -> Optional[Image.Image]:
     return image
 
 
-def process_text_and_image(text: str, image: Optional[Image.Image]) -> Optional[bytes]:
+def process_text_and_image(
+    state: RenderState, text: str, image: Optional[Image.Image]
+) -> Iterator[bytes]:
     """
-    同时处理文本和图像内容，将其绘制到同一张图片上
+    同时处理文本和图像内容，将其绘制到同一张图片上；
+    启用分页时过长的文本会逐页产出多张图片。
+    state 为本次热键处理开始时取得的配置与资源，整个渲染过程使用同一版本
     """
-    if text == "" and image is None:
-        return None
-
-    # 获取配置的区域坐标
-    x1, y1 = config.text_box_topleft
-    x2, y2 = config.image_box_bottomright
-    region_width = x2 - x1
-    region_height = y2 - y1
-
-    # 只有图像的情况
-    if text == "" and image is not None:
-        logging.info("从剪切板中捕获了图片内容")
-        try:
-            return paste_image_auto(
-                image_source=last_used_image_file,
-                image_overlay=(
-                    config.base_overlay_file if config.use_base_overlay else None
-                ),
-                top_left=(x1, y1),
-                bottom_right=(x2, y2),
-                content_image=image,
-                align="center",
-                valign="middle",
-                padding=12,
-                allow_upscale=True,
-                keep_alpha=True,
-            )
-        except Exception as e:
-            logging.error("生成图片失败: %s", e)
-            return None
-
-    # 只有文本的情况
-    elif text != "" and image is None:
-        logging.info("从文本生成图片: " + text)
-        try:
-            return draw_text_auto(
-                image_source=last_used_image_file,
-                image_overlay=(
-                    config.base_overlay_file if config.use_base_overlay else None
-                ),
-                top_left=(x1, y1),
-                bottom_right=(x2, y2),
-                text=text,
-                color=(0, 0, 0),
-                max_font_height=64,
-                font_path=config.font_file,
-                wrap_algorithm=config.text_wrap_algorithm,  # 添加这一行以使用配置的算法
-            )
-        except Exception as e:
-            logging.error("生成图片失败: %s", e)
-            return None
-
-    # 同时有图像和文本的情况
-    else:
-        logging.info("同时处理文本和图片内容")
-        logging.info("文本内容: " + text)
-        get_ratio(x1, y1, x2, y2)
-        try:
-            # 根据图像方向决定排布方式
-            if is_vertical_image(image):
-                logging.info("使用左右排布（竖图）")
-                # 左右排布：图像在左，文本在右
-                # 计算左右区域宽度（各占一半，留出间距）
-                spacing = 10  # 左右区域之间的间距
-                left_width = region_width // 2 - spacing // 2
-                right_width = region_width - left_width - spacing
-                
-                # 左区域（图像）
-                left_region_right = x1 + left_width
-                # 右区域（文本）
-                right_region_left = left_region_right + spacing
-                
-                # 先绘制左半部分的图像
-                intermediate_bytes = paste_image_auto(
-                    image_source=last_used_image_file,
-                    image_overlay=None,  # 暂时不应用overlay
-                    top_left=(x1, y1),
-                    bottom_right=(left_region_right, y2),
-                    content_image=image,
-                    align="center",
-                    valign="middle",
-                    padding=12,
-                    allow_upscale=True, 
-                    keep_alpha=True,
-                )
-                
-                # 在已有图像基础上添加右半部分的文本
-                final_bytes = draw_text_auto(
-                    image_source=io.BytesIO(intermediate_bytes),
-                    image_overlay=config.base_overlay_file if config.use_base_overlay else None,
-                    top_left=(right_region_left, y1),
-                    bottom_right=(x2, y2),
-                    text=text,
-                    color=(0, 0, 0),
-                    max_font_height=64,
-                    font_path=config.font_file,
-                    wrap_algorithm=config.text_wrap_algorithm,  # 添加这一行以使用配置的算法
-                )
-            else:
-                logging.info("使用上下排布（横图）")
-                # 上下排布：图像在上，文本在下
-                # 动态计算图像和文本的区域分配
-                # 根据文本长度和图像尺寸计算合适的比例
-                
-                # 估算文本所需高度（使用最大字体高度的一半作为初始估算）
-                estimated_text_height = min(region_height // 2, 100)
-                
-                # 图像区域（上半部分）
-                image_region_bottom = y1 + (region_height - estimated_text_height)
-                
-                # 文本区域（下半部分）
-                text_region_top = image_region_bottom
-                text_region_bottom = y2
-                
-                # 先绘制图像
-                intermediate_bytes = paste_image_auto(
-                    image_source=last_used_image_file,
-                    image_overlay=None,  # 暂时不应用overlay
-                    top_left=(x1, y1),
-                    bottom_right=(x2, image_region_bottom),
-                    content_image=image,
-                    align="center",
-                    valign="middle",
-                    padding=12,
-                    allow_upscale=True, 
-                    keep_alpha=True,
-                )
-                
-                # 在已有图像基础上添加文本
-                final_bytes = draw_text_auto(
-                    image_source=io.BytesIO(intermediate_bytes),
-                    image_overlay=config.base_overlay_file if config.use_base_overlay else None,
-                    top_left=(x1, text_region_top),
-                    bottom_right=(x2, text_region_bottom),
-                    text=text,
-                    color=(0, 0, 0),
-                    max_font_height=64,
-                    font_path=config.font_file,
-                    wrap_algorithm=config.text_wrap_algorithm,  # 添加这一行以使用配置的算法
-                )
-            
-            return final_bytes
-            
-        except Exception as e:
-            logging.error("生成图片失败: %s", e)
-            return None
+    return render_pages(state, last_used_image_file, text, image, recorder)
 
 
 def generate_image():
@@ -304,6 +155,9 @@ def generate_image():
     """
     global last_used_image_file  # 保存上次使用差分
 
+    state = reloader.current
+    config = state.config
+
     # 检查是否设置了允许的进程列表，如果设置了，则检查当前进程是否在允许列表中
     if config.allowed_processes:
         current_process = get_foreground_window_process_name()
@@ -329,58 +183,84 @@ def generate_image():
 
     logging.info("开始尝试生成图片...")
 
-    # 查找发送内容是否包含更换差分指令 #差分名#, 如果有则更换差分并移除关键字
-    for keyword, img_file in config.baseimage_mapping.items():
-        if keyword not in user_input:
-            continue
-        last_used_image_file = img_file
-        user_input = user_input.replace(keyword, "").strip()
-        logging.info(f"检测到关键词 '{keyword}'，使用底图: {last_used_image_file}")
-        break
+    # 单次扫描解析发送内容中的内联指令 (如 #差分名#), 移除全部标签后按指令更换差分
+    user_input, last_used_image_file = apply_directives(state, user_input, last_used_image_file)
 
-    png_bytes = process_text_and_image(user_input, user_pasted_image)
+    pages = 0
+    for png_bytes in process_text_and_image(state, user_input, user_pasted_image):
+        if pages:
+            # 等待上一张图片发送完毕再写入剪贴板
+            time.sleep(config.delay)
+        pages += 1
 
-    if png_bytes is None:
-        logging.error("生成图片失败！未生成 PNG 字节。")
-        return
+        copy_png_bytes_to_clipboard(png_bytes)
 
-    copy_png_bytes_to_clipboard(png_bytes)
+        if config.auto_paste_image:
+            keyboard.send(config.paste_hotkey)
 
-    if config.auto_paste_image:
-        keyboard.send(config.paste_hotkey)
+            time.sleep(config.delay)
 
-        time.sleep(config.delay)
+            if config.auto_send_image:
+                keyboard.send(config.send_hotkey)
 
-        if config.auto_send_image:
-            keyboard.send(config.send_hotkey)
+    if pages == 0:
+        logging.error("生成图片失败！未生成 PNG 字节。")
+        return
+    if pages > 1:
+        logging.info(f"文本较长，已分为 {pages} 张图片")
 
     # 恢复原始剪贴板内容
     pyperclip.copy(old_clipboard_content)
 
     logging.info("成功地生成并发送图片！")
 
-def get_ratio(x1, y1, x2, y2):
-    try:
-        global ratio
-        ratio = (x2 - x1) / (y2 - y1)
-        logging.info("比例: %s", ratio)
-    except Exception as e:
-        logging.error("计算比例时出错: %s", e)
-
-# 绑定 Ctrl+Alt+H 作为全局热键
-is_hotkey_bound = keyboard.add_hotkey(
-    config.hotkey,
-    generate_image,
-    suppress=config.block_hotkey or config.hotkey == config.send_hotkey,
-)
-
-logging.info("热键绑定: " + str(bool(is_hotkey_bound)))
-logging.info("允许的进程: " + str(config.allowed_processes))
-logging.info("键盘监听已启动，按下 {} 以生成图片".format(config.hotkey))
-
-# 注册表情切换快捷键
-register_emotion_switch_hotkeys()
-logging.info("表情切换快捷键已注册: " + str(config.emotion_switch_hotkeys))
+def bind_hotkeys():
+    """绑定生成图片热键与表情切换快捷键（会先解除已绑定的全部热键）"""
+    keyboard.unhook_all_hotkeys()
+
+    # 绑定 Ctrl+Alt+H 作为全局热键
+    is_hotkey_bound = keyboard.add_hotkey(
+        config.hotkey,
+        generate_image,
+        suppress=config.block_hotkey or config.hotkey == config.send_hotkey,
+    )
+
+    logging.info("热键绑定: " + str(bool(is_hotkey_bound)))
+    logging.info("允许的进程: " + str(config.allowed_processes))
+    logging.info("键盘监听已启动，按下 {} 以生成图片".format(config.hotkey))
+
+    # 注册表情切换快捷键
+    register_emotion_switch_hotkeys()
+    logging.info("表情切换快捷键已注册: " + str(config.emotion_switch_hotkeys))
+
+
+def on_config_reloaded(old: RenderState, new: RenderState):
+    """配置热重载后的回调：更新全局配置，并在需要时重新绑定热键"""
+    global config, recorder
+    config = new.config
+    logging.getLogger().setLevel(
+        getattr(logging, config.logging_level.upper(), logging.INFO)
+    )
+    hotkey_fields = ("hotkey", "block_hotkey", "send_hotkey", "emotion_switch_hotkeys")
+    if any(getattr(old.config, f) != getattr(config, f) for f in hotkey_fields):
+        bind_hotkeys()
+    recorder_fields = (
+        "flight_recorder",
+        "flight_recorder_file",
+        "flight_recorder_max_records",
+        "flight_recorder_max_bytes",
+        "flight_recorder_redact_text",
+    )
+    if any(getattr(old.config, f) != getattr(config, f) for f in recorder_fields):
+        recorder = recorder_from_config(config)
+
+
+bind_hotkeys()
+
+if config.hot_reload:
+    reloader.interval = config.hot_reload_interval
+    reloader.on_reload = on_config_reloaded
+    reloader.start()
 
 # 保持程序运行
 try:
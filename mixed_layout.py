@@ -0,0 +1,210 @@
+# filename: mixed_layout.py
+from io import BytesIO
+from typing import Iterable, Literal, NamedTuple, Optional, Tuple, Union
+
+from PIL import Image, ImageDraw
+
+from hidpi import check_scale, scale_length, scale_point, scaled_asset
+from image_fit_paste import ImageFit, fit_image, paint_image
+from render_budget import DEFAULT_PNG_COMPRESS_LEVEL, RESAMPLE_LANCZOS, RenderBudget, encode_png
+from text_fit_draw import (
+    FontSpec,
+    GlyphAdvanceDraw,
+    RGBColor,
+    TextLayout,
+    _apply_overlay,
+    _open_overlay,
+    layout_text,
+    paint_text,
+)
+
+Orientation = Literal["horizontal", "vertical"]
+Box = Tuple[Tuple[int, int], Tuple[int, int]]
+
+# 候选分割比例：图片占据区域的比例
+DEFAULT_SPLITS = (0.25, 0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7, 0.75)
+
+
+class MixedLayout(NamedTuple):
+    """图文混排的排版方案"""
+
+    orientation: Orientation
+    """"horizontal" 为左图右文，"vertical" 为上图下文"""
+    split: float
+    """图片区域所占比例"""
+    image_box: Box
+    """图片区域"""
+    text_box: Box
+    """文字区域"""
+    image_fit: ImageFit
+    """图片缩放后的尺寸与位置"""
+    text_layout: TextLayout
+    """文字排版结果"""
+    score: float
+    """方案得分，越大越好"""
+
+
+def _split_box(
+    top_left: Tuple[int, int],
+    bottom_right: Tuple[int, int],
+    orientation: Orientation,
+    split: float,
+    spacing: int,
+) -> Optional[Tuple[Box, Box]]:
+    x1, y1 = top_left
+    x2, y2 = bottom_right
+    if orientation == "horizontal":
+        image_w = int((x2 - x1 - spacing) * split)
+        text_left = x1 + image_w + spacing
+        if image_w <= 0 or text_left >= x2:
+            return None
+        return ((x1, y1), (x1 + image_w, y2)), ((text_left, y1), (x2, y2))
+    image_h = int((y2 - y1 - spacing) * split)
+    text_top = y1 + image_h + spacing
+    if image_h <= 0 or text_top >= y2:
+        return None
+    return ((x1, y1), (x2, y1 + image_h)), ((x1, text_top), (x2, y2))
+
+
+def plan_text_and_image(
+    top_left: Tuple[int, int],
+    bottom_right: Tuple[int, int],
+    text: str,
+    image_size: Tuple[int, int],
+    max_font_height: Optional[int] = None,
+    font_path: FontSpec = None,
+    line_spacing: float = 0.15,
+    wrap_algorithm: str = "original",
+    padding: int = 12,
+    spacing: int = 10,
+    min_font_size: int = 12,
+    splits: Iterable[float] = DEFAULT_SPLITS,
+    orientations: Iterable[Orientation] = ("horizontal", "vertical"),
+    scale: float = 1.0,
+    budget: Optional[RenderBudget] = None,
+) -> MixedLayout:
+    """
+    只做测量，不做绘制：对每个候选分割计算图片缩放尺寸和文字的最佳字号，
+    选出对矩形利用最充分的方案。
+
+    得分为图片与文字块实际覆盖的面积占矩形面积的比例；字号小于 min_font_size
+    的方案按比例扣分，避免为了放大图片把文字挤得无法阅读。
+
+    为了让搜索远比一次渲染便宜：
+    1. 图片放置只需算术，(图片面积 + 文字区域面积) 是得分上界，按上界从高到低评估并剪枝；
+    2. 候选的文字测量使用逐字符缓存的字宽估算（GlyphAdvanceDraw）；
+    3. 选定方案后只对其文字区域做一次精确排版（结果有缓存）。
+
+    scale 为 HiDPI 倍数：参数按 1 倍底图给出，返回的方案为放大后的坐标，
+    须以相同的 scale 调用 render_text_and_image。
+
+    传入 budget 时，选定方案的精确排版按时限降级（见 layout_text）。
+    """
+    if scale != 1:
+        check_scale(scale)
+        top_left = scale_point(top_left, scale)
+        bottom_right = scale_point(bottom_right, scale)
+        padding = scale_length(padding, scale)
+        spacing = scale_length(spacing, scale)
+        min_font_size = scale_length(min_font_size, scale)
+        if max_font_height is not None:
+            max_font_height = scale_length(max_font_height, scale)
+    x1, y1 = top_left
+    x2, y2 = bottom_right
+    if not (x2 > x1 and y2 > y1):
+        raise ValueError("无效的排版区域。")
+    box_area = (x2 - x1) * (y2 - y1)
+
+    candidates = []
+    for orientation in orientations:
+        for split in splits:
+            boxes = _split_box(top_left, bottom_right, orientation, split, spacing)
+            if boxes is None:
+                continue
+            image_box, text_box = boxes
+            fit = fit_image(
+                image_box[0], image_box[1], image_size, padding=padding, allow_upscale=True
+            )
+            (tx1, ty1), (tx2, ty2) = text_box
+            bound = (fit.size[0] * fit.size[1] + (tx2 - tx1) * (ty2 - ty1)) / box_area
+            candidates.append((bound, orientation, split, image_box, text_box, fit))
+    candidates.sort(key=lambda c: c[0], reverse=True)
+
+    estimator = GlyphAdvanceDraw("RGBA")
+    best: Optional[MixedLayout] = None
+    for bound, orientation, split, image_box, text_box, fit in candidates:
+        if best is not None and bound <= best.score:
+            break
+        layout = layout_text(
+            estimator,
+            text_box[0],
+            text_box[1],
+            text,
+            max_font_height=max_font_height,
+            font_path=font_path,
+            line_spacing=line_spacing,
+            wrap_algorithm=wrap_algorithm,
+        )
+        covered = fit.size[0] * fit.size[1] + layout.block_w * layout.block_h
+        score = covered / box_area
+        if layout.font_size < min_font_size:
+            score *= layout.font_size / min_font_size
+        if best is None or score > best.score:
+            best = MixedLayout(orientation, split, image_box, text_box, fit, layout, score)
+
+    if best is None:
+        raise ValueError("排版区域过小，无法同时放置图片和文字。")
+
+    # 对选定的文字区域做一次精确排版，用于最终绘制
+    exact = layout_text(
+        ImageDraw.Draw(Image.new("RGBA", (1, 1))),
+        best.text_box[0],
+        best.text_box[1],
+        text,
+        max_font_height=max_font_height,
+        font_path=font_path,
+        line_spacing=line_spacing,
+        wrap_algorithm=wrap_algorithm,
+        budget=budget,
+    )
+    return best._replace(text_layout=exact)
+
+
+def render_text_and_image(
+    image_source: Union[str, BytesIO, Image.Image],
+    layout: MixedLayout,
+    content_image: Image.Image,
+    color: RGBColor = (0, 0, 0),
+    font_path: FontSpec = None,
+    bracket_color: RGBColor = (128, 0, 128),
+    image_overlay: Union[str, Image.Image, None] = None,
+    keep_alpha: bool = True,
+    budget: Optional[RenderBudget] = None,
+    scale: float = 1.0,
+    resample: str = RESAMPLE_LANCZOS,
+    png_compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL,
+    content_digest: Optional[str] = None,
+) -> bytes:
+    """
+    按 plan_text_and_image 选出的方案一次性绘制图片与文字，只编码一次 PNG。
+    传入 budget 时，预计超时的缩放与编码会降级，降级措施记录在 budget.degradations。
+    scale 须与规划时相同，底图与置顶图层使用预先缩放并缓存的版本。
+    resample、png_compress_level 与 content_digest 的含义与 paste_image_auto 相同。
+    """
+    if scale != 1:
+        image_source = scaled_asset(image_source, scale)
+        image_overlay = scaled_asset(image_overlay, scale)
+    if isinstance(image_source, Image.Image):
+        img = image_source.copy()
+    else:
+        img = Image.open(image_source).convert("RGBA")
+
+    paint_image(
+        img, content_image, layout.image_fit, keep_alpha, budget, resample, content_digest
+    )
+    paint_text(img, layout.text_layout, color, font_path, bracket_color=bracket_color)
+
+    _apply_overlay(img, image_overlay, _open_overlay(image_overlay))
+
+    return encode_png(img, budget, png_compress_level)
+
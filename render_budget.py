@@ -0,0 +1,172 @@
+# filename: render_budget.py
+"""
+渲染时限：给一次渲染设定截止时间，预计会超时的步骤改用更快但质量略低的做法，
+并记录实际采用了哪些降级，保证按下热键后不会长时间没有反应。
+
+各步骤的耗时由 CostModel 按历史观测值（每单位工作量的平均耗时）预测。
+"""
+import threading
+import time
+from io import BytesIO
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+# 降级措施名称
+GREEDY_WRAP = "greedy_wrap"
+"""Knuth-Plass 换行改为贪心换行"""
+EARLY_STOP = "early_stop"
+"""字号搜索提前结束，使用已找到的最大可用字号"""
+ESTIMATED_LAYOUT = "estimated_layout"
+"""字号搜索改用逐字符字宽估算，只对选出的字号精确测量"""
+FAST_RESAMPLE = "fast_resample"
+"""图片缩放由 LANCZOS 改为先整数倍缩小再 BILINEAR"""
+FAST_PNG = "fast_png"
+"""PNG 使用最低压缩等级"""
+
+# 图片缩放方式（配置项 image_resample）
+RESAMPLE_LANCZOS = "lanczos"
+"""LANCZOS 插值，质量最好"""
+RESAMPLE_FAST = "fast"
+"""先按整数倍缩小再 BILINEAR 插值，与 FAST_RESAMPLE 降级相同"""
+
+# PNG 默认压缩等级（与 zlib 默认相同），可选 0~9，等级越低编码越快、文件越大
+DEFAULT_PNG_COMPRESS_LEVEL = 6
+
+
+# 各操作每单位工作量的初始耗时（毫秒），在单核的参考机器上实测后取偏大的值。
+# 启动后第一次遇到大图或长文本时也能预测出耗时，之后由观测值逐步修正
+DEFAULT_RATES: Dict[str, float] = {
+    "measure:original": 0.05,  # 每个字符
+    "measure:knuth_plass": 0.1,  # 每个字符（动态规划，长文本更慢）
+    "resize": 1.5e-5,  # 原图与目标图的每个像素（LANCZOS）
+    "png": 2.5e-4,  # 每个像素（默认压缩等级）
+}
+
+
+class CostModel:
+    """
+    按操作类型记录每单位工作量的平均耗时（指数滑动平均），用于预测下一次操作的耗时。
+    初始值取自 defaults，观测值按滑动平均逐步修正。可在多个线程中同时使用。
+    """
+
+    def __init__(self, alpha: float = 0.2, defaults: Optional[Dict[str, float]] = None):
+        self.alpha = alpha
+        self._rates: Dict[str, float] = dict(DEFAULT_RATES if defaults is None else defaults)
+        self._lock = threading.Lock()
+
+    def observe(self, op: str, units: float, elapsed_ms: float) -> None:
+        """记录一次操作的工作量与耗时（毫秒）"""
+        if units <= 0:
+            return
+        rate = elapsed_ms / units
+        with self._lock:
+            old = self._rates.get(op)
+            self._rates[op] = rate if old is None else old + self.alpha * (rate - old)
+
+    def estimate(self, op: str, units: float) -> float:
+        """预测操作耗时（毫秒），既没有初始值也没有观测值的操作返回 0"""
+        return self._rates.get(op, 0.0) * units
+
+
+# 全局耗时模型，各渲染函数共享
+cost_model = CostModel()
+
+
+class RenderBudget:
+    """
+    一次渲染的时限。创建时开始计时，可以在按下热键时就创建，使读取剪贴板等步骤也计入时限。
+
+    排版（换行与字号搜索）须在 layout_share 比例的时限内完成，为绘制与编码留出时间。
+    渲染完成后，degradations 中按发生顺序列出实际采用的降级措施。
+    """
+
+    def __init__(self, deadline_ms: float, layout_share: float = 0.5):
+        if deadline_ms <= 0:
+            raise ValueError("deadline_ms 必须大于 0。")
+        self.deadline_ms = deadline_ms
+        self.layout_share = layout_share
+        self.degradations: List[str] = []
+        self._start = time.perf_counter()
+
+    def elapsed_ms(self) -> float:
+        """已经过的毫秒数"""
+        return (time.perf_counter() - self._start) * 1000
+
+    def remaining_ms(self) -> float:
+        """剩余的毫秒数（可能为负）"""
+        return self.deadline_ms - self.elapsed_ms()
+
+    def would_exceed(self, estimate_ms: float, share: float = 1.0) -> bool:
+        """再花费 estimate_ms 是否会超过时限的 share 比例"""
+        return self.elapsed_ms() + estimate_ms > self.deadline_ms * share
+
+    def degrade(self, name: str) -> None:
+        """记录一项降级措施（同一措施只记录一次）"""
+        if name not in self.degradations:
+            self.degradations.append(name)
+
+
+def encode_png(
+    img: Image.Image,
+    budget: Optional[RenderBudget] = None,
+    compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL,
+) -> bytes:
+    """
+    按 compress_level 编码为 PNG。预计会超出时限时改用最低压缩等级（文件更大，速度快数倍）。
+    """
+    buf = BytesIO()
+    units = img.width * img.height
+    if (
+        budget is not None
+        and compress_level > 1
+        and budget.would_exceed(cost_model.estimate("png", units))
+    ):
+        budget.degrade(FAST_PNG)
+        img.save(buf, format="PNG", compress_level=1)
+        return buf.getvalue()
+    start = time.perf_counter()
+    img.save(buf, format="PNG", compress_level=compress_level)
+    cost_model.observe("png", units, (time.perf_counter() - start) * 1000)
+    return buf.getvalue()
+
+
+def resize_image(
+    img: Image.Image,
+    size: tuple,
+    budget: Optional[RenderBudget] = None,
+    reserve_ms: float = 0.0,
+    resample: str = RESAMPLE_LANCZOS,
+) -> Image.Image:
+    """
+    按 resample 指定的方式缩放。LANCZOS 缩放预计加上 reserve_ms（后续步骤）会超出时限时，
+    改为先按整数倍缩小再 BILINEAR 插值。
+    """
+    if resample == RESAMPLE_FAST:
+        return _fast_resize(img, size)
+    if resample != RESAMPLE_LANCZOS:
+        raise ValueError(f"未知的缩放方式: {resample}")
+    units = img.width * img.height + size[0] * size[1]
+    if budget is not None and budget.would_exceed(
+        cost_model.estimate("resize", units) + reserve_ms
+    ):
+        budget.degrade(FAST_RESAMPLE)
+        return _fast_resize(img, size)
+    start = time.perf_counter()
+    resized = img.resize(size, Image.Resampling.LANCZOS)
+    cost_model.observe("resize", units, (time.perf_counter() - start) * 1000)
+    return resized
+
+
+def _fast_resize(img: Image.Image, size: tuple) -> Image.Image:
+    return img.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+
+def resize_estimate(src_size: tuple, size: tuple) -> float:
+    """预测把 src_size 的图像 LANCZOS 缩放到 size 的耗时（毫秒）"""
+    return cost_model.estimate("resize", src_size[0] * src_size[1] + size[0] * size[1])
+
+
+def png_estimate(size: tuple) -> float:
+    """预测按默认压缩等级编码指定尺寸图像的耗时（毫秒）"""
+    return cost_model.estimate("png", size[0] * size[1])
@@ -0,0 +1,252 @@
+# filename: render_cache.py
+"""
+渲染结果的磁盘缓存：常用的 文字 × 差分 组合长期不变，渲染结果按内容寻址保存在缓存目录中，
+重启后依然有效，命中时不做任何排版工作。
+
+缓存键是以下内容的哈希：文字、底图与置顶图层的内容摘要、各字体文件的内容摘要、
+影响纯文字渲染的配置项的指纹以及 PNG 编码方式（编码器版本与压缩等级），
+任何一项变化都会得到新的键，旧文件随后按 LRU 淘汰。
+渲染时限不计入键：时限降级的结果不写入缓存，缓存中只有完整质量的结果。
+写入先写临时文件再原子替换，多个进程可以共用同一目录。
+
+预热：python -m tools.prewarm_cache phrases.txt
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import PIL
+
+from asset_bundle import Fingerprint, file_fingerprint
+from cache_registry import CacheStats, register_cache
+from config_loader import Config
+
+# PNG 编码器（render_budget.encode_png）的版本，与配置中的 png_compress_level 一起计入缓存键，
+# 压缩等级或 Pillow 版本变化时缓存失效
+ENCODER_PROFILE = f"png:pillow-{PIL.__version__}"
+
+_SUFFIX = ".png"
+
+
+def _hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# (路径, 文件指纹) -> 内容摘要，文件修改后指纹变化，重新计算
+_digests: Dict[Tuple[str, Fingerprint], str] = {}
+_digests_lock = threading.Lock()
+
+
+def file_digest(path: str) -> str:
+    """文件内容的摘要（按路径与文件指纹缓存），文件不存在或无法读取时返回空字符串"""
+    fp = file_fingerprint(path)
+    if fp is None:
+        return ""
+    key = (path, fp)
+    with _digests_lock:
+        digest = _digests.get(key)
+    if digest is not None:
+        return digest
+    try:
+        digest = _hash_file(path)
+    except OSError:
+        return ""
+    with _digests_lock:
+        for stale in [k for k in _digests if k[0] == path]:
+            del _digests[stale]
+        _digests[key] = digest
+    return digest
+
+
+register_cache(
+    "render_cache.file_digests",
+    lambda: CacheStats(len(_digests)),
+    description="底图与字体文件的内容摘要",
+)
+
+
+# 影响纯文字消息渲染结果的配置项。底图、置顶图层与字体按文件内容计入缓存键，不在此列；
+# 差分映射、图片缩放方式、渲染时限等只影响其他消息或不影响缓存中的结果。
+# 新增影响文字排版或绘制的配置项时须加入这里
+_TEXT_RENDER_FIELDS = (
+    "text_box_topleft",
+    "image_box_bottomright",
+    "max_font_height",
+    "text_wrap_algorithm",
+    "text_min_font_size",
+    "render_scale",
+    "use_base_overlay",
+)
+
+
+def render_fingerprint(config: Config) -> str:
+    """影响纯文字渲染结果的配置项的摘要"""
+    data = json.dumps(
+        config.model_dump(mode="json", include=set(_TEXT_RENDER_FIELDS)),
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+
+
+def render_key(config: Config, base_image_file: str, text: str) -> str:
+    """一条纯文本消息渲染结果的缓存键"""
+    overlay = config.base_overlay_file if config.use_base_overlay else None
+    parts = [
+        text,
+        file_digest(base_image_file),
+        file_digest(overlay) if overlay else "",
+        [file_digest(path) for path in config.font_paths()],
+        render_fingerprint(config),
+        ENCODER_PROFILE,
+        config.png_compress_level,
+    ]
+    data = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """
+    目录中的 <键>.png 文件，总字节数不超过 max_bytes，超出时删除最久未用的文件。
+    最近使用时间记录在文件的修改时间上（命中时更新），重启后按此恢复 LRU 顺序。
+    可在多个线程中同时使用；多个进程共用目录时各自按自己看到的文件淘汰，删除失败的文件会被跳过。
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        if max_bytes < 1:
+            raise ValueError("max_bytes 必须大于 0。")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index: "Optional[OrderedDict[str, int]]" = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def _load_index(self) -> "OrderedDict[str, int]":
+        # 第一次使用时扫描目录，按修改时间从旧到新排列
+        if self._index is not None:
+            return self._index
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(_SUFFIX) and entry.is_file():
+                        st = entry.stat()
+                        entries.append((st.st_mtime_ns, entry.name[: -len(_SUFFIX)], st.st_size))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning("无法读取渲染缓存目录 %s: %s", self.directory, e)
+        entries.sort()
+        self._index = OrderedDict((key, size) for _, key, size in entries)
+        self._bytes = sum(self._index.values())
+        return self._index
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def get(self, key: str) -> Optional[bytes]:
+        """返回缓存的 PNG 字节，未命中时返回 None"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        with self._lock:
+            index = self._load_index()
+            if key in index:
+                index.move_to_end(key)
+            else:
+                # 其他进程写入的文件
+                index[key] = len(data)
+                self._bytes += len(data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """写入一条渲染结果（原子替换），写入失败只记录日志"""
+        path = self._path(key)
+        # 多个线程或进程可能同时写同一键，临时文件名各不相同
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.warning("无法写入渲染缓存 %s: %s", path, e)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            index = self._load_index()
+            old = index.pop(key, None)
+            if old is not None:
+                self._bytes -= old
+            index[key] = len(data)
+            self._bytes += len(data)
+            self._trim(index)
+
+    def _trim(self, index: "OrderedDict[str, int]") -> None:
+        # 至少保留刚写入的文件，即使它本身超过上限
+        while self._bytes > self.max_bytes and len(index) > 1:
+            key, size = index.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        """删除目录中的全部缓存文件"""
+        with self._lock:
+            index = self._load_index()
+            for key in index:
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            index.clear()
+            self._bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            index = self._load_index()
+            return CacheStats(len(index), self._bytes)
+
+
+# (目录, 上限) -> 缓存对象，同一目录在进程内共用一个索引
+_caches: Dict[Tuple[str, int], RenderCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_render_cache(config: Config) -> Optional[RenderCache]:
+    """返回配置对应的渲染缓存，未启用时返回 None"""
+    if not config.render_cache:
+        return None
+    key = (os.path.abspath(config.render_cache_dir), config.render_cache_max_bytes)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = RenderCache(config.render_cache_dir, config.render_cache_max_bytes)
+            _caches[key] = cache
+            register_cache(
+                f"render_cache.disk:{config.render_cache_dir}",
+                cache.stats,
+                max_bytes=config.render_cache_max_bytes,
+                description="磁盘上的渲染结果缓存",
+            )
+    return cache
@@ -0,0 +1,24 @@
+# filename: render_core/__init__.py
+"""
+与平台无关的渲染核心：差分解析、排版方式选择、渲染流程与多角色档案。
+
+不依赖键盘、剪贴板与窗口相关的库，可以在任何平台上调用或做性能分析；
+main.py 只负责热键、剪贴板与前台窗口检测，渲染全部委托给这里。
+命令行用法见 render_core/__main__.py。
+"""
+from render_core.emotion import apply_directives, resolve_emotion
+from render_core.pipeline import MessageKind, message_kind, render, render_message, render_pages
+from render_core.profiles import AssetPool, ProfileRegistry, registry_from_config
+
+__all__ = [
+    "AssetPool",
+    "MessageKind",
+    "ProfileRegistry",
+    "apply_directives",
+    "message_kind",
+    "registry_from_config",
+    "render",
+    "render_message",
+    "render_pages",
+    "resolve_emotion",
+]
@@ -0,0 +1,149 @@
+# filename: render_core/__main__.py
+"""
+命令行渲染：不需要热键与剪贴板，按配置把文字和/或图片渲染为 PNG。
+
+文字中的内联指令（如 #开心#）与热键流程一样生效，并优先于 -e 指定的差分。
+
+配置或 --min-font-size 指定了最小可读字号且文本放不下时，分页输出为 output-1.png、output-2.png ……
+指定 -p 时使用配置中 profiles 登记的角色档案（该角色自己的配置文件）渲染。
+指定 --typing png|gif 时输出文字逐字出现的动图（APNG 或 GIF，见 typing_animation），只支持纯文字且不分页。
+
+用法：python -m render_core [文字|-] [-i 图片] [-e 差分] [-p 角色] [-o output.png|-] [-c config.yaml] [--deadline-ms 毫秒] [--scale 倍数] [--typing png|gif]
+"""
+import argparse
+import itertools
+import logging
+import os
+import sys
+from typing import List, Optional
+
+from PIL import Image
+
+from hot_reload import build_state
+from render_core.emotion import apply_directives, resolve_emotion
+from render_core.pipeline import render_pages
+from render_core.profiles import registry_from_config
+from typing_animation import ANIMATION_FORMATS, draw_text_typing
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="把文字和/或图片渲染为 PNG")
+    parser.add_argument("text", nargs="?", default="", help="要渲染的文字，为 - 时从标准输入读取")
+    parser.add_argument("-i", "--image", default=None, help="要粘贴的图片文件")
+    parser.add_argument("-e", "--emotion", default=None, help="差分名称（如 开心 或 #开心#），默认使用默认底图")
+    parser.add_argument("-p", "--profile", default=None, help="角色档案名称（配置中的 profiles）")
+    parser.add_argument("-o", "--output", default="output.png", help="输出 PNG 文件，为 - 时写到标准输出")
+    parser.add_argument("-c", "--config", default="config.yaml", help="配置文件路径")
+    parser.add_argument("--deadline-ms", type=float, default=None, help="覆盖配置中的渲染时限（毫秒）")
+    parser.add_argument("--scale", type=float, default=None, help="覆盖配置中的 HiDPI 渲染倍数")
+    parser.add_argument(
+        "--min-font-size", type=int, default=None, help="覆盖配置中的最小可读字号，放不下时分页输出"
+    )
+    parser.add_argument(
+        "--typing",
+        type=str.upper,
+        choices=ANIMATION_FORMATS,
+        default=None,
+        help="输出文字逐字出现的动图（PNG 为 APNG），只支持纯文字",
+    )
+    args = parser.parse_args(argv)
+
+    state = build_state(args.config)
+    config = state.config
+    logging.basicConfig(
+        level=getattr(logging, config.logging_level.upper(), logging.INFO),
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        stream=sys.stderr,
+    )
+    if args.profile is not None:
+        registry = registry_from_config(config)
+        if registry is None or args.profile not in registry.names():
+            available = "、".join(registry.names()) if registry is not None else "无"
+            print(f"未知的角色档案 {args.profile}，可用：{available}", file=sys.stderr)
+            return 2
+        state = registry.state(args.profile)
+        config = state.config
+    overrides = {}
+    if args.deadline_ms is not None:
+        overrides["render_deadline_ms"] = args.deadline_ms
+    if args.scale is not None:
+        overrides["render_scale"] = args.scale
+    if args.min_font_size is not None:
+        overrides["text_min_font_size"] = args.min_font_size
+    if overrides:
+        state = state._replace(config=config.model_copy(update=overrides))
+
+    base_image_file = config.baseimage_file
+    if args.emotion is not None:
+        resolved = resolve_emotion(config, args.emotion)
+        if resolved is None:
+            print(
+                f"未知的差分 {args.emotion}，可用：{'、'.join(config.baseimage_mapping)}",
+                file=sys.stderr,
+            )
+            return 2
+        base_image_file = resolved
+
+    text = sys.stdin.read() if args.text == "-" else args.text
+    text, base_image_file = apply_directives(state, text, base_image_file)
+
+    image = None
+    if args.image is not None:
+        with Image.open(args.image) as im:
+            im.load()
+            image = im
+
+    if not text and image is None:
+        print("没有要渲染的文字或图片", file=sys.stderr)
+        return 2
+
+    if args.typing is not None:
+        if image is not None or not text:
+            print("打字动画只支持纯文字", file=sys.stderr)
+            return 2
+        config = state.config
+        _write(
+            args.output,
+            draw_text_typing(
+                image_source=state.base_image(base_image_file),
+                image_overlay=state.overlay(),
+                top_left=config.text_box_topleft,
+                bottom_right=config.image_box_bottomright,
+                text=text,
+                max_font_height=config.max_font_height,
+                font_path=config.font_spec(),
+                wrap_algorithm=config.text_wrap_algorithm,
+                frame_format=args.typing,
+            ),
+        )
+        return 0
+
+    pages = render_pages(state, base_image_file, text, image)
+    first = next(pages, None)
+    if first is None:
+        return 1
+    second = next(pages, None)
+    if second is None:
+        _write(args.output, first)
+        return 0
+    if args.output == "-":
+        print("文本分为多页，不能输出到标准输出", file=sys.stderr)
+        return 1
+    stem, ext = os.path.splitext(args.output)
+    count = 0
+    for count, png_bytes in enumerate(itertools.chain((first, second), pages), 1):
+        _write(f"{stem}-{count}{ext or '.png'}", png_bytes)
+    print(f"已分为 {count} 页：{stem}-1{ext or '.png'} ...", file=sys.stderr)
+    return 0
+
+
+def _write(path: str, png_bytes: bytes) -> None:
+    if path == "-":
+        sys.stdout.buffer.write(png_bytes)
+    else:
+        with open(path, "wb") as f:
+            f.write(png_bytes)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,32 @@
+# filename: render_core/emotion.py
+"""差分解析：把差分名称或发送内容中的内联指令解析为底图路径"""
+import logging
+from typing import Optional, Tuple
+
+from config_loader import Config
+from hot_reload import RenderState
+
+
+def resolve_emotion(config: Config, emotion: str) -> Optional[str]:
+    """
+    返回差分对应的底图路径，未找到时返回 None。
+
+    emotion 可以是完整的标签（如 "#开心#"），也可以省略两侧的 #（如 "开心"）。
+    """
+    mapping = config.baseimage_mapping
+    if emotion in mapping:
+        return mapping[emotion]
+    return mapping.get(f"#{emotion.strip('#')}#")
+
+
+def apply_directives(state: RenderState, text: str, base_image_file: str) -> Tuple[str, str]:
+    """
+    解析发送内容中的内联指令 (如 #差分名#)，返回去除全部标签后的文本与应使用的底图路径。
+    没有差分指令时沿用 base_image_file。
+    """
+    parsed = state.parser.parse(text)
+    emotion = parsed.first("emotion")
+    if emotion is not None:
+        base_image_file = emotion.value
+        logging.info(f"检测到关键词 '{emotion.tag}'，使用底图: {base_image_file}")
+    return parsed.text, base_image_file
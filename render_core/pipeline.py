@@ -0,0 +1,303 @@
+# filename: render_core/pipeline.py
+"""渲染流程：按消息内容选择排版方式，在给定的配置快照上生成 PNG"""
+import logging
+from contextlib import nullcontext
+from typing import ContextManager, Iterator, List, Literal, Optional
+
+from PIL import Image
+
+from flight_recorder import FlightRecorder, RenderTrace
+from hot_reload import RenderState
+from image_fit_paste import image_digest, paste_image_auto
+from mixed_layout import plan_text_and_image, render_text_and_image
+from render_budget import RenderBudget
+from render_cache import get_render_cache, render_key
+from text_fit_draw import draw_text_auto
+from text_pagination import draw_text_pages
+
+MessageKind = Literal["text", "image", "mixed"]
+
+
+def message_kind(text: str, image: Optional[Image.Image]) -> Optional[MessageKind]:
+    """按文本与图片的有无确定排版方式，两者都没有时返回 None"""
+    if text and image is not None:
+        return "mixed"
+    if image is not None:
+        return "image"
+    if text:
+        return "text"
+    return None
+
+
+def _stage(trace: Optional[RenderTrace], name: str) -> ContextManager[None]:
+    return trace.stage(name) if trace is not None else nullcontext()
+
+
+def render_message(
+    state: RenderState,
+    base_image_file: str,
+    text: str,
+    image: Optional[Image.Image],
+    trace: Optional[RenderTrace] = None,
+    budget: Optional[RenderBudget] = None,
+    content_digest: Optional[str] = None,
+) -> Optional[bytes]:
+    """
+    按文本与图片的有无选择渲染方式，返回 PNG 字节，失败时记录日志并返回 None。
+    传入 trace 时各阶段耗时记录在其中。content_digest 为已算好的 image_digest(image)。
+    """
+    config = state.config
+
+    # 获取配置的区域坐标
+    x1, y1 = config.text_box_topleft
+    x2, y2 = config.image_box_bottomright
+
+    kind = message_kind(text, image)
+    if kind is None:
+        return None
+
+    # 只有图像的情况
+    if kind == "image":
+        logging.info("从剪切板中捕获了图片内容")
+        try:
+            with _stage(trace, "render"):
+                return paste_image_auto(
+                    image_source=state.base_image(base_image_file),
+                    image_overlay=state.overlay(),
+                    top_left=(x1, y1),
+                    bottom_right=(x2, y2),
+                    content_image=image,
+                    align="center",
+                    valign="middle",
+                    padding=12,
+                    allow_upscale=True,
+                    keep_alpha=True,
+                    budget=budget,
+                    scale=config.render_scale,
+                    resample=config.image_resample,
+                    png_compress_level=config.png_compress_level,
+                    content_digest=content_digest,
+                )
+        except Exception as e:
+            logging.error("生成图片失败: %s", e)
+            return None
+
+    # 只有文本的情况
+    elif kind == "text":
+        logging.info("从文本生成图片: " + text)
+        try:
+            with _stage(trace, "render"):
+                return draw_text_auto(
+                    image_source=state.base_image(base_image_file),
+                    image_overlay=state.overlay(),
+                    top_left=(x1, y1),
+                    bottom_right=(x2, y2),
+                    text=text,
+                    color=(0, 0, 0),
+                    max_font_height=config.max_font_height,
+                    font_path=config.font_spec(),
+                    wrap_algorithm=config.text_wrap_algorithm,
+                    budget=budget,
+                    scale=config.render_scale,
+                    png_compress_level=config.png_compress_level,
+                )
+        except Exception as e:
+            logging.error("生成图片失败: %s", e)
+            return None
+
+    # 同时有图像和文本的情况
+    else:
+        logging.info("同时处理文本和图片内容")
+        logging.info("文本内容: " + text)
+        try:
+            # 先只测量各候选分割方案，选出最充分利用区域的一种，再一次性绘制
+            with _stage(trace, "plan"):
+                layout = plan_text_and_image(
+                    top_left=(x1, y1),
+                    bottom_right=(x2, y2),
+                    text=text,
+                    image_size=image.size,
+                    max_font_height=config.max_font_height,
+                    font_path=config.font_spec(),
+                    wrap_algorithm=config.text_wrap_algorithm,
+                    scale=config.render_scale,
+                    budget=budget,
+                )
+            logging.info(
+                "使用%s排布，图片占比 %.2f，字号 %d",
+                "左右" if layout.orientation == "horizontal" else "上下",
+                layout.split,
+                layout.text_layout.font_size,
+            )
+            with _stage(trace, "render"):
+                return render_text_and_image(
+                    image_source=state.base_image(base_image_file),
+                    layout=layout,
+                    content_image=image,
+                    color=(0, 0, 0),
+                    font_path=config.font_spec(),
+                    image_overlay=state.overlay(),
+                    budget=budget,
+                    scale=config.render_scale,
+                    resample=config.image_resample,
+                    png_compress_level=config.png_compress_level,
+                    content_digest=content_digest,
+                )
+
+        except Exception as e:
+            logging.error("生成图片失败: %s", e)
+            return None
+
+
+def render(
+    state: RenderState,
+    base_image_file: str,
+    text: str,
+    image: Optional[Image.Image],
+    recorder: Optional[FlightRecorder] = None,
+) -> Optional[bytes]:
+    """
+    完整的一次渲染：启用渲染缓存时纯文本消息先查缓存；未命中时按配置的时限创建 RenderBudget，
+    渲染消息并写入缓存。提供 recorder 时记录本次请求。整个过程使用同一版本的配置与资源。
+    """
+    if message_kind(text, image) is None:
+        return None
+
+    trace = RenderTrace()
+    # 纯文本消息先查磁盘缓存，命中时不做任何排版
+    cache = get_render_cache(state.config) if image is None else None
+    key = ""
+    png_bytes = None
+    if cache is not None:
+        with trace.stage("cache"):
+            key = render_key(state.config, base_image_file, text)
+            png_bytes = cache.get(key)
+        if png_bytes is not None:
+            logging.info("使用缓存的渲染结果: " + text)
+
+    degradations: List[str] = []
+    digest = None
+    if png_bytes is None:
+        deadline = state.config.render_deadline_ms
+        budget = RenderBudget(deadline) if deadline > 0 else None
+        # 粘贴图片的摘要只计算一次，缩放结果缓存与渲染记录共用
+        if image is not None:
+            with trace.stage("digest"):
+                digest = image_digest(image)
+        png_bytes = render_message(state, base_image_file, text, image, trace, budget, digest)
+        degradations = budget.degradations if budget is not None else []
+        if degradations:
+            logging.info("为满足渲染时限降低了质量: %s", ", ".join(degradations))
+        # 降级的结果质量较低，不写入缓存
+        elif cache is not None and png_bytes is not None:
+            with trace.stage("cache"):
+                cache.put(key, png_bytes)
+
+    _capture(recorder, trace, state, text, image, base_image_file, png_bytes, degradations, digest)
+    return png_bytes
+
+
+def _capture(
+    recorder: Optional[FlightRecorder],
+    trace: RenderTrace,
+    state: RenderState,
+    text: str,
+    image: Optional[Image.Image],
+    base_image_file: str,
+    output: Optional[bytes],
+    degradations: List[str],
+    digest: Optional[str] = None,
+    output_size: Optional[int] = None,
+) -> None:
+    # 记录失败不影响渲染结果
+    if recorder is None:
+        return
+    try:
+        recorder.capture(
+            trace, state.config, text, image, base_image_file, output, degradations, digest,
+            output_size,
+        )
+    except Exception as e:
+        logging.warning("记录渲染请求失败: %s", e)
+
+
+def render_pages(
+    state: RenderState,
+    base_image_file: str,
+    text: str,
+    image: Optional[Image.Image],
+    recorder: Optional[FlightRecorder] = None,
+) -> Iterator[bytes]:
+    """
+    逐张产出要发送的图片。配置了 text_min_font_size 时，纯文本消息在该字号下放不下会分为多页，
+    每页排版确定后立即产出；其他情况与 render 相同，只产出一张（失败时不产出）。
+    启用渲染缓存时，只有一页的结果同样使用与写入缓存。
+    """
+    config = state.config
+    if message_kind(text, image) != "text" or config.text_min_font_size <= 0:
+        png_bytes = render(state, base_image_file, text, image, recorder)
+        if png_bytes is not None:
+            yield png_bytes
+        return
+
+    # 只有一页的结果与 render 相同，可以使用与写入磁盘缓存
+    trace = RenderTrace()
+    cache = get_render_cache(config)
+    key = ""
+    if cache is not None:
+        with trace.stage("cache"):
+            key = render_key(config, base_image_file, text)
+            png_bytes = cache.get(key)
+        if png_bytes is not None:
+            logging.info("使用缓存的渲染结果: " + text)
+            _capture(recorder, trace, state, text, None, base_image_file, png_bytes, [])
+            yield png_bytes
+            return
+
+    logging.info("分页生成图片: " + text)
+    deadline = config.render_deadline_ms
+    budget = RenderBudget(deadline) if deadline > 0 else None
+    first: Optional[bytes] = None
+    count = 0
+    total = 0
+    completed = False
+    try:
+        pages = draw_text_pages(
+            image_source=state.base_image(base_image_file),
+            image_overlay=state.overlay(),
+            top_left=config.text_box_topleft,
+            bottom_right=config.image_box_bottomright,
+            text=text,
+            color=(0, 0, 0),
+            min_font_size=config.text_min_font_size,
+            max_font_height=config.max_font_height,
+            font_path=config.font_spec(),
+            wrap_algorithm=config.text_wrap_algorithm,
+            scale=config.render_scale,
+            png_compress_level=config.png_compress_level,
+            budget=budget,
+        )
+        while True:
+            with trace.stage("render"):
+                png_bytes = next(pages, None)
+            if png_bytes is None:
+                break
+            count += 1
+            total += len(png_bytes)
+            if first is None:
+                first = png_bytes
+            yield png_bytes
+        completed = True
+    except Exception as e:
+        logging.error("生成图片失败: %s", e)
+    finally:
+        # 调用方提前停止取页时同样记录已生成的部分
+        degradations = budget.degradations if budget is not None else []
+        if degradations:
+            logging.info("为满足渲染时限降低了质量: %s", ", ".join(degradations))
+        _capture(
+            recorder, trace, state, text, None, base_image_file, first, degradations,
+            output_size=total,
+        )
+    if cache is not None and completed and count == 1 and not degradations:
+        cache.put(key, first)  # type: ignore[arg-type]
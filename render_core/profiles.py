@@ -0,0 +1,188 @@
+# filename: render_core/profiles.py
+"""
+多角色档案：在同一进程中服务多个角色，每个角色使用一份 config.yaml 格式的配置
+（各自的底图、置顶图层、字体与文本框）。
+
+档案的配置在第一次使用时才读取，底图与置顶图层在第一次被渲染用到时才解码。
+所有档案的解码图像共享一个按字节数限制的 LRU 资源池，内存不足时最久未用的图像先被淘汰，
+因此长时间闲置的角色会自然让出内存，再次使用时重新解码。
+"""
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterator, Mapping, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from asset_bundle import Fingerprint, file_fingerprint
+from cache_registry import CacheStats, register_cache
+from config_loader import Config, load_config
+from directive_parser import get_directive_parser
+from flight_recorder import FlightRecorder
+from hot_reload import RenderState
+from render_core.emotion import apply_directives, resolve_emotion
+from render_core.pipeline import render
+
+# 资源池默认的字节数上限
+DEFAULT_ASSET_BYTES = 256 * 1024 * 1024
+
+
+def _image_bytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+class AssetPool:
+    """
+    按需解码的图像池，以 (路径, 文件指纹) 为键，总字节数不超过 max_bytes，超出时淘汰最久未用的图像。
+    文件被修改后指纹变化，下次使用时自动重新解码。可在多个线程中同时使用。
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_ASSET_BYTES):
+        self.max_bytes = max_bytes
+        self._images: "OrderedDict[Tuple[str, Fingerprint], Image.Image]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> Optional[Image.Image]:
+        """返回解码后的 RGBA 图像，文件不存在或无法解码时返回 None"""
+        fp = file_fingerprint(path)
+        if fp is None:
+            return None
+        key = (path, fp)
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                return image
+        # 解码不持有锁，其他线程可同时使用池中已有的图像
+        try:
+            with Image.open(path) as im:
+                image = im.convert("RGBA")
+        except OSError as e:
+            logging.error("无法加载图片 %s: %s", path, e)
+            return None
+        self._put(key, image)
+        return image
+
+    def _put(self, key: Tuple[str, Fingerprint], image: Image.Image) -> None:
+        with self._lock:
+            if key in self._images:
+                return
+            # 同一路径的旧版本不会再被使用
+            for stale in [k for k in self._images if k[0] == key[0]]:
+                self._bytes -= _image_bytes(self._images.pop(stale))
+            self._images[key] = image
+            self._bytes += _image_bytes(image)
+            # 至少保留刚解码的图像，即使它本身超过上限
+            while self._bytes > self.max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= _image_bytes(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._images.clear()
+            self._bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(len(self._images), self._bytes)
+
+
+class LazyImages(Mapping[str, Image.Image]):
+    """RenderState.images 的惰性版本：只包含给定的路径，访问时才从资源池取得（必要时解码）"""
+
+    def __init__(self, pool: AssetPool, paths: Sequence[str]):
+        self._pool = pool
+        self._paths = tuple(paths)
+
+    def __getitem__(self, path: str) -> Image.Image:
+        if path not in self._paths:
+            raise KeyError(path)
+        image = self._pool.get(path)
+        if image is None:
+            raise KeyError(path)
+        return image
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._paths)
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+
+class ProfileRegistry:
+    """
+    角色名 -> 配置文件的档案表。render 按名称选择档案渲染，
+    档案的状态在第一次使用时构建，图像由共享的 AssetPool 惰性解码并统一淘汰。
+    """
+
+    def __init__(self, profiles: Mapping[str, str], max_bytes: int = DEFAULT_ASSET_BYTES):
+        self.pool = AssetPool(max_bytes)
+        self._files: Dict[str, str] = dict(profiles)
+        self._states: Dict[str, RenderState] = {}
+        self._lock = threading.Lock()
+        register_cache(
+            "render_core.profile_assets",
+            self.pool.stats,
+            max_bytes=max_bytes,
+            description="各角色档案解码后的底图与置顶图层",
+        )
+
+    def names(self) -> Sequence[str]:
+        """全部档案名称"""
+        return list(self._files)
+
+    def state(self, name: str) -> RenderState:
+        """返回档案的渲染状态，第一次使用时读取配置（不解码图像）"""
+        with self._lock:
+            state = self._states.get(name)
+            if state is not None:
+                return state
+            if name not in self._files:
+                raise KeyError(f"未知的角色档案: {name}")
+            config_file = self._files[name]
+            # 档案中的相对路径相对于档案文件所在的目录，而不是当前工作目录
+            config = load_config(config_file).resolve_paths(str(Path(config_file).parent))
+            state = RenderState(
+                config,
+                LazyImages(self.pool, config.asset_paths()),
+                get_directive_parser(config),
+                {config_file: file_fingerprint(config_file)},
+            )
+            self._states[name] = state
+            return state
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """丢弃档案的状态（name 为 None 时丢弃全部），下次使用时重新读取配置"""
+        with self._lock:
+            if name is None:
+                self._states.clear()
+            else:
+                self._states.pop(name, None)
+
+    def render(
+        self,
+        name: str,
+        text: str,
+        image: Optional[Image.Image] = None,
+        emotion: Optional[str] = None,
+        recorder: Optional[FlightRecorder] = None,
+    ) -> Optional[bytes]:
+        """
+        用指定档案渲染一条消息。emotion 为差分名称，未指定或未找到时使用档案的默认底图；
+        文本中的内联指令优先于 emotion。
+        """
+        state = self.state(name)
+        base_image_file = state.config.baseimage_file
+        if emotion is not None:
+            base_image_file = resolve_emotion(state.config, emotion) or base_image_file
+        text, base_image_file = apply_directives(state, text, base_image_file)
+        return render(state, base_image_file, text, image, recorder)
+
+
+def registry_from_config(config: Config) -> Optional[ProfileRegistry]:
+    """按配置中的 profiles 创建档案表，没有配置档案时返回 None"""
+    if not config.profiles:
+        return None
+    return ProfileRegistry(config.profiles, config.profile_assets_max_bytes)
@@ -0,0 +1,195 @@
+# filename: shared_assets.py
+"""
+多进程渲染时的共享内存资源：父进程解码一次底图写入共享内存，
+工作进程只读地附加并以 Image.frombuffer 包装，不再各自持有一份 RGBA 副本。
+
+用法（对比每个工作进程自行解码与附加共享内存时的内存占用）：
+    python shared_assets.py [-c config.yaml] [-w 4]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import weakref
+from multiprocessing import shared_memory
+from multiprocessing.pool import Pool
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+from config_loader import Config, load_config
+
+
+class SharedAssetManifest(NamedTuple):
+    """描述共享内存段中各图像位置的清单，可被 pickle 传给工作进程"""
+
+    shm_name: str
+    """共享内存段名称"""
+    entries: List[Tuple[str, Tuple[int, int], int]]
+    """(图像名称, 尺寸, 偏移) 列表，像素格式固定为 RGBA"""
+
+
+def _release(shm: shared_memory.SharedMemory) -> None:
+    try:
+        shm.close()
+    finally:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedAssetStore:
+    """
+    持有共享内存段的一方（父进程）。关闭时解除映射并删除内存段；
+    即使忘记关闭，也会在对象回收或解释器退出时清理。
+    """
+
+    def __init__(self, images: Dict[str, Image.Image]):
+        layout = []
+        offset = 0
+        for name, img in images.items():
+            layout.append((name, img.size, offset))
+            offset += img.width * img.height * 4
+
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, offset))
+        for (name, size, off), img in zip(layout, images.values()):
+            data = img.convert("RGBA").tobytes("raw", "RGBA")
+            self._shm.buf[off : off + len(data)] = data
+
+        self.manifest = SharedAssetManifest(self._shm.name, layout)
+        # finalize 在对象回收或解释器退出时都会执行，且只执行一次
+        self._finalizer = weakref.finalize(self, _release, self._shm)
+
+    @classmethod
+    def from_config(cls, config: Config) -> "SharedAssetStore":
+        """解码配置中引用的全部底图与置顶图层（跳过不存在的文件）"""
+        images: Dict[str, Image.Image] = {}
+        for path in config.asset_paths():
+            if os.path.isfile(path):
+                with Image.open(path) as im:
+                    images[path] = im.convert("RGBA")
+        return cls(images)
+
+    @property
+    def size(self) -> int:
+        """共享内存段的字节数"""
+        return self._shm.size
+
+    def pool(self, processes: Optional[int] = None, context=None) -> Pool:
+        """
+        创建工作进程已附加到本内存段的进程池，工作进程中通过 worker_images() 取用图像。
+
+        : param context: multiprocessing 上下文，None 表示默认启动方式
+        """
+        ctx = context or multiprocessing
+        return ctx.Pool(processes, initializer=init_worker, initargs=(self.manifest,))
+
+    def close(self) -> None:
+        """解除映射并删除共享内存段（可重复调用）"""
+        self._finalizer()
+
+    def __enter__(self) -> "SharedAssetStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def attach(manifest: SharedAssetManifest) -> Tuple[shared_memory.SharedMemory, Dict[str, Image.Image]]:
+    """
+    附加到共享内存段并返回 (内存段, 名称 -> 只读图像)。
+    图像直接引用共享内存，调用方需在使用期间保持内存段对象存活。
+    """
+    # 内存段的生命周期只由创建方管理；进程池的工作进程与父进程共用同一个
+    # resource_tracker，附加时的重复登记不会导致工作进程退出时删除内存段
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=manifest.shm_name, track=False)
+    else:
+        shm = shared_memory.SharedMemory(name=manifest.shm_name)
+
+    images: Dict[str, Image.Image] = {}
+    for name, size, offset in manifest.entries:
+        length = size[0] * size[1] * 4
+        images[name] = Image.frombuffer(
+            "RGBA", size, shm.buf[offset : offset + length], "raw", "RGBA", 0, 1
+        )
+    return shm, images
+
+
+_worker_shm: Optional[shared_memory.SharedMemory] = None
+_worker_images: Dict[str, Image.Image] = {}
+
+
+def init_worker(manifest: SharedAssetManifest) -> None:
+    """进程池初始化函数：附加共享内存段"""
+    global _worker_shm, _worker_images
+    _worker_shm, _worker_images = attach(manifest)
+
+
+def worker_images() -> Dict[str, Image.Image]:
+    """工作进程中取得共享的只读图像"""
+    return _worker_images
+
+
+def memory_usage() -> Dict[str, int]:
+    """
+    返回当前进程的内存占用（字节）：rss 为常驻内存，private 为不与其他进程共享的部分。
+    优先使用 psutil，Linux 下没有 psutil 时读取 /proc/self/statm。
+    """
+    try:
+        import psutil
+    except ImportError:
+        psutil = None  # type: ignore
+    if psutil is not None:
+        info = psutil.Process().memory_full_info()
+        return {"rss": info.rss, "private": getattr(info, "uss", info.rss)}
+    with open("/proc/self/statm") as f:
+        _, resident, shared = (int(v) for v in f.read().split()[:3])
+    page = os.sysconf("SC_PAGE_SIZE")
+    return {"rss": resident * page, "private": (resident - shared) * page}
+
+
+def _touch_shared(_: int) -> Dict[str, int]:
+    # 读取每张图像的全部像素，模拟渲染时对底图的访问
+    for img in worker_images().values():
+        img.getextrema()
+    return memory_usage()
+
+
+def _decode_private(paths: List[str]) -> Dict[str, int]:
+    images = []
+    for path in paths:
+        with Image.open(path) as im:
+            images.append(im.convert("RGBA"))
+    for img in images:
+        img.getextrema()
+    return memory_usage()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="对比各工作进程自行解码与使用共享内存时的内存占用")
+    parser.add_argument("-c", "--config", default="config.yaml", help="配置文件路径")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="工作进程数")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    paths = [p for p in config.asset_paths() if os.path.isfile(p)]
+
+    def report(title: str, usages: List[Dict[str, int]]) -> None:
+        rss = sum(u["rss"] for u in usages) / len(usages) / 1024 / 1024
+        private = sum(u["private"] for u in usages) / len(usages) / 1024 / 1024
+        print(f"{title}: 每个工作进程平均 RSS {rss:.1f} MiB，独占 {private:.1f} MiB")
+
+    # 使用 spawn 启动全新的工作进程，避免 fork 继承父进程的堆内存干扰测量
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(args.workers) as pool:
+        report("各自解码", pool.map(_decode_private, [paths] * args.workers, chunksize=1))
+
+    with SharedAssetStore.from_config(config) as store, store.pool(args.workers, ctx) as pool:
+        print(f"共享内存段大小 {store.size / 1024 / 1024:.1f} MiB")
+        report("共享内存", pool.map(_touch_shared, range(args.workers), chunksize=1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+# filename: tests/conftest.py
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from hot_reload import RenderState, build_state  # noqa: E402
+
+
+@pytest.fixture
+def config_file(tmp_path) -> str:
+    """使用仓库内底图的配置文件（绝对路径），渲染缓存写入临时目录"""
+    base = os.path.join(ROOT, "BaseImages")
+    lines = ["baseimage_mapping:"]
+    for tag, name in (("#普通#", "base.png"), ("#开心#", "开心.png")):
+        lines.append(f'  "{tag}": "{os.path.join(base, name)}"')
+    lines += [
+        f'baseimage_file: "{os.path.join(base, "base.png")}"',
+        f'base_overlay_file: "{os.path.join(base, "base_overlay.png")}"',
+        f'render_cache_dir: "{tmp_path / "cache"}"',
+    ]
+    path = tmp_path / "config.yaml"
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path)
+
+
+@pytest.fixture
+def state(config_file) -> RenderState:
+    return build_state(config_file)
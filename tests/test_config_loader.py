@@ -0,0 +1,22 @@
+# filename: tests/test_config_loader.py
+import os
+
+from config_loader import Config, load_config
+
+from conftest import ROOT
+
+
+def test_shipped_config_paths_resolve():
+    config = load_config(os.path.join(ROOT, "config.yaml"))
+    for path in config.asset_paths():
+        assert os.path.isfile(os.path.join(ROOT, path)), path
+
+
+def test_backslash_paths_use_os_separator():
+    config = Config(
+        baseimage_mapping={"#a#": "BaseImages\\a.png"},
+        fallback_font_files=["fonts\\emoji.ttf"],
+    )
+    assert config.baseimage_mapping["#a#"] == os.path.join("BaseImages", "a.png")
+    assert config.fallback_font_files == [os.path.join("fonts", "emoji.ttf")]
+    assert config.baseimage_file == os.path.join("BaseImages", "base.png")
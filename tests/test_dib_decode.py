@@ -0,0 +1,101 @@
+# filename: tests/test_dib_decode.py
+import struct
+from typing import Sequence, Tuple
+
+import pytest
+
+from dib_decode import BI_BITFIELDS, BI_RGB, decode_dib, parse_dib_header
+
+RED, GREEN, BLUE, WHITE = (255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 255)
+
+
+def _info_header(
+    width: int, height: int, bit_count: int, compression: int = BI_RGB, colors_used: int = 0
+) -> bytes:
+    return struct.pack("<IiiHHIIiiII", 40, width, height, 1, bit_count, compression, 0, 0, 0, colors_used, 0)
+
+
+def _v5_header(width: int, height: int, masks: Tuple[int, int, int, int]) -> bytes:
+    head = struct.pack("<IiiHHIIiiII", 124, width, height, 1, 32, BI_BITFIELDS, 0, 0, 0, 0, 0)
+    head += struct.pack("<IIII", *masks)
+    return head + bytes(124 - len(head))
+
+
+def _rows(rows: Sequence[bytes]) -> bytes:
+    # 每行按 4 字节对齐
+    return b"".join(r + bytes(-len(r) % 4) for r in rows)
+
+
+def _palette(colors: Sequence[Tuple[int, int, int]]) -> bytes:
+    return b"".join(bytes((b, g, r, 0)) for r, g, b in colors)
+
+
+def _pixels(image) -> list:
+    return [image.getpixel((x, y)) for y in range(image.height) for x in range(image.width)]
+
+
+def test_1bit_palette():
+    # 2x2，自下而上：最后一行在前
+    data = _info_header(2, 2, 1) + _palette([RED, BLUE]) + _rows([bytes([0b01000000]), bytes([0b10000000])])
+    image = decode_dib(data)
+    assert image.mode == "P"
+    assert _pixels(image.convert("RGB")) == [BLUE, RED, RED, BLUE]
+
+
+def test_8bit_palette():
+    data = _info_header(3, 1, 8, colors_used=3) + _palette([RED, GREEN, BLUE]) + _rows([bytes([2, 1, 0])])
+    image = decode_dib(data)
+    assert image.mode == "P"
+    assert _pixels(image.convert("RGB")) == [BLUE, GREEN, RED]
+
+
+def test_24bit_bottom_up():
+    data = _info_header(1, 2, 24) + _rows([bytes((255, 0, 0)), bytes((0, 0, 255))])
+    image = decode_dib(data)
+    assert image.mode == "RGB"
+    assert _pixels(image) == [RED, BLUE]
+
+
+def test_24bit_top_down():
+    data = _info_header(1, -2, 24) + _rows([bytes((255, 0, 0)), bytes((0, 0, 255))])
+    assert parse_dib_header(data).top_down
+    assert _pixels(decode_dib(data)) == [BLUE, RED]
+
+
+def test_32bit_rgb_ignores_padding_byte():
+    data = _info_header(2, 1, 32) + bytes((0, 0, 255, 0, 255, 255, 255, 0))
+    image = decode_dib(data)
+    assert image.mode == "RGB"
+    assert _pixels(image) == [RED, WHITE]
+
+
+def test_16bit_bitfields_565():
+    masks = struct.pack("<III", 0xF800, 0x7E0, 0x1F)
+    data = _info_header(2, 1, 16, BI_BITFIELDS) + masks + struct.pack("<HH", 0xF800, 0x001F)
+    image = decode_dib(data)
+    assert _pixels(image) == [RED, BLUE]
+
+
+def _v5(alpha: Sequence[int]) -> bytes:
+    masks = (0xFF0000, 0xFF00, 0xFF, 0xFF000000)
+    body = bytes((0, 0, 255, alpha[0], 255, 0, 0, alpha[1]))
+    return _v5_header(2, 1, masks) + body
+
+
+def test_v5_alpha():
+    image = decode_dib(_v5([255, 128]))
+    assert image.mode == "RGBA"
+    assert _pixels(image) == [RED + (255,), BLUE + (128,)]
+
+
+@pytest.mark.parametrize("buffer", [bytes, bytearray])
+def test_v5_zero_alpha_is_opaque(buffer):
+    image = decode_dib(buffer(_v5([0, 0])))
+    assert image.mode == "RGB"
+    assert _pixels(image) == [RED, BLUE]
+
+
+def test_truncated_pixels():
+    data = _info_header(2, 2, 24) + bytes(6)
+    with pytest.raises(ValueError):
+        decode_dib(data)
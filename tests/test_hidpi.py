@@ -0,0 +1,29 @@
+# filename: tests/test_hidpi.py
+import gc
+
+from PIL import Image
+
+from hidpi import ScaledAssetCache
+
+
+def test_released_source_is_dropped():
+    cache = ScaledAssetCache()
+    source = Image.new("RGBA", (10, 10))
+    assert cache.get(source, 2).size == (20, 20)
+    assert cache.stats().entries == 1
+    del source
+    gc.collect()
+    assert cache.stats().entries == 0
+
+
+def test_release_while_lock_is_held():
+    # 弱引用回调在持有缓存锁的线程中触发时不能阻塞
+    cache = ScaledAssetCache()
+    source = Image.new("RGBA", (10, 10))
+    cache.get(source, 2)
+    with cache._lock:
+        del source
+        gc.collect()
+    other = Image.new("RGBA", (4, 4))
+    assert cache.get(other, 2).size == (8, 8)
+    assert cache.stats().entries == 1
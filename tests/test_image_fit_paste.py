@@ -0,0 +1,12 @@
+# filename: tests/test_image_fit_paste.py
+from PIL import Image
+
+from image_fit_paste import image_digest
+
+
+def test_digest_covers_every_pixel():
+    a = Image.new("RGB", (1000, 800), (10, 20, 30))
+    b = a.copy()
+    b.putpixel((999, 799), (10, 20, 31))
+    assert image_digest(a) != image_digest(b)
+    assert image_digest(a) == image_digest(a.copy())
@@ -0,0 +1,24 @@
+# filename: tests/test_pipeline.py
+from flight_recorder import FlightRecorder
+from render_core import render, render_pages
+
+
+def test_render_pages_records_paginated_message(state, tmp_path):
+    state = state._replace(config=state.config.model_copy(update={"text_min_font_size": 48}))
+    recorder = FlightRecorder(str(tmp_path / "fr.jsonl"))
+    text = "这是一段很长的文字，用来触发分页。" * 40
+    pages = list(render_pages(state, state.config.baseimage_file, text, None, recorder))
+    assert len(pages) > 1
+    records = recorder.records()
+    assert len(records) == 1
+    assert records[0].kind == "text"
+    assert records[0].output_bytes == sum(len(p) for p in pages)
+    assert records[0].render_ms > 0
+
+
+def test_render_pages_short_text_matches_render(state, tmp_path):
+    recorder = FlightRecorder(str(tmp_path / "fr.jsonl"))
+    base = state.config.baseimage_file
+    pages = list(render_pages(state, base, "你好", None, recorder))
+    assert pages == [render(state, base, "你好", None)]
+    assert len(recorder.records()) == 1
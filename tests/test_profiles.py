@@ -0,0 +1,28 @@
+# filename: tests/test_profiles.py
+import os
+import shutil
+
+from render_core.profiles import ProfileRegistry
+
+from conftest import ROOT
+
+
+def test_profile_paths_resolve_against_profile_dir(tmp_path, monkeypatch):
+    profile_dir = tmp_path / "角色"
+    shutil.copytree(os.path.join(ROOT, "BaseImages"), profile_dir / "BaseImages")
+    (profile_dir / "config.yaml").write_text(
+        'baseimage_mapping:\n  "#普通#": "BaseImages/base.png"\n'
+        'baseimage_file: "BaseImages/base.png"\n'
+        'base_overlay_file: "BaseImages/base_overlay.png"\n'
+        'font_file: "font.ttf"\n',
+        encoding="utf-8",
+    )
+    # 当前工作目录中没有这些文件
+    monkeypatch.chdir(tmp_path)
+
+    registry = ProfileRegistry({"a": os.path.join("角色", "config.yaml")})
+    config = registry.state("a").config
+    assert config.baseimage_file == os.path.join("角色", "BaseImages", "base.png")
+    assert config.font_file == os.path.join("角色", "font.ttf")
+    assert registry.state("a").images[config.base_overlay_file].mode == "RGBA"
+    assert registry.render("a", "你好").startswith(b"\x89PNG")
@@ -0,0 +1,21 @@
+# filename: tests/test_render_budget.py
+from PIL import Image
+
+import render_budget
+from render_budget import FAST_RESAMPLE, CostModel, RenderBudget, resize_image
+
+
+def test_cold_budget_degrades_huge_resize(monkeypatch):
+    # 启动后还没有任何观测值
+    monkeypatch.setattr(render_budget, "cost_model", CostModel())
+    budget = RenderBudget(100)
+    resized = resize_image(Image.new("RGB", (6000, 4000)), (400, 266), budget)
+    assert resized.size == (400, 266)
+    assert FAST_RESAMPLE in budget.degradations
+
+
+def test_observations_refine_defaults():
+    model = CostModel(alpha=0.5, defaults={"png": 1.0})
+    model.observe("png", 10, 0)
+    assert model.estimate("png", 10) == 5.0
+    assert model.estimate("unknown", 10) == 0.0
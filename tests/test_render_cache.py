@@ -0,0 +1,35 @@
+# filename: tests/test_render_cache.py
+import pytest
+
+from render_cache import render_key
+
+
+def _key(state, **updates):
+    config = state.config.model_copy(update=updates)
+    return render_key(config, config.baseimage_file, "你好")
+
+
+@pytest.mark.parametrize(
+    "updates",
+    [
+        {"render_deadline_ms": 50},
+        {"image_resample": "fast"},
+        {"baseimage_mapping": {"#其他#": "other.png"}},
+        {"hotkey": "ctrl+enter"},
+    ],
+)
+def test_key_ignores_fields_outside_text_rendering(state, updates):
+    assert _key(state, **updates) == _key(state)
+
+
+@pytest.mark.parametrize(
+    "updates",
+    [
+        {"png_compress_level": 1},
+        {"max_font_height": 32},
+        {"text_min_font_size": 20},
+        {"use_base_overlay": False},
+    ],
+)
+def test_key_covers_text_rendering_fields(state, updates):
+    assert _key(state, **updates) != _key(state)
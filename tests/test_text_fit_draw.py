@@ -0,0 +1,62 @@
+# filename: tests/test_text_fit_draw.py
+from PIL import Image, ImageDraw
+
+import text_fit_draw
+from render_budget import RenderBudget
+from text_fit_draw import ESTIMATED_LAYOUT, layout_text
+
+
+class ScriptedBudget(RenderBudget):
+    """would_exceed 依次返回给定的结果，用完后一直返回 last"""
+
+    def __init__(self, answers, last):
+        super().__init__(1000)
+        self.answers = list(answers)
+        self.last = last
+
+    def would_exceed(self, estimate_ms, share=1.0):
+        return self.answers.pop(0) if self.answers else self.last
+
+
+def _layout(monkeypatch, budget, fits_up_to=10):
+    # 精确测量时只有不超过 fits_up_to 的字号放得下，模拟估算严重偏大
+    sizes = []
+    measure = text_fit_draw._measure_wrapped.__wrapped__
+
+    def fake(mode, text, font_path, size, max_w, wrap_algorithm, line_spacing):
+        sizes.append(size)
+        lines, w, h, lh = measure(mode, text, font_path, size, max_w, wrap_algorithm, line_spacing)
+        return lines, w if size <= fits_up_to else max_w + 1, h, lh
+
+    monkeypatch.setattr(text_fit_draw, "_measure_wrapped", fake)
+    draw = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    layout = layout_text(draw, (0, 0), (400, 300), "估算偏大的文字" * 3, max_font_height=120, budget=budget)
+    return layout, sizes
+
+
+def test_estimated_layout_bisects_smaller_sizes(monkeypatch):
+    budget = ScriptedBudget([True, False], last=False)
+    layout, sizes = _layout(monkeypatch, budget)
+    assert ESTIMATED_LAYOUT in budget.degradations
+    assert layout.font_size == 10
+    assert len(sizes) <= 1 + sizes[0].bit_length()
+
+
+def test_estimated_layout_stops_at_deadline(monkeypatch):
+    budget = ScriptedBudget([True, False], last=True)
+    layout, sizes = _layout(monkeypatch, budget)
+    assert len(sizes) == 1
+    assert layout.font_size == sizes[0]
+
+
+def test_line_colors_match_per_line_scan():
+    text = "前面【括号跨行\n继续】后面 a]b [word] 【未闭合 tail"
+    lines = ["前面【括号跨", "行", "继续】后面", "a]b", "【word】", "【未闭合", "tail"]
+    colors = text_fit_draw.LineColors(text)
+    in_bracket = False
+    for line in lines:
+        expected, in_bracket = text_fit_draw.color_spans(line, in_bracket)
+        assert colors.line(line) == expected
+        assert colors.in_bracket == in_bracket
+    # 每一行都在原文中定位到了（没有退回逐行扫描）
+    assert colors._cursor == len(text)
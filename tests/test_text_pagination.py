@@ -0,0 +1,25 @@
+# filename: tests/test_text_pagination.py
+from PIL import Image, ImageDraw
+
+from text_fit_draw import _load_font, measure_block
+from text_pagination import paginate_text
+
+# 在这一宽度下贪心换行为 12 行，Knuth-Plass 换行为 13 行
+TEXT = (
+    "ffffff dddd ggggggg bb a dddd a ggggggg dddd dddd eeeee ggggggg "
+    "ggggggg a ffffff dddd ccc ffffff ggggggg bb"
+)
+WIDTH = 86
+
+
+def test_knuth_plass_pages_never_shrink_below_min_font_size():
+    draw = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    _, _, line_h = measure_block(draw, [], _load_font(None, 16), 0.15)
+    pages = list(
+        paginate_text(
+            draw, (0, 0), (WIDTH, 12 * line_h), TEXT, min_font_size=16, wrap_algorithm="knuth_plass"
+        )
+    )
+    assert len(pages) == 2
+    assert all(p.font_size == 16 for p in pages)
+    assert " ".join(ln.strip() for p in pages for ln in p.lines).split() == TEXT.split()
@@ -0,0 +1,43 @@
+# filename: tests/test_typing_animation.py
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from text_fit_draw import draw_text_auto
+from typing_animation import draw_text_typing
+
+
+def _kwargs(config):
+    return dict(
+        image_source=config.baseimage_file,
+        image_overlay=config.base_overlay_file,
+        top_left=config.text_box_topleft,
+        bottom_right=config.image_box_bottomright,
+        text="",
+        max_font_height=config.max_font_height,
+        font_path=config.font_spec(),
+        wrap_algorithm=config.text_wrap_algorithm,
+    )
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["AVAWAY To Tokyo, WAVY Type [LAVA] yes", "你好，[这是括号里的字]，然后是 Latin 文本。"],
+)
+def test_last_frame_matches_static_render(state, text):
+    kwargs = _kwargs(state.config)
+    kwargs["text"] = text
+    expected = Image.open(BytesIO(draw_text_auto(**kwargs))).convert("RGBA")
+    with Image.open(BytesIO(draw_text_typing(**kwargs, chars_per_frame=3))) as anim:
+        assert anim.n_frames > 2
+        anim.seek(anim.n_frames - 1)
+        last = anim.convert("RGBA")
+    assert last.tobytes() == expected.tobytes()
+
+
+def test_unknown_frame_format(state):
+    kwargs = _kwargs(state.config)
+    kwargs["text"] = "你好"
+    with pytest.raises(ValueError):
+        draw_text_typing(**kwargs, frame_format="WEBP")  # type: ignore[arg-type]
@@ -1,20 +1,46 @@
 # filename: text_fit_draw.py
+import itertools
 import os
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from functools import lru_cache
 from io import BytesIO
-from typing import List, Literal, Optional, Tuple, Union
+from typing import Deque, Dict, Iterable, Iterator, List, Literal, Mapping, NamedTuple, Optional, Tuple, Union
 
 from PIL import Image, ImageDraw, ImageFont
 
+from cache_registry import CacheStats, register_cache
+from font_fallback import ChainFont, get_font_chain
+from hidpi import scale_length, scale_point, scaled_asset
+from render_budget import (
+    DEFAULT_PNG_COMPRESS_LEVEL,
+    EARLY_STOP,
+    ESTIMATED_LAYOUT,
+    GREEDY_WRAP,
+    RenderBudget,
+    cost_model,
+    encode_png,
+)
+
 RGBColor = Tuple[int, int, int]
 
 Align = Literal["left", "center", "right"]
 VAlign = Literal["top", "middle", "bottom"]
 
 
-def _load_font(font_path: Optional[str], size: int) -> ImageFont.FreeTypeFont:
-    """
-    加载指定路径的字体文件，如果失败则加载默认字体。
-    """
+# 字体：单个字体文件路径，或 (主字体, 后备字体...) 组成的字体链
+FontSpec = Union[str, Tuple[str, ...], None]
+
+
+def _open_font(font_path: FontSpec, size: int) -> Union[ImageFont.FreeTypeFont, ChainFont]:
+    if isinstance(font_path, tuple):
+        paths = tuple(p for p in font_path if p and os.path.exists(p))
+        if len(paths) > 1:
+            return ChainFont(get_font_chain(paths), size)
+        font_path = paths[0] if paths else None
     if font_path and os.path.exists(font_path):
         return ImageFont.truetype(font_path, size=size)
     try:
@@ -23,17 +49,133 @@ def _load_font(font_path: Optional[str], size: int) -> ImageFont.FreeTypeFont:
         return ImageFont.load_default()  # type: ignore # 如果没有可用的 TTF 字体，则加载默认位图字体
 
 
-def wrap_lines(
+# 每个线程最多缓存的字体对象数
+FONT_POOL_SIZE = 128
+
+
+class _FontPool:
+    """一个线程的字体对象池与测量用草稿图"""
+
+    def __init__(self):
+        self.generation = -1
+        self.fonts: "OrderedDict[Tuple[FontSpec, int], Union[ImageFont.FreeTypeFont, ChainFont]]" = OrderedDict()
+        self.measure_draws: Dict[str, ImageDraw.ImageDraw] = {}
+
+
+# 各线程的字体池（线程结束后自动移除），只用于统计缓存占用
+_font_pools: "weakref.WeakSet[_FontPool]" = weakref.WeakSet()
+_font_pools_lock = threading.Lock()
+
+
+class _ThreadFonts(threading.local):
+    """每个线程独立的字体池（FreeType 字体对象不能跨线程共享）"""
+
+    def __init__(self):
+        self.pool = _FontPool()
+        with _font_pools_lock:
+            _font_pools.add(self.pool)
+
+
+_thread_fonts = _ThreadFonts()
+# clear_font_caches 每次调用递增，各线程发现代数变化时丢弃自己的字体池
+_generations = itertools.count(1)
+_font_generation = 0
+
+
+def _load_font(font_path: FontSpec, size: int) -> Union[ImageFont.FreeTypeFont, ChainFont]:
+    """
+    加载指定路径的字体文件，如果失败则加载默认字体。
+    传入多个路径时返回按字符覆盖自动切换的字体链（不存在的文件会被忽略）。
+    同一路径与字号的字体对象在当前线程内缓存复用，不同线程各自持有一份。
+    """
+    pool = _thread_fonts.pool
+    if pool.generation != _font_generation:
+        pool.fonts.clear()
+        pool.measure_draws.clear()
+        pool.generation = _font_generation
+    key = (font_path, size)
+    font = pool.fonts.get(key)
+    if font is not None:
+        pool.fonts.move_to_end(key)
+        return font
+    font = _open_font(font_path, size)
+    pool.fonts[key] = font
+    if len(pool.fonts) > FONT_POOL_SIZE:
+        pool.fonts.popitem(last=False)
+    return font
+
+
+def draw_text_with(
+    draw: ImageDraw.ImageDraw,
+    xy: Tuple[float, float],
+    text: str,
+    font: Union[ImageFont.FreeTypeFont, ChainFont],
+    fill: RGBColor,
+) -> None:
+    """用单个字体或字体链绘制一段文本"""
+    if isinstance(font, ChainFont):
+        font.draw_text(draw, xy, text, fill)
+    else:
+        draw.text(xy, text, font=font, fill=fill)
+
+
+def clear_font_caches() -> None:
+    """
+    清空字体对象与排版测量缓存。字体文件内容变化（路径不变）时需要调用。
+    可在任意线程调用，其他线程的字体池在下一次取用字体时丢弃。
+    """
+    global _font_generation
+    _font_generation = next(_generations)
+    _measure_wrapped.cache_clear()
+    get_font_chain.cache_clear()
+
+
+def clear_layout_cache() -> None:
+    """只清空排版测量缓存，保留已加载的字体（用于测量一条新消息的排版耗时）"""
+    _measure_wrapped.cache_clear()
+
+
+# str.splitlines 识别的全部换行符
+_LINE_BREAK = re.compile("\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+
+
+def _iter_paragraphs(txt: str) -> Iterator[str]:
+    # 与 txt.splitlines() or [""] 相同，但逐段产生，不预先切分整个文本
+    if not txt:
+        yield ""
+        return
+    pos = 0
+    for m in _LINE_BREAK.finditer(txt):
+        yield txt[pos:m.start()]
+        pos = m.end()
+    if pos < len(txt):
+        yield txt[pos:]
+
+
+def _iter_words(para: str) -> Iterator[str]:
+    # 与 para.split(" ") 相同，但逐个产生
+    pos = 0
+    while True:
+        end = para.find(" ", pos)
+        if end < 0:
+            yield para[pos:]
+            return
+        yield para[pos:end]
+        pos = end + 1
+
+
+def iter_wrap_lines(
     draw: ImageDraw.ImageDraw, txt: str, font: ImageFont.FreeTypeFont, max_w: int
-) -> List[str]:
+) -> Iterator[str]:
     """
-    将文本按指定宽度拆分为多行。
+    与 wrap_lines 相同的贪心换行，但逐行产生结果：只处理到取出的最后一行为止，
+    适合只需要前几行（例如分页）的超长文本。
     """
-    lines: List[str] = []
+    last: Optional[str] = None
 
-    for para in txt.splitlines() or [""]:
+    for para in _iter_paragraphs(txt):
         has_space = " " in para
-        units = para.split(" ") if has_space else list(para)
+        units = _iter_words(para) if has_space else iter(para)
         buf = ""
 
         def unit_join(a: str, b: str) -> str:
@@ -52,7 +194,8 @@ def wrap_lines(
 
             # 否则先将缓冲区内容作为一行输出
             if buf:
-                lines.append(buf)
+                last = buf
+                yield buf
 
             # 处理当前单元
             if has_space and len(u) > 1:
@@ -63,7 +206,8 @@ def wrap_lines(
                         continue
 
                     if tmp:
-                        lines.append(tmp)
+                        last = tmp
+                        yield tmp
                     tmp = ch
                 buf = tmp
                 continue
@@ -71,13 +215,24 @@ def wrap_lines(
             if draw.textlength(u, font=font) <= max_w:
                 buf = u
             else:
-                lines.append(u)
+                last = u
+                yield u
                 buf = ""
         if buf != "":
-            lines.append(buf)
-        if para == "" and (not lines or lines[-1] != ""):
-            lines.append("")
-    return lines
+            last = buf
+            yield buf
+        if para == "" and last != "":
+            last = ""
+            yield ""
+
+
+def wrap_lines(
+    draw: ImageDraw.ImageDraw, txt: str, font: ImageFont.FreeTypeFont, max_w: int
+) -> List[str]:
+    """
+    将文本按指定宽度拆分为多行。
+    """
+    return list(iter_wrap_lines(draw, txt, font, max_w))
 
 
 def _is_bracket_token(tok: str) -> bool:
@@ -156,6 +311,35 @@ def _split_long_token(draw: ImageDraw.ImageDraw, token: str, font: ImageFont.Fre
     return parts
 
 
+# 一次扫描切分 token：括号 token（可能缺少右括号）、可带右括号的英文单词、单独的右括号、其余单个字符
+_TOKEN_PATTERN = re.compile(r"[【\[][^【\[】\]]*[】\]]?|[A-Za-z]+[】\]]?|[】\]]|.", re.DOTALL)
+# token 中的英文括号统一为中文括号
+_BRACKET_NORMALIZE = str.maketrans("[]", "【】")
+
+
+class Token(NamedTuple):
+    """tokenize 的逻辑切分单元"""
+
+    text: str
+    """token 文本（英文括号已替换为中文括号）"""
+    start: int
+    """在原文中的起始偏移"""
+    end: int
+    """在原文中的结束偏移（不含）"""
+
+
+def iter_tokens(text: str) -> Iterator[Token]:
+    """
+    按逻辑切分 token（保括号），给出每个 token 在原文中的 (start, end) 偏移。
+    括号及括号内的内容（含空白）为一个 token，英文字母连成单词，其余每个字符单独成为 token。
+    """
+    for m in _TOKEN_PATTERN.finditer(text):
+        tok = m.group()
+        if "[" in tok or "]" in tok:
+            tok = tok.translate(_BRACKET_NORMALIZE)
+        yield Token(tok, m.start(), m.end())
+
+
 def tokenize(
         draw: ImageDraw.ImageDraw, text: str, font: ImageFont.FreeTypeFont, max_w: int
 ) -> List[str]:
@@ -164,45 +348,9 @@ def tokenize(
     然后对每个 token 检查宽度，必要时用 _split_long_token 拆分。
     返回最终可供 DP 使用的 token 列表（保证每个 token 宽度尽量 <= max_w）。
     """
-    tokens = []
-    buf = ""
-    in_bracket = False
-    for ch in text:
-        if ch in "【[":
-            if buf:
-                tokens.append(buf)
-            buf = "【"
-            in_bracket = True
-        elif ch in "】]":
-            buf += "】"
-            tokens.append(buf)
-            buf = ""
-            in_bracket = False
-        elif in_bracket:
-            buf += ch
-        elif ch.isspace():
-            if buf:
-                tokens.append(buf)
-                buf = ""
-            # preserve single space as token so DP can consider spaces explicitly if you want
-            tokens.append(ch)
-        else:
-            # treat ASCII letters as part of word, else treat single char
-            if ch.isascii() and ch.isalpha():
-                buf += ch
-            else:
-                if buf:
-                    tokens.append(buf)
-                    buf = ""
-                tokens.append(ch)
-    if buf:
-        tokens.append(buf)
-
-    # now split tokens that are too long
     final_tokens: List[str] = []
-    for tok in tokens:
-        if tok == "":
-            continue
+    for token in iter_tokens(text):
+        tok = token.text
         if draw.textlength(tok, font=font) <= max_w:
             final_tokens.append(tok)
         else:
@@ -273,6 +421,109 @@ def wrap_lines_knuth_plass(
     return lines
 
 
+_BRACKET_CHARS = re.compile(r"[\[【\]】]")
+_OPEN_BRACKETS = "[【"
+
+
+def color_spans(s: str, in_bracket: bool) -> Tuple[List[Tuple[int, int, bool]], bool]:
+    """
+    把字符串划分为同色区间 (start, end, 是否使用括号颜色)，并返回结尾处是否仍在括号内。
+    每个括号字符单独成为一个区间；右括号之前的文字总是使用括号颜色。
+    """
+    spans: List[Tuple[int, int, bool]] = []
+    pos = 0
+    for m in _BRACKET_CHARS.finditer(s):
+        i = m.start()
+        is_open = s[i] in _OPEN_BRACKETS
+        if i > pos:
+            spans.append((pos, i, in_bracket or not is_open))
+        spans.append((i, i + 1, True))
+        in_bracket = is_open
+        pos = i + 1
+    if pos < len(s):
+        spans.append((pos, len(s), in_bracket))
+    return spans, in_bracket
+
+
+Span = Tuple[int, int, bool]
+"""同色区间：(起始, 结束, 是否使用括号颜色)，偏移相对于所在行"""
+
+# 换行时可能被丢弃的字符（段落间的换行符与单词间的空格）
+_DROPPED_AT_BREAK = frozenset(" \r\n\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029")
+
+
+class LineColors:
+    """
+    整段文字的着色：括号位置取自 iter_tokens 给出的 token 偏移，只扫描一遍原文；
+    换行后的各行按顺序在原文中定位，按偏移切出该行的同色区间（与逐行 color_spans 的结果相同）。
+
+    token 按需取出，只处理到已定位的最后一行为止，分页时可在各页之间共用同一个对象。
+    无法在原文中定位的行（例如调用方传入的不是这段文字的换行结果）退回逐行扫描。
+    """
+
+    def __init__(self, text: str, in_bracket: bool = False):
+        self.text = text
+        self.in_bracket = in_bracket
+        """已取出的最后一行结尾处是否仍在括号内"""
+        self._tokens = iter_tokens(text)
+        self._marks: Deque[Tuple[int, bool]] = deque()  # (偏移, 是否为左括号)
+        self._scanned = 0
+        self._cursor = 0
+
+    def _pull(self, end: int) -> None:
+        # 取出起点在 end 之前的 token，记录其中括号字符的位置
+        while self._scanned < end:
+            token = next(self._tokens, None)
+            if token is None:
+                self._scanned = len(self.text)
+                return
+            first, last = token.text[0], token.text[-1]
+            if first in "【】":
+                self._marks.append((token.start, first == "【"))
+            if last == "】" and token.end - token.start > 1:
+                self._marks.append((token.end - 1, False))
+            self._scanned = token.end
+
+    def _locate(self, line: str) -> int:
+        # 从上一行结尾起跳过换行时丢弃的字符，找到与该行相同（括号统一后）的位置
+        text, pos = self.text, self._cursor
+        target = line.translate(_BRACKET_NORMALIZE)
+        while True:
+            if text[pos : pos + len(line)].translate(_BRACKET_NORMALIZE) == target:
+                return pos
+            if pos >= len(text) or text[pos] not in _DROPPED_AT_BREAK:
+                return -1
+            pos += 1
+
+    def line(self, line: str) -> List[Span]:
+        """下一行的同色区间，并更新 in_bracket"""
+        start = self._locate(line)
+        if start < 0:
+            spans, self.in_bracket = color_spans(line, self.in_bracket)
+            return spans
+        end = start + len(line)
+        self._pull(end)
+        marks = self._marks
+        while marks and marks[0][0] < start:
+            marks.popleft()
+        spans: List[Span] = []
+        pos = 0
+        in_bracket = self.in_bracket
+        while marks and marks[0][0] < end:
+            offset, is_open = marks.popleft()
+            i = offset - start
+            if i > pos:
+                spans.append((pos, i, in_bracket or not is_open))
+            spans.append((i, i + 1, True))
+            in_bracket = is_open
+            pos = i + 1
+        if pos < len(line):
+            spans.append((pos, len(line), in_bracket))
+        self.in_bracket = in_bracket
+        self._cursor = end
+        return spans
+
+
 def parse_color_segments(
     s: str, in_bracket: bool, bracket_color: RGBColor, color: RGBColor
 ) -> Tuple[List[Tuple[str, RGBColor]], bool]:
@@ -280,25 +531,8 @@ def parse_color_segments(
     解析字符串为带颜色信息的片段列表。
     中括号及其内部内容使用 bracket_color。
     """
-    segs: List[Tuple[str, RGBColor]] = []
-    buf = ""
-    for ch in s:
-        if ch == "[" or ch == "【":
-            if buf:
-                segs.append((buf, bracket_color if in_bracket else color))
-                buf = ""
-            segs.append((ch, bracket_color))
-            in_bracket = True
-        elif ch == "]" or ch == "】":
-            if buf:
-                segs.append((buf, bracket_color))
-                buf = ""
-            segs.append((ch, bracket_color))
-            in_bracket = False
-        else:
-            buf += ch
-    if buf:
-        segs.append((buf, bracket_color if in_bracket else color))
+    spans, in_bracket = color_spans(s, in_bracket)
+    segs = [(s[a:b], bracket_color if bracket else color) for a, b, bracket in spans]
     return segs, in_bracket
 
 
@@ -322,94 +556,296 @@ def measure_block(
     return max_w, total_h, line_h
 
 
-def draw_text_auto(
-    image_source: Union[str, Image.Image],
+class TextLayout(NamedTuple):
+    """
+    文本排版结果，只与文本、字体和文字区域有关，与底图无关，
+    可以在多张底图上重复绘制。
+    """
+
+    font_size: int
+    """选定的字号"""
+    lines: List[str]
+    """换行后的各行文本"""
+    line_h: int
+    """行高"""
+    block_h: int
+    """文本块总高度"""
+    block_w: int
+    """文本块最大行宽"""
+    top_left: Tuple[int, int]
+    """文字区域左上角"""
+    bottom_right: Tuple[int, int]
+    """文字区域右下角"""
+
+
+def _wrap(
+    draw: ImageDraw.ImageDraw,
+    text: str,
+    font: ImageFont.FreeTypeFont,
+    max_w: int,
+    wrap_algorithm: str,
+) -> List[str]:
+    # 根据配置选择换行算法
+    if wrap_algorithm == "knuth_plass":
+        return wrap_lines_knuth_plass(draw, text, font, max_w)
+    return wrap_lines(draw, text, font, max_w)
+
+
+def _open_image(source: Union[str, BytesIO, Image.Image]) -> Image.Image:
+    if isinstance(source, Image.Image):
+        return source.copy()
+    return Image.open(source).convert("RGBA")
+
+
+def _open_overlay(image_overlay: Union[str, Image.Image, None]) -> Optional[Image.Image]:
+    if image_overlay is None:
+        return None
+    if isinstance(image_overlay, Image.Image):
+        return image_overlay.copy()
+    if os.path.isfile(image_overlay):
+        return Image.open(image_overlay).convert("RGBA")
+    return None
+
+
+def _measure_draw(mode: str) -> ImageDraw.ImageDraw:
+    # 文字宽度只与图像模式有关，使用 1x1 的草稿图测量；草稿图与字体一样按线程持有
+    draws = _thread_fonts.pool.measure_draws
+    draw = draws.get(mode)
+    if draw is None:
+        draw = ImageDraw.Draw(Image.new(mode, (1, 1)))
+        draws[mode] = draw
+    return draw
+
+
+@lru_cache(maxsize=512)
+def _measure_wrapped(
+    mode: str,
+    text: str,
+    font_path: FontSpec,
+    size: int,
+    max_w: int,
+    wrap_algorithm: str,
+    line_spacing: float,
+) -> Tuple[Tuple[str, ...], int, int, int]:
+    """
+    以指定字号换行并测量文本块，返回 (各行, 宽度, 高度, 行高)。
+
+    结果只取决于参数本身，因此缓存起来供不同区域、不同底图的排版复用。
+    缓存的是不可变的元组，lru_cache 自身是线程安全的，可在多个线程间共享。
+    """
+    start = time.perf_counter()
+    draw = _measure_draw(mode)
+    font = _load_font(font_path, size)
+    lines = _wrap(draw, text, font, max_w, wrap_algorithm)
+    w, h, lh = measure_block(draw, lines, font, line_spacing)
+    cost_model.observe(f"measure:{wrap_algorithm}", len(text), (time.perf_counter() - start) * 1000)
+    return tuple(lines), w, h, lh
+
+
+def _font_pool_stats() -> CacheStats:
+    with _font_pools_lock:
+        pools = list(_font_pools)
+    return CacheStats(max((len(p.fonts) for p in pools), default=0))
+
+
+register_cache(
+    "text_fit_draw.font_pool",
+    _font_pool_stats,
+    max_entries=FONT_POOL_SIZE,
+    description="每个线程缓存的字体对象数（取最多的线程）",
+)
+register_cache(
+    "text_fit_draw.measure_wrapped",
+    lambda: CacheStats(_measure_wrapped.cache_info().currsize),
+    max_entries=512,
+    description="按字号换行测量的结果",
+)
+
+
+class GlyphAdvanceDraw:
+    """
+    只用于测量的绘图对象替身：文本宽度按逐字符缓存的字宽累加估算（忽略字距调整）。
+
+    每个字号下每个字符只调用一次 FreeType，适合需要对大量候选区域做排版测量、
+    且允许少量误差的场景（例如图文混排选择分割方案）。缓存随实例释放。
+    """
+
+    def __init__(self, mode: str = "RGBA"):
+        self.mode = mode
+        self._draw = ImageDraw.Draw(Image.new(mode, (1, 1)))
+        self._advances: Dict[ImageFont.FreeTypeFont, Dict[str, float]] = {}
+
+    def textlength(self, text: str, font: ImageFont.FreeTypeFont) -> float:
+        advances = self._advances.setdefault(font, {})
+        total = 0.0
+        for ch in text:
+            w = advances.get(ch)
+            if w is None:
+                w = self._draw.textlength(ch, font=font)
+                advances[ch] = w
+            total += w
+        return total
+
+
+def layout_text(
+    draw: Union[ImageDraw.ImageDraw, GlyphAdvanceDraw],
     top_left: Tuple[int, int],
     bottom_right: Tuple[int, int],
     text: str,
-    color: RGBColor = (0, 0, 0),
     max_font_height: Optional[int] = None,
-    font_path: Optional[str] = None,
-    align: Align = "center",
-    valign: VAlign = "middle",
+    font_path: FontSpec = None,
     line_spacing: float = 0.15,
-    bracket_color: RGBColor = (128, 0, 128),  # 中括号及内部内容颜色
-    image_overlay: Union[str, Image.Image, None] = None,
-    wrap_algorithm: str = "original"  # 新增参数，用于选择换行算法
-) -> bytes:
-    """
-    在指定矩形内自适应字号绘制文本；
-    中括号及括号内文字使用 bracket_color。
+    wrap_algorithm: str = "original",
+    budget: Optional[RenderBudget] = None,
+) -> TextLayout:
     """
+    在指定矩形内搜索能放下文本的最大字号并完成换行，不进行任何绘制。
 
-    # --- 1. 打开图像 ---
-    if isinstance(image_source, Image.Image):
-        img = image_source.copy()
-    else:
-        img = Image.open(image_source).convert("RGBA")
-    draw = ImageDraw.Draw(img)
-
-    if image_overlay is not None:
-        if isinstance(image_overlay, Image.Image):
-            img_overlay = image_overlay.copy()
-        else:
-            img_overlay = (
-                Image.open(image_overlay).convert("RGBA")
-                if os.path.isfile(image_overlay)
-                else None
-            )
-    else:
-        img_overlay = None
-
+    : param draw: 仅用于测量的绘图对象，不会在其上绘制；传入 GlyphAdvanceDraw 时使用估算宽度
+    : param budget: 可选的时限；预计排版会超出时限的 layout_share 比例时，
+                    改用估算宽度搜索字号、Knuth-Plass 改用贪心换行，或在已找到可用字号时提前结束搜索
+    """
     x1, y1 = top_left
     x2, y2 = bottom_right
     if not (x2 > x1 and y2 > y1):
         raise ValueError("无效的文字区域。")
     region_w, region_h = x2 - x1, y2 - y1
+    mode = draw.mode
+    wrap = wrap_algorithm
 
-    # --- 2. 搜索最大字号 ---
+    def measure_estimate() -> float:
+        return cost_model.estimate(f"measure:{wrap}", len(text))
+
+    def measure(size: int) -> Tuple[Tuple[str, ...], int, int, int]:
+        nonlocal wrap
+        if (
+            budget is not None
+            and wrap == "knuth_plass"
+            and budget.would_exceed(measure_estimate(), budget.layout_share)
+        ):
+            wrap = "original"
+            budget.degrade(GREEDY_WRAP)
+        if isinstance(draw, GlyphAdvanceDraw):
+            font = _load_font(font_path, size)
+            lines = _wrap(draw, text, font, region_w, wrap)  # type: ignore[arg-type]
+            w, h, lh = measure_block(draw, lines, font, line_spacing)  # type: ignore[arg-type]
+            return tuple(lines), w, h, lh
+        return _measure_wrapped(mode, text, font_path, size, region_w, wrap, line_spacing)
+
+    # --- 搜索最大字号 ---
     hi = min(region_h, max_font_height) if max_font_height else region_h
-    lo, best_size, best_lines, best_line_h, best_block_h = 1, 0, [], 0, 0
+
+    if (
+        budget is not None
+        and not isinstance(draw, GlyphAdvanceDraw)
+        and budget.would_exceed(measure_estimate() * hi.bit_length(), budget.layout_share)
+    ):
+        # 逐次精确测量来不及完成：用逐字符字宽估算搜索字号，只对结果精确测量，
+        # 估算偏小（忽略字距调整）放不下时逐级缩小字号；连一次精确测量都来不及时直接使用估算结果
+        budget.degrade(ESTIMATED_LAYOUT)
+        estimated = layout_text(
+            GlyphAdvanceDraw(mode),
+            top_left,
+            bottom_right,
+            text,
+            max_font_height=max_font_height,
+            font_path=font_path,
+            line_spacing=line_spacing,
+            wrap_algorithm=wrap,
+        )
+        if budget.would_exceed(measure_estimate(), budget.layout_share):
+            return estimated
+        size = estimated.font_size
+        lines, w, h, lh = measure(size)
+        if w <= region_w and h <= region_h:
+            return TextLayout(size, list(lines), lh, h, w, top_left, bottom_right)
+        # 在更小的字号中二分查找，每次测量前检查时限，来不及时使用已找到的字号或估算结果
+        lo, hi = 1, size - 1
+        fitted: Optional[TextLayout] = None
+        while lo <= hi:
+            if budget.would_exceed(measure_estimate(), budget.layout_share):
+                return fitted or estimated
+            mid = (lo + hi) // 2
+            lines, w, h, lh = measure(mid)
+            if w <= region_w and h <= region_h:
+                fitted = TextLayout(mid, list(lines), lh, h, w, top_left, bottom_right)
+                lo = mid + 1
+            else:
+                hi = mid - 1
+        if fitted is None:
+            # 字号 1 也放不下（最后一次测量的就是字号 1）
+            return TextLayout(1, list(lines), 1, 1, w, top_left, bottom_right)
+        return fitted
+
+    lo, best_size, best_lines, best_line_h, best_block_h, best_block_w = 1, 0, (), 0, 0, 0
 
     while lo <= hi:
+        if (
+            budget is not None
+            and best_size
+            and budget.would_exceed(measure_estimate(), budget.layout_share)
+        ):
+            # 再测量一次就会超出排版时限，使用已找到的最大可用字号
+            budget.degrade(EARLY_STOP)
+            break
         mid = (lo + hi) // 2
-        font = _load_font(font_path, mid)
-        # 根据配置选择换行算法
-        if wrap_algorithm == "knuth_plass":
-            lines = wrap_lines_knuth_plass(draw, text, font, region_w)
-        else:
-            lines = wrap_lines(draw, text, font, region_w)
-        w, h, lh = measure_block(draw, lines, font, line_spacing)
+        lines, w, h, lh = measure(mid)
         if w <= region_w and h <= region_h:
-            best_size, best_lines, best_line_h, best_block_h = mid, lines, lh, h
+            best_size, best_lines, best_line_h, best_block_h, best_block_w = mid, lines, lh, h, w
             lo = mid + 1
         else:
             hi = mid - 1
 
     if best_size == 0:
-        font = _load_font(font_path, 1)
-        # 根据配置选择换行算法
-        if wrap_algorithm == "knuth_plass":
-            best_lines = wrap_lines_knuth_plass(draw, text, font, region_w)
-        else:
-            best_lines = wrap_lines(draw, text, font, region_w)
+        best_lines, best_block_w, _, _ = measure(1)
         best_block_h, best_line_h = 1, 1
         best_size = 1
-    else:
-        font = _load_font(font_path, best_size)
 
-    # --- 3. 垂直对齐 ---
+    return TextLayout(
+        best_size,
+        list(best_lines),
+        best_line_h,
+        best_block_h,
+        best_block_w,
+        top_left,
+        bottom_right,
+    )
+
+
+def text_runs(
+    draw: ImageDraw.ImageDraw,
+    layout: TextLayout,
+    font: ImageFont.FreeTypeFont,
+    color: RGBColor = (0, 0, 0),
+    align: Align = "center",
+    valign: VAlign = "middle",
+    bracket_color: RGBColor = (128, 0, 128),
+    in_bracket: bool = False,
+    colors: Optional[LineColors] = None,
+) -> Iterator[Tuple[int, int, str, RGBColor]]:
+    """
+    按排版结果依次给出每个同色片段的绘制位置：(x, y, 文本, 颜色)。
+    colors 为整段文字的着色（分页时各页共用）；未传入时按本页各行构造，
+    in_bracket 为 True 表示文本开头处于括号内（例如接续上一页的括号）。
+    """
+    if colors is None:
+        colors = LineColors("\n".join(layout.lines), in_bracket)
+    # 先取出全部行的区间，提前结束绘制时着色进度也与排版一致
+    line_spans = [colors.line(ln) for ln in layout.lines]
+    x1, y1 = layout.top_left
+    x2, y2 = layout.bottom_right
+    region_w, region_h = x2 - x1, y2 - y1
+
+    # --- 垂直对齐 ---
     if valign == "top":
         y_start = y1
     elif valign == "middle":
-        y_start = y1 + (region_h - best_block_h) // 2
+        y_start = y1 + (region_h - layout.block_h) // 2
     else:
-        y_start = y2 - best_block_h
+        y_start = y2 - layout.block_h
 
-    # --- 4. 绘制 ---
     y = y_start
-    in_bracket = False
-    for ln in best_lines:
+    for ln, spans in zip(layout.lines, line_spans):
         line_w = int(draw.textlength(ln, font=font))
         if align == "left":
             x = x1
@@ -417,24 +853,183 @@ def draw_text_auto(
             x = x1 + (region_w - line_w) // 2
         else:
             x = x2 - line_w
-        segments, in_bracket = parse_color_segments(
-            ln, in_bracket, bracket_color, color
-        )
-        for seg_text, seg_color in segments:
-            if seg_text:
-                draw.text((x, y), seg_text, font=font, fill=seg_color)
-                x += int(draw.textlength(seg_text, font=font))
-        y += best_line_h
+        for a, b, bracket in spans:
+            seg_text = ln[a:b]
+            seg_color = bracket_color if bracket else color
+            yield x, y, seg_text, seg_color
+            x += int(draw.textlength(seg_text, font=font))
+        y += layout.line_h
         if y - y_start > region_h:
             break
 
+
+def paint_text(
+    img: Image.Image,
+    layout: TextLayout,
+    color: RGBColor = (0, 0, 0),
+    font_path: FontSpec = None,
+    align: Align = "center",
+    valign: VAlign = "middle",
+    bracket_color: RGBColor = (128, 0, 128),
+    in_bracket: bool = False,
+    colors: Optional[LineColors] = None,
+) -> None:
+    """
+    按已经计算好的排版结果在图像上绘制文本（原地修改 img）。
+    in_bracket 与 colors 的含义见 text_runs。
+    """
+    draw = ImageDraw.Draw(img)
+    font = _load_font(font_path, layout.font_size)
+    for x, y, seg_text, seg_color in text_runs(
+        draw, layout, font, color, align, valign, bracket_color, in_bracket, colors
+    ):
+        draw_text_with(draw, (x, y), seg_text, font, seg_color)
+
+
+def _apply_overlay(
+    img: Image.Image,
+    image_overlay: Union[str, Image.Image, None],
+    img_overlay: Optional[Image.Image],
+) -> None:
     # 覆盖置顶图层（如果有）
     if image_overlay is not None and img_overlay is not None:
         img.paste(img_overlay, (0, 0), img_overlay)
     elif image_overlay is not None and img_overlay is None:
         print("Warning: overlay image is not exist.")
 
-    # --- 5. 输出 PNG ---
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    return buf.getvalue()
+
+def draw_text_auto(
+    image_source: Union[str, Image.Image],
+    top_left: Tuple[int, int],
+    bottom_right: Tuple[int, int],
+    text: str,
+    color: RGBColor = (0, 0, 0),
+    max_font_height: Optional[int] = None,
+    font_path: FontSpec = None,
+    align: Align = "center",
+    valign: VAlign = "middle",
+    line_spacing: float = 0.15,
+    bracket_color: RGBColor = (128, 0, 128),  # 中括号及内部内容颜色
+    image_overlay: Union[str, Image.Image, None] = None,
+    wrap_algorithm: str = "original",  # 新增参数，用于选择换行算法
+    budget: Optional[RenderBudget] = None,
+    scale: float = 1.0,
+    png_compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL,
+) -> bytes:
+    """
+    在指定矩形内自适应字号绘制文本；
+    中括号及括号内文字使用 bracket_color。
+    可在多个线程中并发调用，image_source 与 image_overlay 只会被读取。
+
+    传入 budget 时，预计会超时的步骤会降低质量（见 render_budget），
+    实际采用的降级措施记录在 budget.degradations 中。
+
+    scale 为 HiDPI 倍数：坐标与 max_font_height 按 1 倍底图给出，
+    底图与置顶图层使用按倍数预先缩放并缓存的版本（见 hidpi）。
+
+    png_compress_level 为 PNG 压缩等级（0~9），等级越低编码越快、文件越大。
+    """
+    if scale != 1:
+        image_source = scaled_asset(image_source, scale)
+        image_overlay = scaled_asset(image_overlay, scale)
+        top_left = scale_point(top_left, scale)
+        bottom_right = scale_point(bottom_right, scale)
+        if max_font_height is not None:
+            max_font_height = scale_length(max_font_height, scale)
+
+    # --- 1. 打开图像 ---
+    img = _open_image(image_source)
+    img_overlay = _open_overlay(image_overlay)
+
+    # --- 2. 排版 ---
+    layout = layout_text(
+        ImageDraw.Draw(img),
+        top_left,
+        bottom_right,
+        text,
+        max_font_height=max_font_height,
+        font_path=font_path,
+        line_spacing=line_spacing,
+        wrap_algorithm=wrap_algorithm,
+        budget=budget,
+    )
+
+    # --- 3. 绘制 ---
+    paint_text(
+        img, layout, color, font_path, align, valign, bracket_color, colors=LineColors(text)
+    )
+    _apply_overlay(img, image_overlay, img_overlay)
+
+    # --- 4. 输出 PNG ---
+    return encode_png(img, budget, png_compress_level)
+
+
+def draw_text_variants(
+    image_sources: Mapping[str, Union[str, Image.Image]],
+    top_left: Tuple[int, int],
+    bottom_right: Tuple[int, int],
+    text: str,
+    names: Optional[Iterable[str]] = None,
+    color: RGBColor = (0, 0, 0),
+    max_font_height: Optional[int] = None,
+    font_path: FontSpec = None,
+    align: Align = "center",
+    valign: VAlign = "middle",
+    line_spacing: float = 0.15,
+    bracket_color: RGBColor = (128, 0, 128),
+    image_overlay: Union[str, Image.Image, None] = None,
+    wrap_algorithm: str = "original",
+    contact_sheet: bool = False,
+    sheet_columns: int = 4,
+) -> Union[Dict[str, bytes], bytes]:
+    """
+    将同一段文本绘制到多张底图上（例如预览全部表情差分）。
+
+    排版（字号搜索与换行）只计算一次，之后在每张底图上直接绘制。
+
+    : param image_sources: 名称 -> 底图，例如 config.baseimage_mapping
+    : param names: 只渲染其中的部分名称，None 表示全部
+    : param contact_sheet: True 时把所有结果拼成一张总览图并返回其 PNG bytes
+    : param sheet_columns: 总览图每行的图片数
+
+    返回：名称 -> PNG bytes 的字典，或总览图的 PNG bytes。
+    """
+    selected = list(image_sources) if names is None else list(names)
+    for name in selected:
+        if name not in image_sources:
+            raise KeyError(f"未知的底图名称: {name}")
+    if not selected:
+        raise ValueError("没有需要渲染的底图。")
+
+    img_overlay = _open_overlay(image_overlay)
+    layout: Optional[TextLayout] = None
+    canvases: Dict[str, Image.Image] = {}
+    for name in selected:
+        img = _open_image(image_sources[name])
+        if layout is None:
+            layout = layout_text(
+                ImageDraw.Draw(img),
+                top_left,
+                bottom_right,
+                text,
+                max_font_height=max_font_height,
+                font_path=font_path,
+                line_spacing=line_spacing,
+                wrap_algorithm=wrap_algorithm,
+            )
+        paint_text(img, layout, color, font_path, align, valign, bracket_color)
+        _apply_overlay(img, image_overlay, img_overlay)
+        canvases[name] = img
+
+    if not contact_sheet:
+        return {name: encode_png(img) for name, img in canvases.items()}
+
+    # 拼接总览图：按最大单元尺寸排成网格
+    cell_w = max(img.width for img in canvases.values())
+    cell_h = max(img.height for img in canvases.values())
+    cols = max(1, min(sheet_columns, len(canvases)))
+    rows = (len(canvases) + cols - 1) // cols
+    sheet = Image.new("RGBA", (cell_w * cols, cell_h * rows), (255, 255, 255, 255))
+    for i, img in enumerate(canvases.values()):
+        sheet.paste(img, ((i % cols) * cell_w, (i // cols) * cell_h))
+    return encode_png(sheet)
@@ -0,0 +1,194 @@
+# filename: text_pagination.py
+"""
+分页绘制：文本在最小可读字号下一页放不下时，不再把字号一路缩小到看不清，
+而是以最小可读字号把文本依次切分为多页，每确定一页就立即绘制并产出。
+
+换行是逐行进行的（iter_wrap_lines；Knuth-Plass 逐段落进行），生成每一页只需处理该页的文字，
+因此无论文本多长，首页的耗时与内存占用都基本不变。
+"""
+from typing import Iterator, List, Optional, Tuple, Union
+
+from PIL import Image, ImageDraw, ImageFont
+
+from hidpi import scale_length, scale_point, scaled_asset
+from render_budget import DEFAULT_PNG_COMPRESS_LEVEL, RenderBudget, encode_png
+from text_fit_draw import (
+    Align,
+    FontSpec,
+    GlyphAdvanceDraw,
+    LineColors,
+    RGBColor,
+    TextLayout,
+    VAlign,
+    _apply_overlay,
+    _iter_paragraphs,
+    _load_font,
+    _open_image,
+    _open_overlay,
+    iter_wrap_lines,
+    layout_text,
+    measure_block,
+    paint_text,
+    wrap_lines_knuth_plass,
+)
+
+# 默认的最小可读字号（1 倍底图下的像素）
+DEFAULT_MIN_FONT_SIZE = 16
+
+
+def _iter_wrap(
+    draw: Union[ImageDraw.ImageDraw, GlyphAdvanceDraw],
+    text: str,
+    font: ImageFont.FreeTypeFont,
+    max_w: int,
+    wrap_algorithm: str,
+) -> Iterator[str]:
+    # 按配置的算法逐行换行；Knuth-Plass 需要整段文字，因此逐个段落换行，
+    # 空段落的处理与 iter_wrap_lines 相同（连续的空行只保留一行）
+    if wrap_algorithm != "knuth_plass":
+        yield from iter_wrap_lines(draw, text, font, max_w)  # type: ignore[arg-type]
+        return
+    last: Optional[str] = None
+    for para in _iter_paragraphs(text):
+        if para:
+            for ln in wrap_lines_knuth_plass(draw, para, font, max_w):  # type: ignore[arg-type]
+                last = ln
+                yield ln
+        elif last != "":
+            last = ""
+            yield ""
+
+
+def _pages(lines: Iterator[str], per_page: int) -> Iterator[List[str]]:
+    # 每 per_page 行为一页；除第一页外，页首的空行（段落间的空行）不占位置
+    page: List[str] = []
+    first = True
+    for ln in lines:
+        if not page and ln == "" and not first:
+            continue
+        page.append(ln)
+        if len(page) == per_page:
+            yield page
+            page = []
+            first = False
+    if page:
+        yield page
+
+
+def paginate_text(
+    draw: Union[ImageDraw.ImageDraw, GlyphAdvanceDraw],
+    top_left: Tuple[int, int],
+    bottom_right: Tuple[int, int],
+    text: str,
+    min_font_size: int = DEFAULT_MIN_FONT_SIZE,
+    max_font_height: Optional[int] = None,
+    font_path: FontSpec = None,
+    line_spacing: float = 0.15,
+    wrap_algorithm: str = "original",
+    budget: Optional[RenderBudget] = None,
+) -> Iterator[TextLayout]:
+    """
+    依次产出各页的排版结果（惰性生成，取出下一页时才处理下一页的文字）。
+
+    整段文本在 min_font_size 下一页放得下时，只产出一页，
+    排版与 layout_text 完全相同（按 wrap_algorithm 搜索最大字号，budget 同样生效）；
+    否则每页都使用 min_font_size。是否放得下与分页位置都按 wrap_algorithm 换行计算，
+    保证一页放得下时按该算法排版不会小于 min_font_size。
+    """
+    x1, y1 = top_left
+    x2, y2 = bottom_right
+    if not (x2 > x1 and y2 > y1):
+        raise ValueError("无效的文字区域。")
+    if min_font_size < 1:
+        raise ValueError("min_font_size 必须大于 0。")
+    region_w, region_h = x2 - x1, y2 - y1
+    size = min(min_font_size, max_font_height) if max_font_height else min_font_size
+
+    font = _load_font(font_path, size)
+    _, _, line_h = measure_block(draw, [], font, line_spacing)  # type: ignore[arg-type]
+    per_page = max(1, region_h // line_h)
+
+    pages = _pages(_iter_wrap(draw, text, font, region_w, wrap_algorithm), per_page)
+    first = next(pages, [""])
+    second = next(pages, None)
+    if second is None:
+        # 一页放得下：与不分页时的排版一致
+        yield layout_text(
+            draw,
+            top_left,
+            bottom_right,
+            text,
+            max_font_height=max_font_height,
+            font_path=font_path,
+            line_spacing=line_spacing,
+            wrap_algorithm=wrap_algorithm,
+            budget=budget,
+        )
+        return
+
+    def page_layout(lines: List[str]) -> TextLayout:
+        w, h, lh = measure_block(draw, lines, font, line_spacing)  # type: ignore[arg-type]
+        return TextLayout(size, lines, lh, h, w, top_left, bottom_right)
+
+    yield page_layout(first)
+    yield page_layout(second)
+    for page in pages:
+        yield page_layout(page)
+
+
+def draw_text_pages(
+    image_source: Union[str, Image.Image],
+    top_left: Tuple[int, int],
+    bottom_right: Tuple[int, int],
+    text: str,
+    color: RGBColor = (0, 0, 0),
+    min_font_size: int = DEFAULT_MIN_FONT_SIZE,
+    max_font_height: Optional[int] = None,
+    font_path: FontSpec = None,
+    align: Align = "center",
+    valign: VAlign = "middle",
+    line_spacing: float = 0.15,
+    bracket_color: RGBColor = (128, 0, 128),
+    image_overlay: Union[str, Image.Image, None] = None,
+    wrap_algorithm: str = "original",
+    scale: float = 1.0,
+    png_compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL,
+    budget: Optional[RenderBudget] = None,
+) -> Iterator[bytes]:
+    """
+    与 draw_text_auto 相同的绘制，但文本在 min_font_size 下放不下时分为多页，
+    逐页产出 PNG bytes。只有一页时的结果与 draw_text_auto 完全相同。
+
+    跨页的括号保持括号颜色。scale、png_compress_level 与 budget 的含义与 draw_text_auto 相同
+    （min_font_size 同样按倍数放大；budget 对整条消息的全部页面计时）。
+    """
+    if scale != 1:
+        image_source = scaled_asset(image_source, scale)
+        image_overlay = scaled_asset(image_overlay, scale)
+        top_left = scale_point(top_left, scale)
+        bottom_right = scale_point(bottom_right, scale)
+        min_font_size = max(1, scale_length(min_font_size, scale))
+        if max_font_height is not None:
+            max_font_height = scale_length(max_font_height, scale)
+
+    # 底图与置顶图层只打开一次，每页复制
+    base = _open_image(image_source)
+    img_overlay = _open_overlay(image_overlay)
+    # 整段文字共用一份着色，跨页的括号保持括号颜色
+    colors = LineColors(text)
+    for layout in paginate_text(
+        ImageDraw.Draw(base),
+        top_left,
+        bottom_right,
+        text,
+        min_font_size=min_font_size,
+        max_font_height=max_font_height,
+        font_path=font_path,
+        line_spacing=line_spacing,
+        wrap_algorithm=wrap_algorithm,
+        budget=budget,
+    ):
+        img = base.copy()
+        paint_text(img, layout, color, font_path, align, valign, bracket_color, colors=colors)
+        _apply_overlay(img, image_overlay, img_overlay)
+        yield encode_png(img, budget, png_compress_level)
@@ -0,0 +1,2 @@
+# filename: tools/__init__.py
+# 开发与性能测试用的命令行工具，使用 python -m tools.<名称> 运行
@@ -0,0 +1,300 @@
+# filename: tools/autotune.py
+"""
+自动调优：在本机用有代表性的消息组合测量各项速度/质量设置的渲染延迟与输出大小，
+并与最高质量的参考输出逐像素比较，为给定的延迟目标推荐一组设置，写成配置文件。
+
+调节的设置（全部组合逐一测量）：
+  text_wrap_algorithm   换行算法
+  max_font_height       最大字号
+  image_resample        粘贴图片的缩放方式
+  png_compress_level    PNG 压缩等级
+
+消息组合默认为 tools.equivalence 的生成语料（文字、图片与图文混排），
+指定 --trace 时改用 flight_recorder 的渲染记录。每次渲染前清空排版测量与缩放结果缓存，
+测得的是一条新消息的耗时；字体保持加载，与长时间运行的进程一致。
+
+参考输出使用当前配置的换行算法、最大字号（不小于 64）与 LANCZOS 缩放，
+像素差异为任一通道差值超过 --channel 的像素占比。
+
+delay 是热键流程中等待聊天软件处理剪切与粘贴的时间，取决于聊天软件而不是渲染速度，无法在本机测量。
+目标延迟按热键流程的端到端耗时计算：渲染的 p95 加上一张图片所需的 2 次 delay。
+在满足目标的设置中选择像素差异最小的，其次是不需要调低 delay 的、输出更小的、更快的；
+delay 只在必要时从当前值调低，不低于 --min-delay；render_deadline_ms 设为目标中留给渲染的时间，超长消息会自动降级。
+
+结果写入 -o 指定的文件（默认 config.autotune.yaml）：复制当前配置文件并替换相应的项，注释保持不变。
+
+用法：python -m tools.autotune --target-ms 150 [-c config.yaml] [-o config.autotune.yaml]
+      [-n 24] [-r 3] [--trace 记录文件] [--channel 8] [--min-delay 0.05]
+"""
+import argparse
+import itertools
+import random
+import re
+import statistics
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from flight_recorder import load_records
+from hot_reload import RenderState, build_state
+from render_budget import RESAMPLE_FAST, RESAMPLE_LANCZOS
+from render_core import render_message
+from tools.equivalence import Case, build_corpus, pixel_diff
+from tools.replay_trace import clear_message_caches, percentile
+
+# 候选值
+_WRAP_ALGORITHMS = ("original", "knuth_plass")
+_FONT_HEIGHTS = (64, 56, 48)
+_RESAMPLES = (RESAMPLE_LANCZOS, RESAMPLE_FAST)
+_PNG_LEVELS = (6, 3, 1)
+
+# 一张图片的热键流程中等待 delay 的次数（剪切后、粘贴后）
+_DELAYS_PER_MESSAGE = 2
+
+
+class Settings(NamedTuple):
+    """一组待测量的设置（字段名与配置项相同）"""
+
+    text_wrap_algorithm: str
+    max_font_height: int
+    image_resample: str
+    png_compress_level: int
+
+    def label(self) -> str:
+        return (
+            f"{self.text_wrap_algorithm:<11} {self.max_font_height:>3} "
+            f"{self.image_resample:<7} {self.png_compress_level:>3}"
+        )
+
+
+class Measurement(NamedTuple):
+    """一组设置在消息组合上的测量结果"""
+
+    settings: Settings
+    p50_ms: float
+    """单条消息渲染耗时的中位数（毫秒）"""
+    p95_ms: float
+    """单条消息渲染耗时的 p95（毫秒）"""
+    mean_bytes: float
+    """输出 PNG 的平均字节数"""
+    mean_diff: float
+    """与参考输出的平均像素差异占比"""
+    max_diff: float
+    """与参考输出的最大像素差异占比"""
+    failures: int
+    """渲染失败的消息数"""
+
+
+def candidates(state: RenderState) -> List[Settings]:
+    """全部候选设置（包含当前配置）"""
+    config = state.config
+    wraps = dict.fromkeys((config.text_wrap_algorithm, *_WRAP_ALGORITHMS))
+    heights = dict.fromkeys((config.max_font_height, *_FONT_HEIGHTS))
+    resamples = dict.fromkeys((config.image_resample, *_RESAMPLES))
+    levels = dict.fromkeys((config.png_compress_level, *_PNG_LEVELS))
+    return [Settings(*combo) for combo in itertools.product(wraps, heights, resamples, levels)]
+
+
+def reference_settings(state: RenderState) -> Settings:
+    config = state.config
+    return Settings(
+        config.text_wrap_algorithm, max(config.max_font_height, 64), RESAMPLE_LANCZOS, 6
+    )
+
+
+def _with(state: RenderState, settings: Settings) -> RenderState:
+    updates = dict(settings._asdict(), render_deadline_ms=0)
+    return state._replace(config=state.config.model_copy(update=updates))
+
+
+def render_once(state: RenderState, case: Case) -> Optional[bytes]:
+    """按新消息的条件渲染一次：排版测量与缩放结果缓存为空，字体已加载"""
+    clear_message_caches()
+    return render_message(state, case.emotion, case.text, case.image())
+
+
+def measure(
+    state: RenderState,
+    settings: Settings,
+    corpus: Sequence[Case],
+    references: Sequence[Optional[bytes]],
+    repeat: int,
+    channel: int,
+) -> Measurement:
+    state = _with(state, settings)
+    latencies: List[float] = []
+    sizes: List[int] = []
+    diffs: List[float] = []
+    failures = 0
+    for case, ref in zip(corpus, references):
+        times: List[float] = []
+        png = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            png = render_once(state, case)
+            times.append((time.perf_counter() - start) * 1000)
+        if png is None or ref is None:
+            failures += 1
+            continue
+        latencies.append(statistics.median(times))
+        sizes.append(len(png))
+        diffs.append(pixel_diff(ref, png, channel))
+    return Measurement(
+        settings,
+        percentile(latencies, 50),
+        percentile(latencies, 95),
+        sum(sizes) / len(sizes) if sizes else 0.0,
+        sum(diffs) / len(diffs) if diffs else 1.0,
+        max(diffs, default=1.0),
+        failures,
+    )
+
+
+class Recommendation(NamedTuple):
+    measurement: Measurement
+    delay: float
+    """推荐的 delay（秒）"""
+    render_deadline_ms: float
+    """推荐的渲染时限（毫秒）"""
+    meets_target: bool
+
+
+def recommend(
+    results: Sequence[Measurement], target_ms: float, current_delay: float, min_delay: float
+) -> Recommendation:
+    """
+    在满足目标的设置中选像素差异最小的，其次是不需要调低 delay 的、输出更小的、更快的；
+    都不满足时选最快的。
+    """
+    usable = [m for m in results if m.failures == 0] or list(results)
+    floor_delay = min(min_delay, current_delay)
+    render_share = target_ms - _DELAYS_PER_MESSAGE * floor_delay * 1000
+    keep_delay_share = target_ms - _DELAYS_PER_MESSAGE * current_delay * 1000
+    feasible = [m for m in usable if m.p95_ms <= render_share]
+    if feasible:
+        best = min(
+            feasible,
+            key=lambda m: (
+                round(m.mean_diff, 4),
+                m.p95_ms > keep_delay_share,
+                m.mean_bytes,
+                m.p95_ms,
+            ),
+        )
+        meets = True
+    else:
+        best = min(usable, key=lambda m: m.p95_ms)
+        meets = False
+    # delay 只在必要时调低：剩余时间平均分给各次等待
+    spare = (target_ms - best.p95_ms) / _DELAYS_PER_MESSAGE / 1000
+    delay = round(min(current_delay, max(floor_delay, spare)), 3)
+    deadline = max(best.p95_ms, target_ms - _DELAYS_PER_MESSAGE * delay * 1000)
+    return Recommendation(best, delay, round(deadline), meets)
+
+
+def _yaml_value(value: object) -> str:
+    if isinstance(value, str):
+        return f'"{value}"'
+    return str(value)
+
+
+def write_profile(config_file: str, out_path: str, values: Dict[str, object], header: str) -> None:
+    """复制配置文件并替换（或追加）指定的项，其余内容与注释保持不变"""
+    try:
+        with open(config_file, "r", encoding="utf-8") as f:
+            text = f.read()
+    except FileNotFoundError:
+        text = ""
+    missing: List[str] = []
+    for key, value in values.items():
+        line = f"{key}: {_yaml_value(value)}"
+        pattern = re.compile(rf"^{re.escape(key)}:.*$", re.MULTILINE)
+        if pattern.search(text):
+            text = pattern.sub(lambda _m: line, text, count=1)
+        else:
+            missing.append(line)
+    if missing:
+        text = text.rstrip("\n") + "\n\n" + "\n".join(missing) + "\n"
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write(header + text)
+
+
+def load_corpus(state: RenderState, args: argparse.Namespace) -> List[Case]:
+    config = state.config
+    if args.trace:
+        cases = []
+        for r in load_records(args.trace)[-args.cases:]:
+            text = r.text if r.kind != "image" else ""
+            cases.append(Case(r.kind, text, r.base_image, r.image_size, r.image_mode))
+        return cases
+    emotions = list(dict.fromkeys(config.baseimage_mapping.values())) or [config.baseimage_file]
+    # Knuth-Plass 换行不支持换行符，语料中不含换行，两种算法都能参与比较
+    return build_corpus(random.Random(args.seed), args.cases, emotions, allow_newline=False)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="在本机测量速度/质量设置并按延迟目标推荐配置")
+    parser.add_argument("--target-ms", type=float, required=True, help="热键到发出图片的目标延迟（毫秒）")
+    parser.add_argument("-c", "--config", default="config.yaml", help="配置文件路径")
+    parser.add_argument("-o", "--output", default="config.autotune.yaml", help="写入推荐配置的文件")
+    parser.add_argument("-n", "--cases", type=int, default=24, help="消息条数")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="每条消息渲染的次数（取中位数）")
+    parser.add_argument("--trace", default=None, help="改用渲染记录文件中最近的消息")
+    parser.add_argument("--seed", type=int, default=0, help="生成语料的随机种子")
+    parser.add_argument("--channel", type=int, default=8, help="像素差异的通道阈值")
+    parser.add_argument("--min-delay", type=float, default=0.05, help="delay 的下限（秒）")
+    args = parser.parse_args(argv)
+
+    state = build_state(args.config)
+    corpus = load_corpus(state, args)
+    if not corpus:
+        print("没有可用于测量的消息", file=sys.stderr)
+        return 2
+
+    # 预热：加载字体与底图，避免第一组设置计入冷启动开销
+    ref_state = _with(state, reference_settings(state))
+    for case in corpus:
+        render_once(ref_state, case)
+    references = [render_once(ref_state, case) for case in corpus]
+
+    settings_list = candidates(state)
+    print(f"{len(corpus)} 条消息 × {len(settings_list)} 组设置，每条渲染 {args.repeat} 次")
+    print(f"参考设置：{reference_settings(state).label()}\n")
+    print(f"{'换行算法':<8} {'字号':>4} {'缩放':<6} {'PNG':>4} {'p50ms':>8} {'p95ms':>8} {'平均KiB':>8} {'平均差异':>8} {'最大差异':>8}")
+    results: List[Measurement] = []
+    for settings in settings_list:
+        m = measure(state, settings, corpus, references, args.repeat, args.channel)
+        results.append(m)
+        failed = f"  失败 {m.failures} 条" if m.failures else ""
+        print(
+            f"{settings.label()} {m.p50_ms:>8.1f} {m.p95_ms:>8.1f} {m.mean_bytes / 1024:>8.1f}"
+            f" {m.mean_diff:>8.2%} {m.max_diff:>8.2%}{failed}"
+        )
+
+    rec = recommend(results, args.target_ms, state.config.delay, args.min_delay)
+    best = rec.measurement
+    values: Dict[str, object] = dict(best.settings._asdict())
+    values["delay"] = rec.delay
+    values["render_deadline_ms"] = rec.render_deadline_ms
+
+    print()
+    if not rec.meets_target:
+        print(f"注意：没有设置能满足 {args.target_ms:.0f}ms 的目标，推荐最快的一组")
+    print(f"推荐：{best.settings.label()}  delay {rec.delay}s  render_deadline_ms {rec.render_deadline_ms:.0f}")
+    print(
+        f"  渲染 p95 {best.p95_ms:.1f}ms + {_DELAYS_PER_MESSAGE} × delay = "
+        f"{best.p95_ms + _DELAYS_PER_MESSAGE * rec.delay * 1000:.0f}ms，"
+        f"平均 {best.mean_bytes / 1024:.1f}KiB，平均像素差异 {best.mean_diff:.2%}"
+    )
+    header = (
+        f"# 由 python -m tools.autotune --target-ms {args.target_ms:g} 生成（{time.strftime('%Y-%m-%d %H:%M')}）\n"
+        f"# 渲染 p95 {best.p95_ms:.1f}ms，平均输出 {best.mean_bytes / 1024:.1f}KiB，"
+        f"与最高质量输出的平均像素差异 {best.mean_diff:.2%}\n\n"
+    )
+    write_profile(args.config, args.output, values, header)
+    print(f"已写入 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,512 @@
+# filename: tools/equivalence.py
+"""
+像素等价性测试：用生成的语料（多种文字、括号、长度、差分与图片形状）分别走参考渲染路径
+和各个快速路径，比较解码后的像素、换行结果与选定的字号，超出容差时以非零状态退出。
+
+参考结果保存在 --golden 目录（默认 .cache/equivalence）中：每条语料第一次运行时记录当前代码
+清空全部缓存后的渲染结果与排版，之后的运行都与保存的结果比较，因此对参考路径本身的改动也能发现。
+改动渲染代码之前先运行一次以记录基准；有意改变输出后用 --update-golden 重新记录。
+保存的结果按文字、图片形状、底图与字体内容以及影响渲染的配置项寻址，任何一项变化都会重新记录。
+
+快速路径（MODES）：
+  reference   当前代码清空全部缓存后的渲染，应与保存的基准输出完全一致
+  cached      缓存全部命中后的再次渲染（字体池、排版测量、缩放结果），应与首次渲染完全一致
+  pagination  分页绘制在只有一页时的结果（排版取自 paginate_text），应与 draw_text_auto 完全一致
+  degraded    在来不及完成的时限下渲染，触发全部降级措施（估算字号、贪心换行、快速缩放、快速 PNG）
+  hidpi       2 倍渲染缩小回 1 倍后与 1 倍渲染比较（字形栅格化不同，只能近似）
+
+各快速路径的排版取自该路径自身（缓存命中的测量、分页、带时限的排版与图文方案选择）。
+容差可按模式覆盖，例如 --tolerance degraded:pixels=0.05 --tolerance degraded:font=3
+
+用法：python -m tools.equivalence [-c config.yaml] [-n 300] [--modes cached,degraded] [--seed 0] [--show 5]
+                                  [--golden 目录 | --no-golden] [--update-golden]
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from PIL import Image, ImageChops, ImageDraw
+
+from hot_reload import RenderState, build_state
+from image_fit_paste import resize_cache
+from mixed_layout import plan_text_and_image
+from render_budget import RenderBudget
+from render_cache import render_key
+from render_core import message_kind, render_message
+from text_fit_draw import TextLayout, clear_font_caches, clear_layout_cache, layout_text
+from text_pagination import draw_text_pages, paginate_text
+from tools.replay_trace import synthetic_image
+
+# 各类文字素材
+_SCRIPTS: Dict[str, Callable[[random.Random], str]] = {
+    "cjk": lambda r: chr(r.randint(0x4E00, 0x9FA5)),
+    "kana": lambda r: chr(r.randint(0x3041, 0x3096)),
+    "hangul": lambda r: chr(r.randint(0xAC00, 0xD7A3)),
+    "latin": lambda r: r.choice(["hello", "world", "sketchbook", "OK", "lol", "Anan", "x"]) + " ",
+    "digits": lambda r: str(r.randint(0, 99999)),
+    "punct": lambda r: r.choice("，。！？、…～,.!?;:-"),
+    "emoji": lambda r: r.choice("😀😭👍🎉❤️"),
+}
+_LENGTHS = {"tiny": (1, 2), "short": (3, 12), "medium": (13, 60), "long": (61, 300)}
+_IMAGE_SHAPES = [
+    ((16, 16), "RGB"),
+    ((640, 640), "RGB"),
+    ((1920, 1080), "RGB"),
+    ((300, 1200), "RGB"),
+    ((2000, 200), "RGB"),
+    ((512, 512), "RGBA"),
+    ((400, 300), "P"),
+    ((400, 300), "L"),
+]
+
+
+class Case(NamedTuple):
+    """一条测试语料"""
+
+    name: str
+    """可读的类别描述"""
+    text: str
+    emotion: str
+    """底图路径"""
+    image_size: Optional[Tuple[int, int]]
+    image_mode: Optional[str]
+
+    def image(self) -> Optional[Image.Image]:
+        if self.image_size is None:
+            return None
+        return synthetic_image(self.image_size, self.image_mode or "RGB")
+
+
+def _bracketed(rng: random.Random, body: str) -> str:
+    style = rng.choice(["cn", "en", "unclosed", "nested", "empty"])
+    cut = rng.randint(0, len(body))
+    if style == "cn":
+        return body[:cut] + "【" + body[cut:] + "】"
+    if style == "en":
+        return body[:cut] + "[" + body[cut:] + "]"
+    if style == "unclosed":
+        return body[:cut] + "【" + body[cut:]
+    if style == "nested":
+        return "【" + body[:cut] + "[" + body[cut:] + "]】"
+    return body[:cut] + "【】" + body[cut:]
+
+
+def build_corpus(
+    rng: random.Random, count: int, emotions: Sequence[str], allow_newline: bool
+) -> List[Case]:
+    """按文字种类 × 长度 × 括号 × 差分 × 图片形状生成语料，各类别轮流覆盖"""
+    corpus: List[Case] = []
+    scripts = list(_SCRIPTS)
+    lengths = list(_LENGTHS)
+    for i in range(count):
+        script = scripts[i % len(scripts)]
+        length = lengths[(i // len(scripts)) % len(lengths)]
+        lo, hi = _LENGTHS[length]
+        target = rng.randint(lo, hi)
+        parts: List[str] = []
+        while sum(map(len, parts)) < target:
+            # 以一种文字为主，混入少量其他文字
+            source = script if rng.random() < 0.8 else rng.choice(scripts)
+            parts.append(_SCRIPTS[source](rng))
+            if allow_newline and rng.random() < 0.02:
+                parts.append("\n")
+        text = "".join(parts).strip() or "短"
+        tags = [script, length]
+        if rng.random() < 0.3:
+            text = _bracketed(rng, text)
+            tags.append("bracket")
+
+        kind = ("text", "text", "image", "mixed")[i % 4]
+        size, mode = _IMAGE_SHAPES[rng.randrange(len(_IMAGE_SHAPES))]
+        if kind == "image":
+            text, tags = "", []
+        if kind != "text":
+            tags.append(f"{mode}{size[0]}x{size[1]}")
+        corpus.append(
+            Case(
+                f"{kind}:{'/'.join(tags)}",
+                text,
+                emotions[i % len(emotions)],
+                size if kind != "text" else None,
+                mode if kind != "text" else None,
+            )
+        )
+    return corpus
+
+
+class Output(NamedTuple):
+    """一次渲染的结果"""
+
+    png: Optional[bytes]
+    layout: Optional[TextLayout]
+    """文字排版（没有文字时为 None）"""
+
+
+class Tolerance(NamedTuple):
+    """快速路径相对参考结果允许的差异"""
+
+    pixels: float = 0.0
+    """差异像素占比上限"""
+    channel: int = 0
+    """单个通道差值不超过此值的像素不计为差异"""
+    font: int = 0
+    """字号差的上限"""
+    lines: bool = False
+    """是否允许换行结果不同"""
+
+
+class Diff(NamedTuple):
+    case: Case
+    pixels: float
+    font: int
+    lines_equal: bool
+    detail: str
+
+
+def _layout_for(
+    state: RenderState,
+    case: Case,
+    budget: Optional[RenderBudget] = None,
+    scale: float = 1.0,
+) -> Optional[TextLayout]:
+    """按 render_core.render_message 的参数计算文字排版（与渲染时的排版一致）"""
+    config = state.config
+    image = case.image()
+    kind = message_kind(case.text, image)
+    if kind == "text":
+        return layout_text(
+            ImageDraw.Draw(Image.new("RGBA", (1, 1))),
+            _scaled(config.text_box_topleft, scale),
+            _scaled(config.image_box_bottomright, scale),
+            case.text,
+            max_font_height=int(round(config.max_font_height * scale)),
+            font_path=config.font_spec(),
+            wrap_algorithm=config.text_wrap_algorithm,
+            budget=budget,
+        )
+    if kind == "mixed" and image is not None:
+        return plan_text_and_image(
+            top_left=config.text_box_topleft,
+            bottom_right=config.image_box_bottomright,
+            text=case.text,
+            image_size=image.size,
+            max_font_height=config.max_font_height,
+            font_path=config.font_spec(),
+            wrap_algorithm=config.text_wrap_algorithm,
+            scale=scale,
+            budget=budget,
+        ).text_layout
+    return None
+
+
+def _scaled(point: Tuple[int, int], scale: float) -> Tuple[int, int]:
+    return int(round(point[0] * scale)), int(round(point[1] * scale))
+
+
+def _with(state: RenderState, **updates) -> RenderState:
+    return state._replace(config=state.config.model_copy(update=updates))
+
+
+def reference(state: RenderState, case: Case) -> Output:
+    """参考路径：清空全部缓存后，不带时限、1 倍渲染；排版同样在清空测量缓存后计算"""
+    clear_font_caches()
+    resize_cache.clear()
+    state = _with(state, render_scale=1.0, render_deadline_ms=0)
+    png = render_message(state, case.emotion, case.text, case.image())
+    clear_layout_cache()
+    return Output(png, _layout_for(state, case))
+
+
+def mode_cached(state: RenderState, case: Case) -> Optional[Output]:
+    state = _with(state, render_scale=1.0, render_deadline_ms=0)
+    # 参考渲染之后缓存已经填满，渲染与排版的测量全部命中
+    png = render_message(state, case.emotion, case.text, case.image())
+    return Output(png, _layout_for(state, case))
+
+
+def mode_pagination(state: RenderState, case: Case) -> Optional[Output]:
+    if case.image_size is not None:
+        return None
+    config = state.config
+    layouts = list(
+        paginate_text(
+            ImageDraw.Draw(Image.new("RGBA", (1, 1))),
+            config.text_box_topleft,
+            config.image_box_bottomright,
+            case.text,
+            min_font_size=1,
+            max_font_height=config.max_font_height,
+            font_path=config.font_spec(),
+            wrap_algorithm=config.text_wrap_algorithm,
+        )
+    )
+    pages = list(
+        draw_text_pages(
+            image_source=state.base_image(case.emotion),
+            image_overlay=state.overlay(),
+            top_left=config.text_box_topleft,
+            bottom_right=config.image_box_bottomright,
+            text=case.text,
+            min_font_size=1,
+            max_font_height=config.max_font_height,
+            font_path=config.font_spec(),
+            wrap_algorithm=config.text_wrap_algorithm,
+        )
+    )
+    return Output(pages[0] if len(pages) == 1 else None, layouts[0] if layouts else None)
+
+
+def _expired_budget() -> RenderBudget:
+    # 时限极短，每一步都预计会超时，从而触发全部降级措施
+    return RenderBudget(1e-9)
+
+
+def mode_degraded(state: RenderState, case: Case) -> Optional[Output]:
+    state = _with(state, render_scale=1.0)
+    # 缓存中的高质量缩放结果会绕过快速缩放
+    resize_cache.clear()
+    png = render_message(state, case.emotion, case.text, case.image(), budget=_expired_budget())
+    return Output(png, _layout_for(state, case, budget=_expired_budget()))
+
+
+def mode_hidpi(state: RenderState, case: Case) -> Optional[Output]:
+    state = _with(state, render_scale=2.0, render_deadline_ms=0)
+    png = render_message(state, case.emotion, case.text, case.image())
+    if png is None:
+        return Output(None, None)
+    # 缩小回 1 倍尺寸后比较；字号按 1 倍折算
+    with Image.open(io.BytesIO(png)) as im:
+        half = im.convert("RGBA").resize((im.width // 2, im.height // 2), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    half.save(buf, format="PNG")
+    layout = _layout_for(state, case, scale=2.0)
+    if layout is not None:
+        layout = layout._replace(font_size=int(round(layout.font_size / 2)))
+    return Output(buf.getvalue(), layout)
+
+
+class Mode(NamedTuple):
+    render: Callable[[RenderState, Case], Optional[Output]]
+    """渲染一条语料，不适用时返回 None"""
+    tolerance: Tolerance
+    """默认容差"""
+
+
+MODES: Dict[str, Mode] = {
+    # 当前参考路径本身，与保存的基准输出比较（在主循环中与参考渲染共用一次渲染）
+    "reference": Mode(reference, Tolerance()),
+    "cached": Mode(mode_cached, Tolerance()),
+    "pagination": Mode(mode_pagination, Tolerance()),
+    "degraded": Mode(mode_degraded, Tolerance(pixels=0.03, channel=8, font=4, lines=True)),
+    # 图文混排在 2 倍下可能选出不同的分割方案，字号差异较大
+    "hidpi": Mode(mode_hidpi, Tolerance(pixels=0.1, channel=48, font=6, lines=True)),
+}
+
+
+def golden_key(state: RenderState, case: Case) -> str:
+    """一条语料参考结果的保存键"""
+    config = _with(state, render_scale=1.0, render_deadline_ms=0).config
+    data = json.dumps(
+        [
+            render_key(config, case.emotion, case.text),
+            case.image_size,
+            case.image_mode,
+            config.image_resample,
+        ]
+    )
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def load_golden(directory: str, key: str) -> Optional[Output]:
+    """读取保存的参考结果，不存在时返回 None"""
+    try:
+        with open(os.path.join(directory, key + ".png"), "rb") as f:
+            png = f.read()
+        with open(os.path.join(directory, key + ".json"), "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    layout = None
+    if data is not None:
+        layout = TextLayout(
+            data["font_size"],
+            data["lines"],
+            data["line_h"],
+            data["block_h"],
+            data["block_w"],
+            tuple(data["top_left"]),
+            tuple(data["bottom_right"]),
+        )
+    return Output(png, layout)
+
+
+def save_golden(directory: str, key: str, output: Output) -> None:
+    os.makedirs(directory, exist_ok=True)
+    assert output.png is not None
+    with open(os.path.join(directory, key + ".png"), "wb") as f:
+        f.write(output.png)
+    layout = output.layout._asdict() if output.layout is not None else None
+    with open(os.path.join(directory, key + ".json"), "w", encoding="utf-8") as f:
+        json.dump(layout, f, ensure_ascii=False)
+
+
+def pixel_diff(a: bytes, b: bytes, channel: int) -> float:
+    """解码后逐像素比较，返回任一通道差值超过 channel 的像素占比；尺寸不同时为 1"""
+    with Image.open(io.BytesIO(a)) as ia, Image.open(io.BytesIO(b)) as ib:
+        ia, ib = ia.convert("RGBA"), ib.convert("RGBA")
+        if ia.size != ib.size:
+            return 1.0
+        bands = ImageChops.difference(ia, ib).split()
+    worst = bands[0]
+    for band in bands[1:]:
+        worst = ImageChops.lighter(worst, band)
+    over = worst.point(lambda v: 255 if v > channel else 0).histogram()[255]
+    return over / (ia.width * ia.height)
+
+
+def compare(ref: Output, out: Output, tolerance: Tolerance, case: Case) -> Diff:
+    if ref.png is None or out.png is None:
+        failed = "参考路径" if ref.png is None else "快速路径"
+        return Diff(case, 1.0, 0, True, f"{failed}渲染失败")
+    pixels = pixel_diff(ref.png, out.png, tolerance.channel)
+    font, lines_equal, detail = 0, True, ""
+    if ref.layout is not None and out.layout is not None:
+        font = out.layout.font_size - ref.layout.font_size
+        lines_equal = ref.layout.lines == out.layout.lines
+        if not lines_equal:
+            for i, (x, y) in enumerate(zip(ref.layout.lines, out.layout.lines)):
+                if x != y:
+                    detail = f"第 {i + 1} 行：{x!r} -> {y!r}"
+                    break
+            else:
+                detail = f"行数 {len(ref.layout.lines)} -> {len(out.layout.lines)}"
+    return Diff(case, pixels, font, lines_equal, detail)
+
+
+def within(diff: Diff, tolerance: Tolerance) -> bool:
+    return (
+        diff.pixels <= tolerance.pixels
+        and abs(diff.font) <= tolerance.font
+        and (diff.lines_equal or tolerance.lines)
+    )
+
+
+def parse_tolerances(specs: Sequence[str]) -> Dict[str, Tolerance]:
+    """解析 模式:键=值 形式的容差覆盖"""
+    tolerances = {name: mode.tolerance for name, mode in MODES.items()}
+    for spec in specs:
+        name, _, assignment = spec.partition(":")
+        key, _, value = assignment.partition("=")
+        if name not in tolerances or key not in Tolerance._fields or not value:
+            raise ValueError(f"无效的容差: {spec}")
+        current = tolerances[name]
+        field_type = type(getattr(current, key))
+        parsed = value.lower() in ("1", "true", "yes") if field_type is bool else field_type(value)
+        tolerances[name] = current._replace(**{key: parsed})
+    return tolerances
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="比较参考渲染路径与各快速路径的输出")
+    parser.add_argument("-c", "--config", default="config.yaml", help="配置文件路径")
+    parser.add_argument("-n", "--cases", type=int, default=300, help="语料条数")
+    parser.add_argument("--modes", default=",".join(MODES), help="要比较的快速路径，逗号分隔")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument(
+        "--tolerance", action="append", default=[], help="覆盖容差，格式 模式:键=值（键为 pixels/channel/font/lines）"
+    )
+    parser.add_argument("--show", type=int, default=5, help="每个模式列出差异最大的语料数")
+    parser.add_argument(
+        "--golden", default=os.path.join(".cache", "equivalence"), help="保存参考结果的目录"
+    )
+    parser.add_argument(
+        "--no-golden", action="store_true", help="不使用保存的参考结果，直接与当前代码的参考渲染比较"
+    )
+    parser.add_argument("--update-golden", action="store_true", help="用当前代码的参考渲染重新记录参考结果")
+    args = parser.parse_args(argv)
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    for name in modes:
+        if name not in MODES:
+            parser.error(f"未知的模式 {name}，可用：{', '.join(MODES)}")
+    try:
+        tolerances = parse_tolerances(args.tolerance)
+    except ValueError as e:
+        parser.error(str(e))
+
+    state = build_state(args.config)
+    config = state.config
+    emotions = list(dict.fromkeys(config.baseimage_mapping.values())) or [config.baseimage_file]
+    corpus = build_corpus(
+        random.Random(args.seed), args.cases, emotions, config.text_wrap_algorithm != "knuth_plass"
+    )
+    print(f"{len(corpus)} 条语料，比较模式：{', '.join(modes)}")
+
+    golden = None if args.no_golden else args.golden
+    recorded = 0
+    diffs: Dict[str, List[Diff]] = {name: [] for name in modes}
+    for i, case in enumerate(corpus, 1):
+        current = reference(state, case)
+        ref, stored = current, None
+        if golden is not None:
+            key = golden_key(state, case)
+            stored = None if args.update_golden else load_golden(golden, key)
+            if stored is not None:
+                ref = stored
+            elif current.png is not None:
+                save_golden(golden, key, current)
+                recorded += 1
+        for name in modes:
+            if name == "reference":
+                # 刚记录的参考结果就是本次渲染，没有可比较的基准
+                out = current if stored is not None else None
+            else:
+                out = MODES[name].render(state, case)
+            if out is not None:
+                diffs[name].append(compare(ref, out, tolerances[name], case))
+        if i % 50 == 0:
+            print(f"  已完成 {i}/{len(corpus)}")
+
+    if golden is None:
+        print("未使用保存的参考结果：参考路径本身的改动无法发现")
+    elif recorded:
+        print(f"新记录参考结果 {recorded} 条（{golden}），这些语料的 reference 模式未比较")
+
+    failed = False
+    for name in modes:
+        tolerance = tolerances[name]
+        results = diffs[name]
+        bad = [d for d in results if not within(d, tolerance)]
+        failed = failed or bool(bad)
+        identical = sum(d.pixels == 0 for d in results)
+        line_diffs = sum(not d.lines_equal for d in results)
+        font_deltas: Dict[int, int] = {}
+        for d in results:
+            font_deltas[d.font] = font_deltas.get(d.font, 0) + 1
+        print(f"\n[{name}] {len(results)} 条，容差 {tolerance._asdict()}")
+        print(f"  像素无差异 {identical} 条，最大差异像素占比 {max((d.pixels for d in results), default=0):.4f}")
+        print(f"  换行不同 {line_diffs} 条；字号差分布 {dict(sorted(font_deltas.items()))}")
+        print(f"  超出容差 {len(bad)} 条")
+        worst = sorted(results, key=lambda d: (within(d, tolerance), -d.pixels, -abs(d.font)))
+        for d in worst[: args.show]:
+            if d.pixels == 0 and d.font == 0 and d.lines_equal:
+                break
+            mark = "超出" if not within(d, tolerance) else "容许"
+            print(
+                f"    [{mark}] {d.case.name} 像素 {d.pixels:.4f} 字号 {d.font:+d}"
+                f" {d.detail} 文本 {d.case.text[:30]!r}"
+            )
+
+    if failed:
+        print("\n失败：存在超出容差的快速路径结果")
+        sys.exit(1)
+    print("\n通过")
+
+
+if __name__ == "__main__":
+    main()
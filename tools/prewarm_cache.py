@@ -0,0 +1,85 @@
+# filename: tools/prewarm_cache.py
+"""
+预热渲染缓存：把常用语列表中的每一句按配置中 baseimage_mapping 的每个差分渲染一遍，
+写入磁盘渲染缓存（render_cache_dir），之后这些 文字 × 差分 组合在热键流程中直接使用缓存。
+
+常用语文件每行一句，空行与以 # 开头的行被忽略；已在缓存中的组合不会重新渲染。
+预热不限制渲染时限（时限不计入缓存键），结果与热键流程中未降级的渲染相同。
+配置中未启用 render_cache 时同样写入缓存目录，但热键流程不会使用，运行时会给出提示。
+
+用法：python -m tools.prewarm_cache 常用语.txt [-c config.yaml]
+"""
+import argparse
+import sys
+import time
+from typing import List, Optional
+
+from hot_reload import build_state
+from render_cache import get_render_cache, render_key
+from render_core import render_pages
+
+
+def read_phrases(path: str) -> List[str]:
+    """读取常用语文件（为 - 时从标准输入读取），去除重复"""
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    phrases = [ln.strip() for ln in lines]
+    return list(dict.fromkeys(p for p in phrases if p and not p.startswith("#")))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="按全部差分预先渲染常用语，写入磁盘渲染缓存")
+    parser.add_argument("phrases", help="常用语文件，每行一句，为 - 时从标准输入读取")
+    parser.add_argument("-c", "--config", default="config.yaml", help="配置文件路径")
+    args = parser.parse_args(argv)
+
+    state = build_state(args.config)
+    if not state.config.render_cache:
+        print("注意：配置中未启用 render_cache，预热的结果不会被热键流程使用", file=sys.stderr)
+    # 时限降级的结果不会写入缓存，预热不需要赶时间
+    state = state._replace(
+        config=state.config.model_copy(update={"render_cache": True, "render_deadline_ms": 0})
+    )
+    config = state.config
+    cache = get_render_cache(config)
+    assert cache is not None
+
+    phrases = read_phrases(args.phrases)
+    emotions = list(dict.fromkeys(config.baseimage_mapping.values()))
+    if not phrases or not emotions:
+        print("没有要预热的常用语或差分", file=sys.stderr)
+        return 2
+
+    rendered = cached = unstored = skipped = 0
+    start = time.perf_counter()
+    for phrase in phrases:
+        for base_image_file in emotions:
+            key = render_key(config, base_image_file, phrase)
+            if key in cache:
+                cached += 1
+                continue
+            pages = list(render_pages(state, base_image_file, phrase, None))
+            if key in cache:
+                rendered += 1
+            elif len(pages) == 1:
+                # 渲染成功但没有写入缓存（降级的结果或写入失败）
+                unstored += 1
+            else:
+                # 渲染失败或分为多页的文字不写入缓存
+                skipped += 1
+    elapsed = time.perf_counter() - start
+
+    stats = cache.stats()
+    print(
+        f"{len(phrases)} 句 × {len(emotions)} 个差分：新写入 {rendered}，已在缓存 {cached}，"
+        f"渲染但未写入 {unstored}，失败或分页 {skipped}，用时 {elapsed:.1f}s"
+    )
+    print(f"缓存 {config.render_cache_dir}：{stats.entries} 个文件，{(stats.bytes or 0) / 1024 / 1024:.1f} MiB")
+    return 1 if not rendered and not cached else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+# filename: tools/render_stress.py
+"""
+多线程渲染压力测试：用 1..N 个线程并发调用 draw_text_auto / paste_image_auto，
+报告吞吐量与相对单线程的加速比，并逐一核对输出与单线程结果字节一致。
+
+Pillow 在缩放、文字栅格化与 PNG 压缩等耗时操作中释放 GIL，
+因此在多核机器上吞吐量应随线程数近似线性增长（直到达到核心数）。
+
+用法：python -m tools.render_stress [-c config.yaml] [-t 1,2,4,8] [-n 200] [--kind text|image|all] [--distinct]
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from PIL import Image
+
+from hot_reload import build_state
+from image_fit_paste import paste_image_auto
+from text_fit_draw import draw_text_auto
+
+SAMPLE_TEXTS = [
+    "今天也要好好学习哦",
+    "【安安】才不是笨蛋！",
+    "The quick brown fox jumps over the lazy dog.",
+    "这是一段比较长的文字，用来测试自动换行与字号搜索在多行情况下的表现。[重点]会用另一种颜色显示。",
+    "短",
+]
+
+
+def _content_image(size=(640, 480)) -> Image.Image:
+    # 带透明度渐变的测试图，所有线程共享同一个只读对象
+    gradient = Image.linear_gradient("L").resize(size)
+    return Image.merge("RGBA", (gradient, gradient.rotate(90), gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT), gradient))
+
+
+def build_jobs(config_file: str, count: int, kind: str, distinct: bool) -> List[Callable[[], bytes]]:
+    """按配置构造 count 个渲染任务；distinct 为 True 时每段文字都不同，绕开排版测量缓存"""
+    state = build_state(config_file)
+    config = state.config
+    base = state.base_image(config.baseimage_file)
+    overlay = state.overlay()
+    top_left = config.text_box_topleft
+    bottom_right = config.image_box_bottomright
+    content = _content_image()
+
+    def text_job(text: str) -> Callable[[], bytes]:
+        return lambda: draw_text_auto(
+            image_source=base,
+            image_overlay=overlay,
+            top_left=top_left,
+            bottom_right=bottom_right,
+            text=text,
+            max_font_height=64,
+            font_path=config.font_spec(),
+            wrap_algorithm=config.text_wrap_algorithm,
+        )
+
+    def image_job() -> bytes:
+        return paste_image_auto(
+            image_source=base,
+            image_overlay=overlay,
+            top_left=top_left,
+            bottom_right=bottom_right,
+            content_image=content,
+            padding=12,
+            allow_upscale=True,
+        )
+
+    jobs: List[Callable[[], bytes]] = []
+    for i in range(count):
+        if kind == "image" or (kind == "all" and i % 3 == 2):
+            jobs.append(image_job)
+        else:
+            text = SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]
+            jobs.append(text_job(f"{text} #{i}" if distinct else text))
+    return jobs
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="多线程渲染吞吐量与一致性测试")
+    parser.add_argument("-c", "--config", default="config.yaml", help="配置文件路径")
+    parser.add_argument(
+        "-t", "--threads", default=None, help="逗号分隔的线程数列表，默认 1,2,4... 直到 CPU 核心数"
+    )
+    parser.add_argument("-n", "--jobs", type=int, default=200, help="每轮渲染任务数")
+    parser.add_argument("--kind", choices=("text", "image", "all"), default="all", help="任务类型")
+    parser.add_argument("--distinct", action="store_true", help="每个任务使用不同文字")
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        counts = [int(t) for t in args.threads.split(",")]
+    else:
+        cpus = os.cpu_count() or 1
+        counts = [1]
+        while counts[-1] * 2 <= cpus:
+            counts.append(counts[-1] * 2)
+        if counts[-1] != cpus:
+            counts.append(cpus)
+
+    jobs = build_jobs(args.config, args.jobs, args.kind, args.distinct)
+    # 单线程先跑一遍作为参考输出，同时预热共享的测量缓存
+    expected = [_digest(job()) for job in jobs]
+
+    print(f"CPU 核心数 {os.cpu_count()}，每轮 {len(jobs)} 个任务")
+    print(f"{'线程':>4} {'耗时(s)':>8} {'任务/秒':>8} {'加速比':>6} {'效率':>6} {'不一致':>6}")
+    baseline = None
+    failed = False
+    for n in counts:
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            # 先让每个线程各渲染一次，建立各自的字体池
+            list(pool.map(lambda job: job(), jobs[:n]))
+            start = time.perf_counter()
+            results = list(pool.map(lambda job: _digest(job()), jobs))
+            elapsed = time.perf_counter() - start
+        mismatches = sum(a != b for a, b in zip(results, expected))
+        failed = failed or mismatches > 0
+        rate = len(jobs) / elapsed
+        baseline = baseline or rate
+        speedup = rate / baseline
+        print(f"{n:>4} {elapsed:>8.2f} {rate:>8.1f} {speedup:>6.2f} {speedup / n:>6.0%} {mismatches:>6}")
+
+    if failed:
+        print("多线程输出与单线程不一致！")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
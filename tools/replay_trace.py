@@ -0,0 +1,220 @@
+# filename: tools/replay_trace.py
+"""
+重放渲染记录：按 flight_recorder 记录的请求（文本、差分、粘贴图片尺寸）用当前代码与当前配置
+重新渲染，报告各类请求的延迟分位数，并与记录时的耗时对比。
+
+粘贴图片只记录了尺寸与模式，重放时使用同尺寸的合成图片（渐变叠加噪声，压缩难度接近照片）。
+
+重放与热键流程一样经过 render_pages（缓存查找、图片摘要、排版、绘制与编码），
+并与记录时一样以各阶段耗时之和（RenderRecord.render_ms）比较。
+磁盘渲染缓存改用临时目录：记录时命中缓存的请求重放时同样命中，未命中的同样不命中。
+
+用法：python -m tools.replay_trace [记录文件] [-c config.yaml] [-r 重复次数] [--kind text|image|mixed]
+"""
+import argparse
+import os
+import tempfile
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from flight_recorder import FlightRecorder, RenderRecord, config_fingerprint, load_records
+from hot_reload import RenderState, build_state
+from image_fit_paste import resize_cache
+from render_cache import get_render_cache
+from render_core import render_pages, resolve_emotion
+from text_fit_draw import clear_layout_cache
+
+_synthetic_cache: Dict[Tuple[Tuple[int, int], str], Image.Image] = {}
+
+
+def synthetic_image(size: Tuple[int, int], mode: str = "RGB") -> Image.Image:
+    """生成指定尺寸与模式的合成图片，同一尺寸只生成一次"""
+    key = (size, mode)
+    img = _synthetic_cache.get(key)
+    if img is None:
+        gradient = Image.linear_gradient("L").resize(size)
+        noise = Image.effect_noise(size, 40)
+        bands = [
+            Image.blend(gradient, noise, 0.3),
+            Image.blend(gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT), noise, 0.3),
+            Image.blend(gradient.transpose(Image.Transpose.FLIP_TOP_BOTTOM), noise, 0.3),
+        ]
+        rgb = Image.merge("RGB", bands)
+        if mode == "RGBA":
+            img = rgb.copy()
+            img.putalpha(gradient)
+        elif mode == "P":
+            img = rgb.quantize(256)
+        else:
+            img = rgb.convert(mode) if mode in ("L", "RGB") else rgb
+        _synthetic_cache[key] = img
+    return img
+
+
+def replay_inputs(
+    state: RenderState, record: RenderRecord
+) -> Tuple[str, str, Optional[Image.Image]]:
+    """一条记录的渲染输入：(底图路径, 文字, 粘贴图片)"""
+    base_file = (
+        resolve_emotion(state.config, record.emotion) or record.base_image
+        if record.emotion
+        else record.base_image
+    )
+    image = (
+        synthetic_image(record.image_size, record.image_mode or "RGB")
+        if record.image_size
+        else None
+    )
+    text = record.text if record.kind != "image" else ""
+    return base_file, text, image
+
+
+def clear_message_caches() -> None:
+    """清空随消息内容积累的缓存（排版测量与图片缩放结果），已加载的字体与底图保留"""
+    clear_layout_cache()
+    resize_cache.clear()
+
+
+class ReplayRecorder(FlightRecorder):
+    """只在内存中保存重放产生的记录（含各阶段耗时），不写文件"""
+
+    def __init__(self):
+        super().__init__(os.devnull)
+        self.records: List[RenderRecord] = []
+
+    def _load(self) -> None:
+        pass
+
+    def record(self, record: RenderRecord) -> None:
+        self.records.append(record)
+
+
+def replay_one(
+    state: RenderState, record: RenderRecord, recorder: Optional[FlightRecorder] = None
+) -> List[bytes]:
+    """用与热键流程相同的渲染流程重新渲染一条记录，返回产出的各页 PNG"""
+    return list(render_pages(state, *replay_inputs(state, record), recorder))
+
+
+def was_cache_hit(record: RenderRecord) -> bool:
+    """记录时是否直接使用了磁盘缓存中的结果（只有缓存阶段，没有渲染阶段）"""
+    return "cache" in record.timings and "render" not in record.timings
+
+
+def replay_records(
+    state: RenderState, records: Sequence[RenderRecord], repeat: int
+) -> Tuple[Dict[str, List[float]], int]:
+    """
+    把每条记录重放 repeat 次，返回 (类型 -> 各次的阶段耗时之和, 失败次数)。
+    每次计时前清空排版与缩放缓存，与真实的新消息一样不会命中这些缓存；
+    磁盘缓存按记录时的情况准备：命中的请求先不计时地渲染一次写入缓存，未命中的请求先清空缓存。
+    """
+    recorder = ReplayRecorder()
+    cache = get_render_cache(state.config)
+    replayed: Dict[str, List[float]] = defaultdict(list)
+    failures = 0
+    for _ in range(repeat):
+        for record in records:
+            if cache is not None:
+                if was_cache_hit(record):
+                    replay_one(state, record)
+                else:
+                    cache.clear()
+            clear_message_caches()
+            recorder.records.clear()
+            try:
+                ok = bool(replay_one(state, record, recorder))
+            except Exception as e:
+                print(f"重放失败（{record.kind}）: {e}")
+                ok = False
+            if not ok or not recorder.records:
+                failures += 1
+                continue
+            elapsed = recorder.records[-1].render_ms
+            replayed[record.kind].append(elapsed)
+            replayed["全部"].append(elapsed)
+    return replayed, failures
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """线性插值的分位数，q 取 0..100"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def _row(name: str, values: List[float]) -> str:
+    if not values:
+        return f"{name:<12} {'-':>6}"
+    mean = sum(values) / len(values)
+    return (
+        f"{name:<12} {len(values):>6} {percentile(values, 50):>8.1f} {percentile(values, 90):>8.1f}"
+        f" {percentile(values, 99):>8.1f} {max(values):>8.1f} {mean:>8.1f}"
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="重放渲染记录并报告延迟分位数")
+    parser.add_argument("trace", nargs="?", default=None, help="记录文件，默认使用配置中的 flight_recorder_file")
+    parser.add_argument("-c", "--config", default="config.yaml", help="配置文件路径")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="每条记录重放的次数")
+    parser.add_argument("--kind", choices=("text", "image", "mixed"), default=None, help="只重放指定类型")
+    parser.add_argument("--no-warmup", action="store_true", help="不预先渲染一遍（计入字体加载等冷启动开销）")
+    args = parser.parse_args(argv)
+
+    state = build_state(args.config)
+    path = args.trace or state.config.flight_recorder_file
+    records = [r for r in load_records(path) if args.kind is None or r.kind == args.kind]
+    if not records:
+        print(f"{path} 中没有可重放的记录")
+        return
+
+    current = config_fingerprint(state.config)
+    stale = sum(r.config_fingerprint != current for r in records)
+    if stale:
+        print(f"注意：{stale}/{len(records)} 条记录产生时的配置与当前配置不同")
+
+    with tempfile.TemporaryDirectory(prefix="replay_cache_") as cache_dir:
+        # 不读写真实的磁盘缓存
+        state = state._replace(
+            config=state.config.model_copy(update={"render_cache_dir": cache_dir})
+        )
+        # 预热只为加载字体、生成合成图片
+        if not args.no_warmup:
+            for record in records:
+                replay_one(state, record)
+        replayed, failures = replay_records(state, records, args.repeat)
+
+    recorded: Dict[str, List[float]] = defaultdict(list)
+    for record in records:
+        recorded[record.kind].append(record.render_ms)
+        recorded["全部"].append(record.render_ms)
+
+    header = f"{'类型':<10} {'次数':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'平均':>8}"
+    kinds = [k for k in ("text", "image", "mixed", "全部") if recorded.get(k)]
+    print(f"\n记录时的渲染耗时（毫秒，{len(records)} 条）")
+    print(header)
+    for kind in kinds:
+        print(_row(kind, recorded[kind]))
+    print(f"\n当前代码重放耗时（毫秒，各阶段之和，每条 {args.repeat} 次）")
+    print(header)
+    for kind in kinds:
+        print(_row(kind, replayed[kind]))
+
+    print("\np50 变化")
+    for kind in kinds:
+        before, after = percentile(recorded[kind], 50), percentile(replayed[kind], 50)
+        if before > 0 and replayed[kind]:
+            print(f"{kind:<12} {before:>8.1f} -> {after:>8.1f} ({(after - before) / before:+.0%})")
+    if failures:
+        print(f"\n{failures} 次重放失败")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+# filename: tools/soak.py
+"""
+长时间运行测试：不依赖键盘与剪贴板，按 main.py 的流程连续渲染大量随机消息
+（文字、粘贴图片、图文混排，随机切换差分），模拟剪贴板图片的 DIB 解码与结果转 BMP，
+定期采样 RSS、tracemalloc 与各缓存的占用。
+
+内存持续增长、tracemalloc 统计的增长超出阈值或任何缓存超出声明上限时以非零状态退出，
+并打印与预热后基线相比增长最多的分配位置。
+
+用法：python -m tools.soak [-c config.yaml] [-n 100000] [--sample-every 2000] [--no-tracemalloc]
+"""
+import argparse
+import gc
+import random
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+from typing import Dict, List, NamedTuple, Optional
+
+from PIL import Image
+
+from cache_registry import CacheInfo, cache_report
+from dib_decode import decode_dib
+from hot_reload import RenderState, build_state
+from render_core import render_message
+from shared_assets import memory_usage
+
+MiB = 1024 * 1024
+
+# 随机文本使用的字符：常用汉字、标点、英文单词与括号
+_WORDS = ["hello", "world", "Anan", "sketchbook", "OK", "2024", "lol", "?!"]
+_PUNCT = "，。！？、…～"
+_IMAGE_SIZES = [(64, 64), (320, 240), (512, 512), (800, 600), (1280, 720), (1920, 1080), (300, 1200)]
+
+
+class Sample(NamedTuple):
+    messages: int
+    elapsed: float
+    rss: int
+    traced: int
+
+
+def random_text(rng: random.Random, allow_newline: bool) -> str:
+    parts: List[str] = []
+    for _ in range(rng.randint(1, 40)):
+        r = rng.random()
+        if r < 0.6:
+            parts.append("".join(chr(rng.randint(0x4E00, 0x9FA5)) for _ in range(rng.randint(1, 4))))
+        elif r < 0.75:
+            parts.append(rng.choice(_PUNCT))
+        elif r < 0.9:
+            parts.append(" " + rng.choice(_WORDS) + " ")
+        elif r < 0.97:
+            parts.append("【" + chr(rng.randint(0x4E00, 0x9FA5)) * rng.randint(1, 3) + "】")
+        elif allow_newline:
+            parts.append("\n")
+    return "".join(parts).strip() or "短"
+
+
+def _dib_bytes(img: Image.Image) -> bytes:
+    # 与 copy_png_bytes_to_clipboard 写入剪贴板的格式相同：去掉文件头的 BMP
+    with BytesIO() as output:
+        img.save(output, "BMP")
+        return output.getvalue()[14:]
+
+
+def build_dib_pool(rng: random.Random) -> List[bytes]:
+    """预先生成各种尺寸的剪贴板 DIB 数据，每条消息重新解码，模拟每次新粘贴的图片"""
+    pool = []
+    for size in _IMAGE_SIZES:
+        noise = Image.effect_noise(size, rng.randint(20, 60))
+        gradient = Image.linear_gradient("L").resize(size)
+        rgb = Image.merge("RGB", (noise, gradient, Image.blend(noise, gradient, 0.5)))
+        pool.append(_dib_bytes(rgb))
+    return pool
+
+
+def render(state: RenderState, base_file: str, text: str, image: Optional[Image.Image]) -> bytes:
+    """与热键流程相同的渲染，失败时抛出异常"""
+    png_bytes = render_message(state, base_file, text, image)
+    if png_bytes is None:
+        raise RuntimeError("渲染失败")
+    return png_bytes
+
+
+def to_clipboard_bmp(png_bytes: bytes) -> bytes:
+    """与 main.copy_png_bytes_to_clipboard 相同的格式转换（不写入剪贴板）"""
+    image = Image.open(BytesIO(png_bytes))
+    with BytesIO() as output:
+        image.convert("RGB").save(output, "BMP")
+        return output.getvalue()[14:]
+
+
+def growth_slope(samples: List[Sample]) -> float:
+    """最小二乘拟合 RSS 随消息数的增长速度（字节 / 消息）"""
+    if len(samples) < 2:
+        return 0.0
+    xs = [s.messages for s in samples]
+    ys = [s.rss for s in samples]
+    mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+    var = sum((x - mx) ** 2 for x in xs)
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / var if var else 0.0
+
+
+def _format_cache(info: CacheInfo) -> str:
+    limit = info.max_entries if info.max_entries is not None else "-"
+    text = f"{info.name} {info.entries}/{limit}"
+    if info.bytes is not None:
+        cap = f"{info.max_bytes / MiB:.1f}" if info.max_bytes is not None else "-"
+        text += f" ({info.bytes / MiB:.1f}/{cap} MiB)"
+    return text + (" 超出上限!" if info.over_limit else "")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="长时间连续渲染，检查内存增长与缓存上限")
+    parser.add_argument("-c", "--config", default="config.yaml", help="配置文件路径")
+    parser.add_argument("-n", "--messages", type=int, default=100_000, help="消息总数")
+    parser.add_argument("--warmup", type=int, default=2000, help="预热消息数，之后的采样作为基线")
+    parser.add_argument("--sample-every", type=int, default=2000, help="采样间隔（消息数）")
+    parser.add_argument("--mix", default="6,2,2", help="文字、图片、图文混排的比例")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--max-rss-growth", type=float, default=64.0, help="允许的 RSS 增长（MiB）")
+    parser.add_argument(
+        "--max-slope", type=float, default=1.0, help="允许的 RSS 增长速度（MiB / 1 万条消息，按后一半采样拟合）"
+    )
+    parser.add_argument("--max-traced-growth", type=float, default=16.0, help="允许的 tracemalloc 增长（MiB）")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="不启用 tracemalloc（速度更快）")
+    parser.add_argument("--top", type=int, default=15, help="打印增长最多的分配位置数")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    state = build_state(args.config)
+    config = state.config
+    emotions = list(config.baseimage_mapping.values()) or [config.baseimage_file]
+    allow_newline = config.text_wrap_algorithm != "knuth_plass"
+    weights = [float(w) for w in args.mix.split(",")]
+    dibs = build_dib_pool(rng)
+
+    use_tracemalloc = not args.no_tracemalloc
+    if use_tracemalloc:
+        tracemalloc.start(1)
+
+    samples: List[Sample] = []
+    baseline_snapshot = None
+    over_limit: Dict[str, CacheInfo] = {}
+    start = time.perf_counter()
+
+    def sample(done: int) -> Sample:
+        gc.collect()
+        traced = tracemalloc.get_traced_memory()[0] if use_tracemalloc else 0
+        s = Sample(done, time.perf_counter() - start, memory_usage()["rss"], traced)
+        report = cache_report()
+        for info in report:
+            if info.over_limit:
+                over_limit[info.name] = info
+        rate = done / s.elapsed if s.elapsed else 0.0
+        print(
+            f"{done:>8} 条  {rate:>6.1f} 条/秒  RSS {s.rss / MiB:>7.1f} MiB  "
+            f"tracemalloc {s.traced / MiB:>6.1f} MiB  "
+            + "; ".join(_format_cache(i) for i in report)
+        )
+        return s
+
+    print(f"共 {args.messages} 条消息，预热 {args.warmup} 条，每 {args.sample_every} 条采样一次")
+    for i in range(1, args.messages + 1):
+        kind = rng.choices(("text", "image", "mixed"), weights)[0]
+        text = random_text(rng, allow_newline) if kind != "image" else ""
+        image = decode_dib(rng.choice(dibs)) if kind != "text" else None
+        png_bytes = render(state, rng.choice(emotions), text, image)
+        to_clipboard_bmp(png_bytes)
+
+        if i == args.warmup or (i > args.warmup and i % args.sample_every == 0) or i == args.messages:
+            samples.append(sample(i))
+            if i == args.warmup and use_tracemalloc:
+                baseline_snapshot = tracemalloc.take_snapshot()
+
+    failures: List[str] = []
+    measured = [s for s in samples if s.messages >= args.warmup]
+    if len(measured) >= 2:
+        rss_growth = (measured[-1].rss - measured[0].rss) / MiB
+        print(f"\n预热后 RSS 增长 {rss_growth:.1f} MiB")
+        if rss_growth > args.max_rss_growth:
+            failures.append(f"RSS 增长 {rss_growth:.1f} MiB 超过 {args.max_rss_growth} MiB")
+        # 缓存填满之前的增长是正常的，只用后一半采样判断是否仍在持续增长
+        tail = measured[len(measured) // 2 :]
+        if len(tail) >= 3:
+            slope = growth_slope(tail) * 10_000 / MiB
+            print(f"后半程 RSS 增长速度 {slope:.2f} MiB / 1 万条")
+            if slope > args.max_slope:
+                failures.append(f"RSS 增长速度 {slope:.2f} MiB / 1 万条超过 {args.max_slope}")
+        else:
+            print("采样过少，跳过增长速度检查")
+        if use_tracemalloc:
+            traced_growth = (measured[-1].traced - measured[0].traced) / MiB
+            print(f"预热后 tracemalloc 增长 {traced_growth:.1f} MiB")
+            if traced_growth > args.max_traced_growth:
+                failures.append(f"tracemalloc 增长 {traced_growth:.1f} MiB 超过 {args.max_traced_growth} MiB")
+    for info in over_limit.values():
+        failures.append(f"缓存 {_format_cache(info)}")
+
+    if baseline_snapshot is not None:
+        diff = tracemalloc.take_snapshot().compare_to(baseline_snapshot, "lineno")
+        print(f"\n与预热后基线相比增长最多的 {args.top} 个分配位置：")
+        for stat in diff[: args.top]:
+            print(f"  {stat}")
+
+    if failures:
+        print("\n失败：")
+        for f in failures:
+            print(f"  {f}")
+        sys.exit(1)
+    print("\n通过")
+
+
+if __name__ == "__main__":
+    main()
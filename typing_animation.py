@@ -0,0 +1,282 @@
+# filename: typing_animation.py
+import os
+import struct
+import zlib
+from io import BytesIO
+from typing import Iterator, List, Literal, Optional, Tuple, Union
+
+from PIL import Image, ImageChops, ImageDraw
+
+from text_fit_draw import (
+    Align,
+    FontSpec,
+    RGBColor,
+    VAlign,
+    _load_font,
+    draw_text_with,
+    layout_text,
+    text_runs,
+)
+
+AnimationFormat = Literal["PNG", "GIF"]
+ANIMATION_FORMATS = ("PNG", "GIF")
+Rect = Tuple[int, int, int, int]
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _reveal_steps(seg_text: str) -> List[int]:
+    """
+    同色片段逐字出现时每一步绘制的前缀长度：每个非空白字符一步，
+    最后一步绘制整个片段，保证结束时与整段绘制完全相同。
+    """
+    steps = [i + 1 for i, ch in enumerate(seg_text) if not ch.isspace()]
+    if steps:
+        steps[-1] = len(seg_text)
+    return steps
+
+
+def _pen_offset(font, seg_text: str, i: int) -> float:
+    """整段绘制 seg_text 时第 i 个字符的起笔位置（相对片段起点，包含与前一字符的字距调整）"""
+    if i == 0:
+        return 0.0
+    return font.getlength(seg_text[: i + 1]) - font.getlength(seg_text[i])
+
+
+def _clip(box: Tuple[float, float, float, float], bounds: Rect, margin: int) -> Rect:
+    return (
+        max(bounds[0], int(box[0]) - margin),
+        max(bounds[1], int(box[1]) - margin),
+        min(bounds[2], int(box[2]) + 1 + margin),
+        min(bounds[3], int(box[3]) + 1 + margin),
+    )
+
+
+def _union(a: Optional[Rect], b: Rect) -> Rect:
+    if a is None:
+        return b
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+    )
+
+
+def _png_chunks(img: Image.Image) -> Iterator[Tuple[bytes, bytes]]:
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    data = buf.getvalue()
+    pos = len(_PNG_SIGNATURE)
+    while pos < len(data):
+        (length,) = struct.unpack_from(">I", data, pos)
+        kind = data[pos + 4 : pos + 8]
+        yield kind, data[pos + 8 : pos + 8 + length]
+        pos += 12 + length
+
+
+def _fctl(seq: int, rect: Rect, delay_ms: int) -> bytes:
+    x0, y0, x1, y1 = rect
+    # dispose_op=0 (保留), blend_op=0 (直接覆盖该区域)
+    return _chunk(
+        b"fcTL",
+        struct.pack(">IIIIIHHBB", seq, x1 - x0, y1 - y0, x0, y0, delay_ms, 1000, 0, 0),
+    )
+
+
+def _write_apng(
+    first: Image.Image,
+    deltas: List[Tuple[Rect, Image.Image]],
+    durations: List[int],
+    loop: int,
+) -> bytes:
+    """
+    写出 APNG：首帧为完整图像，其余各帧只编码变化区域（fcTL 偏移 + fdAT）。
+    """
+    out = BytesIO()
+    out.write(_PNG_SIGNATURE)
+    seq = 0
+    idat: List[bytes] = []
+    for kind, data in _png_chunks(first):
+        if kind == b"IHDR":
+            out.write(_chunk(kind, data))
+            out.write(_chunk(b"acTL", struct.pack(">II", len(deltas) + 1, loop)))
+            out.write(_fctl(seq, (0, 0) + first.size, durations[0]))
+            seq += 1
+        elif kind == b"IDAT":
+            idat.append(data)
+        elif kind == b"IEND":
+            out.write(_chunk(b"IDAT", b"".join(idat)))
+    for (rect, patch), delay in zip(deltas, durations[1:]):
+        out.write(_fctl(seq, rect, delay))
+        seq += 1
+        data = b"".join(d for kind, d in _png_chunks(patch) if kind == b"IDAT")
+        out.write(_chunk(b"fdAT", struct.pack(">I", seq) + data))
+        seq += 1
+    out.write(_chunk(b"IEND", b""))
+    return out.getvalue()
+
+
+def draw_text_typing(
+    image_source: Union[str, Image.Image],
+    top_left: Tuple[int, int],
+    bottom_right: Tuple[int, int],
+    text: str,
+    color: RGBColor = (0, 0, 0),
+    max_font_height: Optional[int] = None,
+    font_path: FontSpec = None,
+    align: Align = "center",
+    valign: VAlign = "middle",
+    line_spacing: float = 0.15,
+    bracket_color: RGBColor = (128, 0, 128),
+    image_overlay: Union[str, Image.Image, None] = None,
+    wrap_algorithm: str = "original",
+    frame_format: AnimationFormat = "PNG",
+    chars_per_frame: int = 1,
+    frame_duration: int = 60,
+    hold_duration: int = 2000,
+    loop: int = 0,
+) -> bytes:
+    """
+    生成文字逐字出现的动图（APNG 或 GIF）。
+
+    排版只按最终文本计算一次；每一帧只在新字符的起笔位置（按前缀计算，包含字距调整）绘制新字符，
+    并只编码这些字符覆盖的矩形区域；每个同色片段的最后一步整段重绘一次，
+    因此整段动画的开销接近一次静态渲染加若干小块增量。
+    最后一帧与相同参数的 draw_text_auto 结果完全相同。
+
+    : param frame_format: "PNG" 输出 APNG（逐帧只写变化区域），"GIF" 输出 GIF
+    : param chars_per_frame: 每帧新出现的字符数
+    : param frame_duration: 每帧时长（毫秒）
+    : param hold_duration: 最后一帧停留时长（毫秒）
+    : param loop: 循环次数，0 表示无限循环
+
+    返回：动图的 bytes。
+    """
+    if chars_per_frame < 1:
+        raise ValueError("chars_per_frame 必须大于 0。")
+    if frame_format not in ANIMATION_FORMATS:
+        raise ValueError(f"不支持的动图格式: {frame_format}，可用：{'、'.join(ANIMATION_FORMATS)}")
+
+    if isinstance(image_source, Image.Image):
+        canvas = image_source.convert("RGBA")
+    else:
+        canvas = Image.open(image_source).convert("RGBA")
+
+    if image_overlay is not None:
+        if isinstance(image_overlay, Image.Image):
+            img_overlay = image_overlay.convert("RGBA")
+        else:
+            img_overlay = (
+                Image.open(image_overlay).convert("RGBA")
+                if os.path.isfile(image_overlay)
+                else None
+            )
+        if img_overlay is None:
+            print("Warning: overlay image is not exist.")
+    else:
+        img_overlay = None
+
+    layout = layout_text(
+        ImageDraw.Draw(canvas),
+        top_left,
+        bottom_right,
+        text,
+        max_font_height=max_font_height,
+        font_path=font_path,
+        line_spacing=line_spacing,
+        wrap_algorithm=wrap_algorithm,
+    )
+    font = _load_font(font_path, layout.font_size)
+
+    def composed(rect: Rect) -> Image.Image:
+        # 取出画布上的矩形区域并叠加对应位置的置顶图层
+        patch = canvas.crop(rect)
+        if img_overlay is not None:
+            ov = img_overlay.crop(rect)
+            patch.paste(ov, (0, 0), ov)
+        return patch
+
+    first = composed((0, 0) + canvas.size)
+    draw = ImageDraw.Draw(canvas)
+    bounds = (0, 0) + canvas.size
+
+    deltas: List[Tuple[Rect, Image.Image]] = []
+    pending: Optional[Rect] = None
+    count = 0
+    for x, y, seg_text, fill in text_runs(draw, layout, font, color, align, valign, bracket_color):
+        steps = _reveal_steps(seg_text)
+        if not steps:
+            continue
+        # 每一步只绘制新出现的字符，位置按片段前缀的字距计算；
+        # 最后一步恢复片段区域后整段重绘一次，结束时与静态渲染逐像素相同
+        # （逐字绘制时相邻字形重叠处的混合与整段绘制略有差异）
+        box = _clip(draw.textbbox((x, y), seg_text, font=font), bounds, 2)
+        if box[2] <= box[0] or box[3] <= box[1]:
+            continue
+        clean = canvas.crop(box)
+        prev = 0
+        for end in steps[:-1]:
+            piece = seg_text[prev:end]
+            gx = x + _pen_offset(font, seg_text, prev)
+            draw_text_with(draw, (gx, y), piece, font, fill)
+            rect: Optional[Rect] = _clip(draw.textbbox((gx, y), piece, font=font), bounds, 1)
+            prev = end
+            if rect[2] <= rect[0] or rect[3] <= rect[1]:
+                continue
+            pending = _union(pending, rect)
+            count += 1
+            if count % chars_per_frame == 0:
+                deltas.append((pending, composed(pending)))
+                pending = None
+        before = canvas.crop(box)
+        canvas.paste(clean, box[:2])
+        draw_text_with(draw, (x, y), seg_text, font, fill)
+        changed = ImageChops.difference(before, canvas.crop(box)).getbbox(alpha_only=False)
+        if changed is None:
+            continue
+        pending = _union(
+            pending,
+            (box[0] + changed[0], box[1] + changed[1], box[0] + changed[2], box[1] + changed[3]),
+        )
+        count += 1
+        if count % chars_per_frame == 0:
+            deltas.append((pending, composed(pending)))
+            pending = None
+    if pending is not None:
+        deltas.append((pending, composed(pending)))
+
+    durations = [frame_duration] * (len(deltas) + 1)
+    durations[-1] = hold_duration
+
+    if frame_format == "PNG":
+        return _write_apng(first, deltas, durations, loop)
+
+    # GIF 不支持带偏移的局部帧：用最终画面生成统一调色板，只对变化区域量化后贴入上一帧，
+    # 相邻帧之间只有这些区域不同，Pillow 编码时会按差异裁剪
+    palette = composed(bounds).convert("RGB").quantize(colors=256)
+
+    def to_palette(im: Image.Image) -> Image.Image:
+        return im.convert("RGB").quantize(palette=palette, dither=Image.Dither.NONE)
+
+    frame = to_palette(first)
+    frames = [frame]
+    for rect, patch in deltas:
+        frame = frame.copy()
+        frame.paste(to_palette(patch), rect[:2])
+        frames.append(frame)
+    buf = BytesIO()
+    frames[0].save(
+        buf,
+        format="GIF",
+        save_all=True,
+        append_images=frames[1:],
+        duration=durations,
+        loop=loop,
+        optimize=False,  # 调色板已统一，跳过逐帧的调色板重排
+    )
+    return buf.getvalue()